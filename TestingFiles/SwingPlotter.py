@@ -1,29 +1,153 @@
-import serial
+import argparse
 import matplotlib.pyplot as plt
 import matplotlib.animation as animation
-from collections import deque
 import numpy as np
 import datetime
 import signal
 import sys
+import threading
+import time
 
-# Serial setup
-ser = serial.Serial('COM3', 115200)
+from data_sources import open_source
+from recording import RecordingWriter
+
+parser = argparse.ArgumentParser(description='Real-time swing speed plotter')
+parser.add_argument('--port', default='COM3', help='Serial port (default: COM3)')
+parser.add_argument('--baudrate', type=int, default=115200, help='Baud rate (default: 115200)')
+parser.add_argument('--replay', metavar='FILE',
+                   help='Replay a swing recording, CSV file or serial log instead of reading the serial port')
+parser.add_argument('--speed', type=float, default=1.0,
+                   help='Replay speed, 1 for real-time, N for N times faster, 0 for as fast as possible (default: 1)')
+parser.add_argument('--headless', action='store_true',
+                   help='Render frames off-screen until the replay ends, then report ingestion and frame rates')
+args = parser.parse_args()
+
+if args.headless:
+    plt.switch_backend('Agg')
+
+# Serial setup (or replay), the timeout lets the reader thread check whether it should stop
+ser = open_source(args.port, args.baudrate, timeout=0.1, replay=args.replay, speed=args.speed, kind='swing')
 ser.flush()
 
 # Constants
 threshold = 0.70
 max_live_points = 300
+max_live_speed = 2.0
+refresh_ms = 33  # ~30 fps
+session_chunk_size = 65536
+
+
+class SampleRing:
+    """Preallocated ring buffers holding the most recent samples for the live plot.
+    Written by the reader thread, and copied out in order by the UI thread"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.times = np.zeros(capacity, dtype=np.uint32)
+        self.speeds = np.zeros(capacity, dtype=np.float32)
+        self.swings = np.zeros(capacity, dtype=bool)
+        self.count = 0  # total samples ever written
+        self.lock = threading.Lock()
+
+    def append(self, time_ms, speed, is_swing):
+        with self.lock:
+            i = self.count % self.capacity
+            self.times[i] = time_ms
+            self.speeds[i] = speed
+            self.swings[i] = is_swing
+            self.count += 1
+
+    def snapshot(self):
+        # Returns copies of (times, speeds, swings), oldest sample first
+        with self.lock:
+            if self.count <= self.capacity:
+                n = self.count
+                return self.times[:n].copy(), self.speeds[:n].copy(), self.swings[:n].copy()
+            start = self.count % self.capacity
+            order = np.r_[start:self.capacity, 0:start]
+            return self.times[order], self.speeds[order], self.swings[order]
+
+
+class SessionRecorder:
+    """Keeps every sample of the session (for saving) in fixed size NumPy chunks, about 9 bytes per sample.
+    A full chunk is never copied again, a new one is allocated instead"""
+
+    def __init__(self, chunk_size=session_chunk_size):
+        self.chunk_size = chunk_size
+        self.chunks = []
+        self.fill = chunk_size  # samples used in the last chunk, full so the first append allocates one
+        self.lock = threading.Lock()
+
+    def append(self, time_ms, speed, is_swing):
+        with self.lock:
+            if self.fill == self.chunk_size:
+                self.chunks.append((np.empty(self.chunk_size, dtype=np.uint32),
+                                    np.empty(self.chunk_size, dtype=np.float32),
+                                    np.empty(self.chunk_size, dtype=bool)))
+                self.fill = 0
+            chunk_times, chunk_speeds, chunk_swings = self.chunks[-1]
+            chunk_times[self.fill] = time_ms
+            chunk_speeds[self.fill] = speed
+            chunk_swings[self.fill] = is_swing
+            self.fill += 1
+
+    def __len__(self):
+        return max(0, len(self.chunks) - 1) * self.chunk_size + (self.fill if self.chunks else 0)
+
+    def arrays(self):
+        # Returns the whole session as (times, speeds, swings) arrays
+        with self.lock:
+            if not self.chunks:
+                return np.empty(0, np.uint32), np.empty(0, np.float32), np.empty(0, bool)
+            parts = self.chunks[:-1] + [tuple(array[:self.fill] for array in self.chunks[-1])]
+            return tuple(np.concatenate([part[i] for part in parts]) for i in range(3))
+
+
+class SerialReader(threading.Thread):
+    """Reads and parses "time_ms,speed,is_swing" lines from the serial port on its own thread,
+    so the plot never waits on the port. Stops by itself at the end of a replay"""
+
+    def __init__(self, port, live, session):
+        super().__init__(daemon=True)
+        self.port = port
+        self.live = live
+        self.session = session
+        self.stop_event = threading.Event()
 
-# Live plot buffers
-times = deque(maxlen=max_live_points)
-speeds = deque(maxlen=max_live_points)
-swing_flags = deque(maxlen=max_live_points)
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                line_raw = self.port.readline()
+            except OSError as e:
+                print(f"Serial read failed: {e}")
+                break
+            if not line_raw:
+                if getattr(self.port, 'exhausted', False):
+                    break
+                continue  # timed out waiting for data
 
-# Full session buffers (for saving)
-full_times = []
-full_speeds = []
-full_swings = []
+            try:
+                parts = line_raw.decode('utf-8').strip().split(',')
+                if len(parts) >= 3:
+                    time_ms = int(parts[0])
+                    speed = float(parts[1])
+                    is_swing = parts[2] == "1"
+
+                    self.live.append(time_ms, speed, is_swing)
+                    self.session.append(time_ms, speed, is_swing)
+
+            except Exception as e:
+                print(f"Error parsing line: {e}")
+
+    def stop(self):
+        self.stop_event.set()
+        self.join()
+
+
+# Live plot buffers and full session buffers (for saving)
+live = SampleRing(max_live_points)
+session = SessionRecorder()
+reader = SerialReader(ser, live, session)
 
 # Setup live plot
 fig, ax = plt.subplots()
@@ -31,67 +155,54 @@ line, = ax.plot([], [], label='Swing Speed')
 threshold_line = ax.axhline(y=threshold, color='r', linestyle='--', label='Threshold')
 scatter = ax.scatter([], [], color='green', label='Detected Swings', zorder=5)
 
+# Fixed axes, so blitting only redraws the line and swing markers, never the axes
 ax.set_xlim(0, max_live_points)
-ax.set_ylim(0, 2)
+ax.set_ylim(0, max_live_speed)
 ax.set_xlabel("Time (index)")
 ax.set_ylabel("Swing Speed (m/s)")
 ax.set_title("Real-Time Swing Speed")
 ax.legend()
 plt.tight_layout()
 
-# Function to update live plot
+# Sample indexes of the live window, shared by every frame
+live_x = np.arange(max_live_points)
+last_count = -1
+
+def init_plot():
+    # Blank frame for blitting, everything else is the cached background
+    line.set_data([], [])
+    scatter.set_offsets(np.empty((0, 2)))
+    return line, scatter
+
+# Function to update live plot, from the samples the reader thread has collected so far
 def update(frame):
-    while ser.in_waiting:
-        try:
-            line_raw = ser.readline().decode('utf-8').strip()
-            parts = line_raw.split(',')
-            if len(parts) >= 3:
-                time_ms = int(parts[0])
-                speed = float(parts[1])
-                is_swing = parts[2] == "1"
-
-                # Live plot storage
-                times.append(time_ms)
-                speeds.append(speed)
-                swing_flags.append(is_swing)
-
-                # Full storage
-                full_times.append(time_ms)
-                full_speeds.append(speed)
-                full_swings.append(is_swing)
-
-        except Exception as e:
-            print(f"Error parsing line: {e}")
-            continue
-
-    # Update line
-    line.set_data(range(len(speeds)), speeds)
-
-    # Update scatter points
-    # Replace the original scatter.set_offsets() line with this:
-    scatter_data = np.array([
-        (i, s) for i, (s, flag) in enumerate(zip(speeds, swing_flags)) if flag
-    ])
-    if len(scatter_data) == 0:
-        scatter_data = np.empty((0, 2))  # Ensure 2D array when empty
-
-    scatter.set_offsets(scatter_data)
-
-    ax.set_xlim(0, max(len(speeds), max_live_points))
+    global last_count
+
+    # Nothing to redraw if no samples arrived since the last frame
+    if live.count == last_count:
+        return line, scatter
+    last_count = live.count
+
+    times, speeds, swing_flags = live.snapshot()
+    x = live_x[:len(speeds)]
+
+    # Update line and detected swing points
+    line.set_data(x, speeds)
+    scatter.set_offsets(np.column_stack((x[swing_flags], speeds[swing_flags])))
     return line, scatter
 
 # Save and close logic
 def save_and_exit(sig=None, frame=None):
     print("\nExiting and saving full session graph...")
+    reader.stop()
+    full_times, full_speeds, full_swings = session.arrays()
 
     fig2, ax2 = plt.subplots()
     ax2.plot(full_times, full_speeds, label='Swing Speed')
     ax2.axhline(y=threshold, color='r', linestyle='--', label='Threshold')
 
     # Plot detected swings
-    swing_x = [t for t, s in zip(full_times, full_swings) if s]
-    swing_y = [v for v, s in zip(full_speeds, full_swings) if s]
-    ax2.scatter(swing_x, swing_y, color='green', label='Detected Swings', zorder=5)
+    ax2.scatter(full_times[full_swings], full_speeds[full_swings], color='green', label='Detected Swings', zorder=5)
 
     ax2.set_title("Full Session Swing Speed")
     ax2.set_xlabel("Time (ms)")
@@ -105,14 +216,47 @@ def save_and_exit(sig=None, frame=None):
     plt.savefig(filename)
     print(f"Saved as {filename}")
 
+    # Save the samples as a binary recording, for offline analysis (see recording.py)
+    if len(full_times):
+        recording_name = f"swing_session_{now}.rec"
+        with RecordingWriter(recording_name, 'swing', meta={'source': 'SwingPlotter.py', 'threshold': threshold}) as recording:
+            recording.append(time_ms=full_times, speed=full_speeds, is_swing=full_swings)
+        print(f"Recording saved as {recording_name}")
+
     ser.close()
     plt.close('all')
     sys.exit(0)
 
+# Render frames off-screen as fast as possible while a replay is read, the same way blitting does
+# (draw the background once, then only the line and swing markers), to measure ingestion and rendering throughput
+def run_headless():
+    fig.canvas.draw()
+    background = fig.canvas.copy_from_bbox(ax.bbox)
+    init_plot()
+
+    frames = 0
+    start = time.perf_counter()
+    reader.start()
+    while reader.is_alive():
+        fig.canvas.restore_region(background)
+        for artist in update(frames):
+            ax.draw_artist(artist)
+        fig.canvas.blit(ax.bbox)
+        frames += 1
+    elapsed = time.perf_counter() - start
+
+    print(f"Ingested {len(session):,} samples in {elapsed:.2f}s ({len(session) / elapsed:,.0f} samples/s)")
+    print(f"Rendered {frames:,} frames ({frames / elapsed:,.1f} fps)")
+    save_and_exit()
+
 # Handle Ctrl+C and regular closing
 signal.signal(signal.SIGINT, save_and_exit)
 fig.canvas.mpl_connect('close_event', save_and_exit)
 
-# Start animation
-ani = animation.FuncAnimation(fig, update, interval=100)
+# Start reading and animation
+if args.headless:
+    run_headless()
+
+reader.start()
+ani = animation.FuncAnimation(fig, update, init_func=init_plot, interval=refresh_ms, blit=True, cache_frame_data=False)
 plt.show()
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Plotter Data Sources
+Pluggable sources of serial data for SwingPlotter.py and latency_plotter.py: a real serial port, or a replay of a
+recorded session that behaves like one (read, readline, in_waiting), so the plotters run without hardware.
+
+Replays regenerate the lines the device prints over serial from a .rec recording or CSV file (see recording.py),
+at their recorded pace (speed=1), N times faster (speed=N), or as fast as the reader consumes them (speed=0).
+Raw serial logs (one device line per line) can be replayed too, at a fixed line rate.
+
+Usage:
+    python data_sources.py session.rec --speed 0     # measure replay throughput
+"""
+
+import argparse
+import itertools
+import threading
+import time
+
+from recording import is_recording, iter_chunks, open_recording
+
+# Lines each kind of record is printed as by the device, for a chunk of records
+LINE_FORMATS = {
+    'latency': lambda chunk: [f"Latency: {latency} microseconds\r\n" for latency in chunk['latency_us'].tolist()],
+    'swing': lambda chunk: [f"{time_ms},{speed:.2f},{is_swing}\r\n" for time_ms, speed, is_swing
+                            in zip(chunk['time_ms'].tolist(), chunk['speed'].tolist(), chunk['is_swing'].tolist())],
+}
+
+# Sample time of each kind of record, in microseconds
+RECORD_TIMES = {
+    'latency': lambda chunk: chunk['timestamp_us'].astype('int64'),
+    'swing': lambda chunk: chunk['time_ms'].astype('int64') * 1000,
+}
+
+def open_source(port=None, baudrate=115200, timeout=0.1, replay=None, speed=1.0, kind='latency', line_rate=100.0):
+    """Open a serial port, or a replay of a recorded session if replay is set.
+    pyserial is only imported for real ports, so replays work without it"""
+    if replay:
+        return ReplaySource(replay, kind, speed, timeout, line_rate)
+    if not port:
+        raise ValueError("A serial port or a replay file is required")
+
+    import serial
+    return serial.Serial(port, baudrate, timeout=timeout)
+
+class ReplaySource:
+    """Replays a recording, CSV file or raw serial log as a pseudo serial port.
+    A producer thread releases lines into a buffer as their (scaled) time comes, and read/readline block like
+    a serial port with a timeout. The producer pauses while more than max_buffered bytes are waiting"""
+
+    def __init__(self, path, kind='latency', speed=1.0, timeout=0.1, line_rate=100.0, chunk_size=10_000, max_buffered=1 << 20):
+        self.path = path
+        self.kind = kind
+        self.speed = speed
+        self.timeout = timeout
+        self.line_rate = line_rate
+        self.chunk_size = chunk_size
+        self.max_buffered = max_buffered
+
+        self.port = f"replay:{path}"
+        self.is_open = True
+        self.finished = False
+        self.lines_sent = 0
+        self.bytes_sent = 0
+        self.start_time = None
+        self.end_time = None
+
+        self.buffer = bytearray()
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.produce, daemon=True)
+        self.thread.start()
+
+    def line_batches(self):
+        # Yield (times in microseconds, lines) batches from the file
+        if is_recording(self.path) or not self.path.lower().endswith(('.txt', '.log')):
+            if is_recording(self.path):
+                self.kind = open_recording(self.path).kind
+            for chunk in iter_chunks(self.path, self.kind, self.chunk_size):
+                yield RECORD_TIMES[self.kind](chunk).tolist(), LINE_FORMATS[self.kind](chunk)
+        else:
+            # Raw serial logs have no times, lines are spaced evenly at line_rate
+            interval = 1e6 / self.line_rate
+            with open(self.path, 'rb') as file:
+                counter = itertools.count()
+                while True:
+                    lines = [line.rstrip(b'\r\n').decode('utf-8', errors='ignore') + '\r\n' for line in itertools.islice(file, self.chunk_size)]
+                    if not lines:
+                        break
+                    yield [int(next(counter) * interval) for _ in lines], lines
+
+    def produce(self):
+        self.start_time = time.perf_counter()
+        first_time = None
+        try:
+            for times, lines in self.line_batches():
+                if first_time is None and times:
+                    first_time = times[0]
+
+                i = 0
+                while i < len(lines) and self.is_open:
+                    # Release every line whose replay time has come (all of them when replaying as fast as possible)
+                    if self.speed > 0:
+                        now = (time.perf_counter() - self.start_time) * self.speed * 1e6 + first_time
+                        end = i
+                        while end < len(lines) and times[end] <= now:
+                            end += 1
+                        if end == i:
+                            time.sleep(min((times[i] - now) / self.speed / 1e6, 0.05))
+                            continue
+                    else:
+                        end = len(lines)
+
+                    data = ''.join(lines[i:end]).encode('utf-8')
+                    with self.condition:
+                        while len(self.buffer) > self.max_buffered and self.is_open:
+                            self.condition.wait(0.1)
+                        self.buffer += data
+                        self.lines_sent += end - i
+                        self.bytes_sent += len(data)
+                        self.condition.notify_all()
+                    i = end
+
+                if not self.is_open:
+                    break
+        finally:
+            with self.condition:
+                self.finished = True
+                self.end_time = time.perf_counter()
+                self.condition.notify_all()
+
+    @property
+    def in_waiting(self):
+        return len(self.buffer)
+
+    def read(self, size=1):
+        """Read up to size bytes, waiting up to the timeout for them to arrive"""
+        deadline = time.monotonic() + (self.timeout or 0)
+        with self.condition:
+            while len(self.buffer) < size and not self.finished and self.is_open:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            data = bytes(self.buffer[:size])
+            del self.buffer[:size]
+            self.condition.notify_all()
+            return data
+
+    def readline(self):
+        """Read one line (including the newline), or whatever arrived before the timeout"""
+        deadline = time.monotonic() + (self.timeout or 0)
+        with self.condition:
+            while b'\n' not in self.buffer and not self.finished and self.is_open:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            end = self.buffer.find(b'\n') + 1 or len(self.buffer)
+            data = bytes(self.buffer[:end])
+            del self.buffer[:end]
+            self.condition.notify_all()
+            return data
+
+    @property
+    def exhausted(self):
+        """True once the whole file has been replayed and read"""
+        return self.finished and not self.buffer
+
+    def flush(self):
+        pass
+
+    def close(self):
+        with self.condition:
+            self.is_open = False
+            self.condition.notify_all()
+        self.thread.join()
+
+    def stats(self):
+        """Lines and bytes replayed so far, and the replay rate"""
+        elapsed = ((self.end_time or time.perf_counter()) - self.start_time) if self.start_time else 0.0
+        return {
+            'lines': self.lines_sent,
+            'bytes': self.bytes_sent,
+            'seconds': elapsed,
+            'lines_per_second': self.lines_sent / elapsed if elapsed else 0.0,
+        }
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a recorded session and measure how fast it can be read')
+    parser.add_argument('file', help='Recording (.rec), CSV file, or raw serial log (.txt/.log)')
+    parser.add_argument('--kind', choices=sorted(LINE_FORMATS), default='latency',
+                       help='Kind of CSV file (recordings know their own kind, default: latency)')
+    parser.add_argument('--speed', type=float, default=0,
+                       help='Replay speed, 1 for real-time, N for N times faster, 0 for as fast as possible (default: 0)')
+    args = parser.parse_args()
+
+    source = ReplaySource(args.file, args.kind, args.speed)
+    lines = 0
+    while not source.exhausted:
+        lines += source.read(source.in_waiting or 1).count(b'\n')
+    source.close()
+
+    stats = source.stats()
+    print(f"Replayed {lines:,} lines ({stats['bytes']:,} bytes) in {stats['seconds']:.2f}s: {stats['lines_per_second']:,.0f} lines/s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+"""
+BLE Latency Analysis
+Offline analysis of latency sessions recorded by latency_plotter.py (CSV files or .rec recordings).
+Files are processed in chunks, so memory use stays bounded for sessions with tens of millions of samples.
+
+Reports percentiles, jitter, a histogram and CDF, gaps with estimated dropped samples, and per-window trends,
+with several sessions compared side by side (e.g. two firmware builds of TestBLE.ino).
+
+Usage:
+    python latency_analysis.py old_build.rec new_build.csv --window 300 --json results.json --plot results.png
+"""
+
+import argparse
+import json
+import math
+import os
+import sys
+from collections import Counter
+
+import numpy as np
+
+from recording import RecordingError, iter_chunks
+
+# Latencies below this many microseconds are counted in a dense array (8 MB), larger ones in a sparse counter,
+# so every percentile is exact
+DENSE_LIMIT = 1 << 20
+
+REPORT_PERCENTILES = (50, 90, 95, 99, 99.9)
+
+class LatencyAnalyzer:
+    """Accumulates the statistics of one session, one chunk of (timestamps, latencies) at a time"""
+
+    def __init__(self, name, window_seconds=60, gap_factor=3.0, interval_us=None):
+        self.name = name
+        self.window_us = int(window_seconds * 1e6)
+        self.gap_factor = gap_factor
+        self.interval_us = interval_us
+
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+        self.first_time = None
+        self.last_time = None
+        self.last_latency = None
+
+        # Exact latency distribution
+        self.dense_counts = np.zeros(DENSE_LIMIT, dtype=np.int64)
+        self.sparse_counts = Counter()
+
+        # Jitter: differences between consecutive latencies
+        self.diff_count = 0
+        self.diff_abs_sum = 0.0
+        self.diff_abs_max = 0
+
+        # Gaps between arrivals longer than gap_factor times the expected interval
+        self.gaps = []  # (start time, length) of the longest gaps
+        self.gap_count = 0
+        self.gap_total_us = 0
+        self.dropped_estimate = 0
+
+        # Per-window count, sum, sum of squares, min, max, keyed by window index
+        self.windows = {}
+
+    def add(self, timestamps, latencies):
+        if len(latencies) == 0:
+            return
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        latencies = np.asarray(latencies, dtype=np.int64)
+        values = latencies.astype(np.float64)
+
+        # Mean and variance, merging the chunk into the running values (Chan et al.'s parallel form of Welford's algorithm)
+        n = len(values)
+        chunk_mean = values.mean()
+        chunk_m2 = ((values - chunk_mean) ** 2).sum()
+        delta = chunk_mean - self.mean
+        total = self.count + n
+        self.mean += delta * n / total
+        self.m2 += chunk_m2 + delta * delta * self.count * n / total
+        self.count = total
+        self.min = int(latencies.min()) if self.min is None else min(self.min, int(latencies.min()))
+        self.max = int(latencies.max()) if self.max is None else max(self.max, int(latencies.max()))
+
+        # Distribution
+        dense = latencies < DENSE_LIMIT
+        self.dense_counts += np.bincount(latencies[dense], minlength=DENSE_LIMIT)
+        if not dense.all():
+            values, counts = np.unique(latencies[~dense], return_counts=True)
+            self.sparse_counts.update(dict(zip(values.tolist(), counts.tolist())))
+
+        # Jitter, continuing from the last latency of the previous chunk
+        previous = latencies[:1] if self.last_latency is None else np.array([self.last_latency])
+        diffs = np.abs(np.diff(np.concatenate((previous, latencies))))
+        if self.last_latency is None:
+            diffs = diffs[1:]
+        self.diff_count += len(diffs)
+        self.diff_abs_sum += float(diffs.sum())
+        if len(diffs):
+            self.diff_abs_max = max(self.diff_abs_max, int(diffs.max()))
+
+        # Gaps, continuing from the last timestamp of the previous chunk. Sessions recorded before latency_plotter.py
+        # spread the samples of a read over the time since the previous read have batches sharing one timestamp,
+        # so only the intervals between distinct timestamps are considered
+        times = timestamps if self.last_time is None else np.concatenate(([self.last_time], timestamps))
+        intervals = np.diff(times)
+        starts = times[:-1]
+        positive = intervals > 0
+        intervals, starts = intervals[positive], starts[positive]
+        if self.interval_us is None and len(intervals):
+            self.interval_us = float(np.median(intervals))
+        if self.interval_us:
+            gap = intervals > self.gap_factor * self.interval_us
+            if gap.any():
+                self.gap_count += int(gap.sum())
+                self.gap_total_us += int(intervals[gap].sum())
+                self.dropped_estimate += int(np.maximum(np.round(intervals[gap] / self.interval_us) - 1, 0).sum())
+                self.gaps.extend(zip(starts[gap].tolist(), intervals[gap].tolist()))
+                self.gaps = sorted(self.gaps, key=lambda gap: -gap[1])[:20]
+
+        # Windows
+        window_ids = timestamps // self.window_us
+        unique_ids, inverse = np.unique(window_ids, return_inverse=True)
+        counts = np.bincount(inverse)
+        sums = np.bincount(inverse, weights=latencies)
+        squares = np.bincount(inverse, weights=latencies.astype(np.float64) ** 2)
+        minimums = np.full(len(unique_ids), np.iinfo(np.int64).max)
+        maximums = np.zeros(len(unique_ids), dtype=np.int64)
+        np.minimum.at(minimums, inverse, latencies)
+        np.maximum.at(maximums, inverse, latencies)
+        for i, window_id in enumerate(unique_ids.tolist()):
+            window = self.windows.get(window_id)
+            if window is None:
+                self.windows[window_id] = [int(counts[i]), float(sums[i]), float(squares[i]), int(minimums[i]), int(maximums[i])]
+            else:
+                window[0] += int(counts[i])
+                window[1] += float(sums[i])
+                window[2] += float(squares[i])
+                window[3] = min(window[3], int(minimums[i]))
+                window[4] = max(window[4], int(maximums[i]))
+
+        if self.first_time is None:
+            self.first_time = int(timestamps[0])
+        self.last_time = int(timestamps[-1])
+        self.last_latency = int(latencies[-1])
+
+    def percentiles(self, qs):
+        """Exact percentiles (the smallest latency with at least q% of samples at or below it)"""
+        if not self.count:
+            return {q: None for q in qs}
+        cumulative = np.cumsum(self.dense_counts)
+        dense_total = int(cumulative[-1])
+        sparse_values = sorted(self.sparse_counts)
+        sparse_cumulative = np.cumsum([self.sparse_counts[value] for value in sparse_values])
+
+        results = {}
+        for q in qs:
+            rank = max(1, math.ceil(q / 100 * self.count))
+            if rank <= dense_total:
+                results[q] = int(np.searchsorted(cumulative, rank))
+            else:
+                results[q] = sparse_values[int(np.searchsorted(sparse_cumulative, rank - dense_total))]
+        return results
+
+    def count_at_or_below(self, edges):
+        # Number of samples at or below each edge
+        cumulative = np.cumsum(self.dense_counts)
+        dense_edges = np.clip(np.asarray(edges, dtype=np.int64), -1, DENSE_LIMIT - 1)
+        counts = np.where(dense_edges >= 0, cumulative[np.maximum(dense_edges, 0)], 0)
+        for value, count in self.sparse_counts.items():
+            counts = counts + np.where(np.asarray(edges) >= value, count, 0)
+        return counts
+
+    def result(self, bins=50):
+        """Summarize the session as a JSON-serializable dict"""
+        if not self.count:
+            return {'name': self.name, 'samples': 0}
+
+        percentiles = self.percentiles(REPORT_PERCENTILES + (99.99,))
+        std = math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0
+        duration = (self.last_time - self.first_time) / 1e6
+
+        # Histogram up to the 99.99th percentile (the rest is counted in the last bin) and CDF at the bin edges
+        top = max(percentiles[99.99], self.min + 1)
+        edges = np.linspace(self.min, top, bins + 1)
+        at_or_below = self.count_at_or_below(np.floor(edges).astype(np.int64))
+        histogram = np.diff(at_or_below)
+        histogram[0] += at_or_below[0]
+        histogram[-1] += self.count - at_or_below[-1]
+
+        windows = []
+        for window_id in sorted(self.windows):
+            count, total, squares, minimum, maximum = self.windows[window_id]
+            mean = total / count
+            windows.append({
+                'start_us': window_id * self.window_us,
+                'samples': count,
+                'mean_us': mean,
+                'std_us': math.sqrt(max(squares / count - mean * mean, 0.0)),
+                'min_us': minimum,
+                'max_us': maximum,
+            })
+
+        return {
+            'name': self.name,
+            'samples': self.count,
+            'duration_s': duration,
+            'rate_hz': self.count / duration if duration > 0 else None,
+            'mean_us': self.mean,
+            'std_us': std,
+            'min_us': self.min,
+            'max_us': self.max,
+            'percentiles_us': {str(q): percentiles[q] for q in REPORT_PERCENTILES},
+            'jitter_us': self.diff_abs_sum / self.diff_count if self.diff_count else 0.0,
+            'jitter_max_us': self.diff_abs_max,
+            'interval_us': self.interval_us,
+            'gaps': self.gap_count,
+            'gap_total_s': self.gap_total_us / 1e6,
+            'dropped_estimate': self.dropped_estimate,
+            'longest_gaps': [{'start_us': start, 'length_s': length / 1e6} for start, length in self.gaps[:5]],
+            'histogram': {'edges_us': edges.tolist(), 'counts': histogram.tolist()},
+            'cdf': {'latency_us': edges.tolist(), 'fraction': (at_or_below / self.count).tolist()},
+            'windows': windows,
+        }
+
+def analyze_file(path, chunk_size=1_000_000, window_seconds=60, gap_factor=3.0, interval_us=None, bins=50):
+    """Analyze one latency CSV or recording, returning LatencyAnalyzer.result()"""
+    analyzer = LatencyAnalyzer(os.path.basename(path), window_seconds, gap_factor, interval_us)
+    for chunk in iter_chunks(path, 'latency', chunk_size):
+        analyzer.add(chunk['timestamp_us'], chunk['latency_us'])
+    return analyzer.result(bins)
+
+def format_comparison(results):
+    """Side by side text table of the main metrics of each session"""
+    def number(value, digits=1):
+        return '-' if value is None else f"{value:,.{digits}f}"
+
+    rows = [
+        ('Samples', lambda r: f"{r['samples']:,}"),
+        ('Duration (s)', lambda r: number(r.get('duration_s'))),
+        ('Rate (Hz)', lambda r: number(r.get('rate_hz'), 2)),
+        ('Mean (µs)', lambda r: number(r.get('mean_us'))),
+        ('Std dev (µs)', lambda r: number(r.get('std_us'))),
+        ('Min (µs)', lambda r: number(r.get('min_us'), 0)),
+    ]
+    rows += [(f"p{q} (µs)", lambda r, q=q: number(r.get('percentiles_us', {}).get(str(q)), 0)) for q in REPORT_PERCENTILES]
+    rows += [
+        ('Max (µs)', lambda r: number(r.get('max_us'), 0)),
+        ('Jitter (µs)', lambda r: number(r.get('jitter_us'))),
+        ('Max jitter (µs)', lambda r: number(r.get('jitter_max_us'), 0)),
+        ('Interval (ms)', lambda r: number(r['interval_us'] / 1000 if r.get('interval_us') else None, 2)),
+        ('Gaps', lambda r: f"{r.get('gaps', 0):,}"),
+        ('Gap time (s)', lambda r: number(r.get('gap_total_s'))),
+        ('Dropped (est.)', lambda r: f"{r.get('dropped_estimate', 0):,}"),
+    ]
+
+    table = [[''] + [result['name'] for result in results]]
+    table += [[label] + [format_value(result) if result['samples'] else '-' for result in results] for label, format_value in rows]
+    widths = [max(len(row[i]) for row in table) for i in range(len(table[0]))]
+    lines = ['  '.join(cell.ljust(widths[0]) if i == 0 else cell.rjust(widths[i]) for i, cell in enumerate(row)) for row in table]
+    lines.insert(1, '-' * len(lines[0]))
+
+    # Change of each metric relative to the first session
+    if len(results) > 1 and results[0]['samples']:
+        base = results[0]
+        lines.append('')
+        for result in results[1:]:
+            if not result['samples']:
+                continue
+            changes = [f"{key} {100 * (result['percentiles_us'][key] - base['percentiles_us'][key]) / max(base['percentiles_us'][key], 1):+.1f}%"
+                       for key in ('50', '99')]
+            changes.append(f"mean {100 * (result['mean_us'] - base['mean_us']) / max(base['mean_us'], 1):+.1f}%")
+            lines.append(f"{result['name']} vs {base['name']}: p" + ', p'.join(changes[:2]) + f", {changes[2]}")
+    return '\n'.join(lines)
+
+def plot_results(results, filepath):
+    """Save histogram, CDF and per-window trend plots of every session to an image"""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    fig, (ax_hist, ax_cdf, ax_trend) = plt.subplots(3, 1, figsize=(12, 14))
+    for result in results:
+        if not result['samples']:
+            continue
+        edges = np.array(result['histogram']['edges_us'])
+        ax_hist.stairs(result['histogram']['counts'], edges, label=result['name'])
+        ax_cdf.plot(result['cdf']['latency_us'], result['cdf']['fraction'], label=result['name'])
+        starts = np.array([window['start_us'] for window in result['windows']], dtype=np.float64)
+        ax_trend.plot((starts - starts[0]) / 60e6, [window['mean_us'] for window in result['windows']], marker='.', label=result['name'])
+
+    ax_hist.set_title('Latency Histogram')
+    ax_hist.set_xlabel('Latency (microseconds)')
+    ax_hist.set_ylabel('Samples')
+    ax_cdf.set_title('Latency CDF')
+    ax_cdf.set_xlabel('Latency (microseconds)')
+    ax_cdf.set_ylabel('Fraction of samples')
+    ax_trend.set_title('Mean Latency per Window')
+    ax_trend.set_xlabel('Session time (minutes)')
+    ax_trend.set_ylabel('Latency (microseconds)')
+    for ax in (ax_hist, ax_cdf, ax_trend):
+        ax.grid(True, alpha=0.3)
+        ax.legend()
+
+    plt.tight_layout()
+    plt.savefig(filepath, dpi=150)
+    plt.close(fig)
+
+def main():
+    parser = argparse.ArgumentParser(description='Analyze and compare recorded BLE latency sessions')
+    parser.add_argument('files', nargs='+', help='Latency CSV files or .rec recordings')
+    parser.add_argument('--chunk-size', type=int, default=1_000_000,
+                       help='Samples processed at a time (default: 1000000)')
+    parser.add_argument('--window', type=float, default=60,
+                       help='Trend window length in seconds (default: 60)')
+    parser.add_argument('--interval', type=float,
+                       help='Expected interval between samples in milliseconds (default: median interval of the session)')
+    parser.add_argument('--gap-factor', type=float, default=3.0,
+                       help='Intervals longer than this many expected intervals are gaps (default: 3)')
+    parser.add_argument('--bins', type=int, default=50,
+                       help='Number of histogram bins (default: 50)')
+    parser.add_argument('--json', type=str,
+                       help='Save the full results (including histogram, CDF and windows) to a JSON file')
+    parser.add_argument('--plot', type=str,
+                       help='Save histogram, CDF and trend plots to an image file')
+    args = parser.parse_args()
+
+    results = []
+    for path in args.files:
+        try:
+            results.append(analyze_file(path, args.chunk_size, args.window, args.gap_factor,
+                                        args.interval * 1000 if args.interval else None, args.bins))
+        except (RecordingError, OSError, ValueError, IndexError) as e:
+            print(f"Error analyzing {path}: {e}")
+            sys.exit(1)
+
+    print(format_comparison(results))
+    for result in results:
+        for gap in result.get('longest_gaps', []):
+            print(f"{result['name']}: gap of {gap['length_s']:.3f}s at {np.datetime64(gap['start_us'], 'us')} UTC")
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=2)
+        print(f"Results saved to: {args.json}")
+    if args.plot:
+        plot_results(results, args.plot)
+        print(f"Plots saved to: {args.plot}")
+
+if __name__ == "__main__":
+    main()
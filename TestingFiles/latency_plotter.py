@@ -4,34 +4,279 @@ ESP32 BLE Latency Monitor
 Captures latency data from ESP32 serial output and plots it in real-time using matplotlib.
 """
 
-import serial
 import matplotlib.pyplot as plt
 import matplotlib.animation as animation
-from datetime import datetime, timedelta
+import numpy as np
+from datetime import datetime
+import math
 import re
 import argparse
 import sys
 import os
-import csv
+import queue
+import threading
+import time
+
+from data_sources import open_source
+from recording import RecordingWriter
+
+class RingBuffer:
+    """Fixed-size NumPy ring buffer, holding the most recent values"""
+
+    def __init__(self, capacity, dtype):
+        self.data = np.zeros(capacity, dtype=dtype)
+        self.capacity = capacity
+        self.count = 0  # total values written
+
+    def extend(self, values):
+        """Add an array of values, overwriting the oldest"""
+        values = values[-self.capacity:]
+        start = self.count % self.capacity
+        first = min(len(values), self.capacity - start)
+        self.data[start:start + first] = values[:first]
+        self.data[:len(values) - first] = values[first:]
+        self.count += len(values)
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def values(self):
+        """Return the values in order, oldest first"""
+        if self.count <= self.capacity:
+            return self.data[:self.count]
+        start = self.count % self.capacity
+        return np.concatenate((self.data[start:], self.data[:start]))
+
+class SampleHistory:
+    """Complete session history in fixed-size NumPy chunks: int64 epoch microseconds and uint32 latencies (12 bytes per sample)"""
+
+    def __init__(self, chunk_size=65536):
+        self.chunk_size = chunk_size
+        self.times = []
+        self.latencies = []
+        self.fill = chunk_size  # values used in the last chunk, full so the first add allocates one
+
+    def extend(self, times, latencies):
+        while len(times):
+            if self.fill == self.chunk_size:
+                self.times.append(np.empty(self.chunk_size, dtype=np.int64))
+                self.latencies.append(np.empty(self.chunk_size, dtype=np.uint32))
+                self.fill = 0
+            n = min(len(times), self.chunk_size - self.fill)
+            self.times[-1][self.fill:self.fill + n] = times[:n]
+            self.latencies[-1][self.fill:self.fill + n] = latencies[:n]
+            self.fill += n
+            times, latencies = times[n:], latencies[n:]
+
+    def __len__(self):
+        return max(0, len(self.times) - 1) * self.chunk_size + (self.fill if self.times else 0)
+
+    def arrays(self):
+        """Return the whole history as (times, latencies) arrays"""
+        if not self.times:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.uint32)
+        times = self.times[:-1] + [self.times[-1][:self.fill]]
+        latencies = self.latencies[:-1] + [self.latencies[-1][:self.fill]]
+        return np.concatenate(times), np.concatenate(latencies)
+
+class RunningStats:
+    """Session statistics updated in O(1) memory: count, Welford mean/variance, min/max, and percentiles
+    from a log-bucketed histogram sketch (each bucket spans about 2 * accuracy relative error)"""
+
+    def __init__(self, accuracy=0.01, max_value=10**8):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets = np.zeros(int(math.ceil(math.log(max_value) / self.log_gamma)) + 1, dtype=np.int64)
+
+    def add(self, values):
+        """Add a batch of values (NumPy array)"""
+        n = len(values)
+        if n == 0:
+            return
+        values = values.astype(np.float64)
+
+        # Combine the batch's mean and squared deviations with the running ones (Chan et al.'s parallel form of Welford's algorithm)
+        batch_mean = values.mean()
+        batch_m2 = ((values - batch_mean) ** 2).sum()
+        delta = batch_mean - self.mean
+        total = self.count + n
+        self.mean += delta * n / total
+        self.m2 += batch_m2 + delta * delta * self.count * n / total
+        self.count = total
+
+        batch_min, batch_max = values.min(), values.max()
+        self.min = batch_min if self.min is None else min(self.min, batch_min)
+        self.max = batch_max if self.max is None else max(self.max, batch_max)
+
+        # Bucket i holds values in (gamma^(i-1), gamma^i], values below 1 go in bucket 0
+        indexes = np.ceil(np.log(np.maximum(values, 1)) / self.log_gamma).astype(np.int64)
+        np.clip(indexes, 0, len(self.buckets) - 1, out=indexes)
+        self.buckets += np.bincount(indexes, minlength=len(self.buckets))
+
+    @property
+    def variance(self):
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance)
+
+    def percentile(self, q):
+        """Estimate the q-th percentile (0-100), within the sketch's relative accuracy"""
+        if self.count == 0:
+            return None
+        rank = q / 100 * (self.count - 1)
+        index = int(np.searchsorted(np.cumsum(self.buckets), rank, side='right'))
+        estimate = 2 * self.gamma ** index / (self.gamma + 1)
+        return min(max(estimate, self.min), self.max)
+
+class CsvStreamWriter:
+    """Appends samples to CSV files from a background thread as they arrive, flushing to disk every
+    flush_interval seconds, so a crash loses at most that much data. A new file is started when the
+    current one reaches max_bytes or max_seconds (if set). Samples are also appended to a binary
+    recording (see recording.py) if record is set, which is never rotated"""
+
+    def __init__(self, directory, prefix, flush_interval=1.0, max_bytes=None, max_seconds=None, record=False):
+        self.directory = directory
+        self.prefix = prefix
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+
+        self.paths = []
+        self.samples = 0
+        self.recording_path = os.path.join(directory, f"{prefix}.rec") if record else None
+        self.recording = None
+        self.file = None
+        self.file_bytes = 0
+        self.file_start = 0
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.write_loop, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def write(self, timestamps, latencies):
+        """Queue a batch of latencies and their timestamps (epoch microseconds), safe to call from any thread"""
+        self.queue.put((timestamps, latencies))
+
+    def close(self):
+        """Write everything still queued, then flush and close the current file"""
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+    def open_next_file(self):
+        if self.file:
+            self.flush()
+            self.file.close()
+
+        part = len(self.paths) + 1
+        filename = f"{self.prefix}.csv" if part == 1 else f"{self.prefix}_part{part}.csv"
+        path = os.path.join(self.directory, filename)
+        self.file = open(path, 'w', newline='', buffering=1 << 16)
+        self.file_bytes = self.file.write('Timestamp,Latency_Microseconds\r\n')
+        self.file_start = time.monotonic()
+        self.paths.append(path)
+
+    def needs_rotation(self):
+        if self.file is None:
+            return True
+        if self.max_bytes and self.file_bytes >= self.max_bytes:
+            return True
+        return bool(self.max_seconds) and time.monotonic() - self.file_start >= self.max_seconds
+
+    def flush(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        if self.recording:
+            self.recording.flush()
+
+    def write_loop(self):
+        last_flush = time.monotonic()
+        last_second, prefix = None, ''
+        done = False
+        while not done:
+            # Wait for data, waking up at least once per flush interval
+            try:
+                batches = [self.queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                batches = []
+            while True:
+                try:
+                    batches.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            for batch in batches:
+                if batch is None:
+                    done = True
+                    continue
+
+                timestamps, latencies = batch
+                if self.needs_rotation():
+                    self.open_next_file()
+
+                # Only the microseconds change between most samples, the date and time is formatted once per second
+                lines = []
+                for timestamp, latency in zip(timestamps.tolist(), latencies):
+                    second, micros = divmod(timestamp, 1_000_000)
+                    if second != last_second:
+                        last_second, prefix = second, datetime.fromtimestamp(second).strftime('%Y-%m-%d %H:%M:%S')
+                    lines.append(f"{prefix}.{micros:06d},{latency}\r\n")
+                self.file_bytes += self.file.write(''.join(lines))
+                self.samples += len(latencies)
+
+                if self.recording_path:
+                    if self.recording is None:
+                        self.recording = RecordingWriter(self.recording_path, 'latency', meta={'source': 'latency_plotter.py'})
+                    self.recording.append(timestamp_us=timestamps, latency_us=latencies)
+
+            if self.file and (done or time.monotonic() - last_flush >= self.flush_interval):
+                self.flush()
+                last_flush = time.monotonic()
+
+        if self.file:
+            self.file.close()
+            self.file = None
+        if self.recording:
+            self.recording.close()
 
 class LatencyMonitor:
-    def __init__(self, port, baudrate=115200, max_points=100):
+    def __init__(self, port, baudrate=115200, max_points=100, output_dir=None, keep_history=True,
+                 flush_interval=1.0, rotate_bytes=None, rotate_seconds=None, record=False, replay=None, speed=1.0):
         self.port = port
         self.baudrate = baudrate
+        self.replay = replay
+        self.speed = speed
         self.max_points = max_points
         
-        # Data storage for live plot (rolling window)
-        self.timestamps = []
-        self.latencies = []
+        # Data storage for live plot (rolling window), timestamps are epoch microseconds
+        self.timestamps = RingBuffer(max_points, np.int64)
+        self.latencies = RingBuffer(max_points, np.uint32)
         
-        # Complete data storage for final graph and CSV
-        self.all_timestamps = []
-        self.all_latencies = []
+        # Complete data storage for the final graph (optional, the CSV files always have everything), plus running session stats
+        self.history = SampleHistory() if keep_history else None
+        self.stats = RunningStats()
         
         # Session info for file naming
         self.session_start = datetime.now()
+
+        # Samples are streamed to CSV files as they're read
+        self.output_dir = output_dir or os.getcwd()
+        self.csv_writer = CsvStreamWriter(self.output_dir, f"latency_data_{self.session_start.strftime('%Y-%m-%d_%H-%M-%S')}",
+                                          flush_interval, rotate_bytes, rotate_seconds, record)
+
+        # Offset from epoch microseconds to local time, for plotting timestamps as datetime64
+        self.local_offset_us = int(self.session_start.astimezone().utcoffset().total_seconds() * 1e6)
         
-        # Serial connection
+        # Serial connection (or replay of a recorded session, see data_sources.py)
         self.ser = None
         
         # Plot setup
@@ -45,124 +290,177 @@ class LatencyMonitor:
         self.ax.grid(True, alpha=0.3)
         self.ax.legend()
         
-        # Regex pattern to match latency output
-        self.latency_pattern = re.compile(r'Latency: (\d+) microseconds')
+        # Byte-level pattern matching latency lines, so serial data never needs decoding
+        self.latency_pattern = re.compile(rb'^[ \t]*Latency: (\d+) microseconds', re.MULTILINE)
+
+        # Batches of (epoch microseconds array, [latencies]) from the reader thread to the plot
+        self.sample_queue = queue.Queue()
+        self.reader_thread = None
+        self.stop_event = threading.Event()
         
     def connect_serial(self):
-        """Connect to ESP32 via serial"""
+        """Connect to ESP32 via serial, or open the replay file"""
         try:
-            self.ser = serial.Serial(self.port, self.baudrate, timeout=1)
-            print(f"Connected to {self.port} at {self.baudrate} baud")
+            self.ser = open_source(self.port, self.baudrate, timeout=0.1, replay=self.replay, speed=self.speed, kind='latency')
+            if self.replay:
+                print(f"Replaying {self.replay} at {f'{self.speed:g}x speed' if self.speed > 0 else 'full speed'}")
+            else:
+                print(f"Connected to {self.port} at {self.baudrate} baud")
             return True
-        except serial.SerialException as e:
+        except (OSError, ValueError) as e:
             print(f"Error connecting to serial port: {e}")
             return False
     
-    def read_latency_data(self):
-        """Read and parse latency data from serial"""
-        if not self.ser or not self.ser.is_open:
-            return None
-            
-        try:
-            line = self.ser.readline().decode('utf-8', errors='ignore').strip()
-            if line:
-                match = self.latency_pattern.match(line)
-                if match:
-                    latency = int(match.group(1))
-                    timestamp = datetime.now()
-                    return timestamp, latency
-        except Exception as e:
-            print(f"Error reading serial data: {e}")
-        
-        return None
-    
+    def parse_latency_data(self, data):
+        """Parse latency values from complete lines of serial data (bytes)"""
+        return [int(value) for value in self.latency_pattern.findall(data)]
+
+    @staticmethod
+    def sample_times(previous, now, count):
+        """Timestamps (epoch microseconds) for count samples that arrived between two reads, spread evenly
+        after previous up to now, so each sample keeps its own time when many arrive in one read"""
+        return previous + (now - previous) * np.arange(1, count + 1, dtype=np.int64) // count
+
+    def read_serial_loop(self):
+        """Reader thread: drain everything waiting on the serial port in bulk, split off complete
+        lines, and queue the parsed latencies as one batch per read"""
+        pending = b''
+        last_read = time.time_ns() // 1000
+        while not self.stop_event.is_set():
+            try:
+                # Blocks for up to the port timeout when nothing is waiting
+                data = self.ser.read(self.ser.in_waiting or 1)
+            except OSError as e:
+                print(f"Error reading serial data: {e}")
+                break
+
+            # Everything in this read arrived since the previous read returned
+            previous, last_read = last_read, time.time_ns() // 1000
+            if not data:
+                if getattr(self.ser, 'exhausted', False):
+                    break  # end of a replay
+                continue
+
+            # Only parse up to the last newline, a partial line is kept for the next read
+            pending += data
+            end = pending.rfind(b'\n')
+            if end < 0:
+                continue
+            complete, pending = pending[:end + 1], pending[end + 1:]
+
+            latencies = self.parse_latency_data(complete)
+            if latencies:
+                timestamps = self.sample_times(previous, last_read, len(latencies))
+                self.csv_writer.write(timestamps, latencies)
+                self.sample_queue.put((timestamps, latencies))
+
+    def start_reader(self):
+        """Start the background serial reader thread"""
+        self.stop_event.clear()
+        self.reader_thread = threading.Thread(target=self.read_serial_loop, daemon=True)
+        self.reader_thread.start()
+
+    def stop_reader(self):
+        """Stop the background serial reader thread"""
+        self.stop_event.set()
+        if self.reader_thread:
+            self.reader_thread.join()
+            self.reader_thread = None
+
+    def to_datetime64(self, timestamps):
+        """Convert epoch microseconds to local datetime64 values for plotting"""
+        return (timestamps + self.local_offset_us).astype('datetime64[us]')
+
     def update_plot(self, frame):
         """Update plot with new data (called by animation)"""
-        # Read new data
-        data = self.read_latency_data()
-        if data:
-            timestamp, latency = data
+        # Take every batch the reader has queued since the last frame
+        batches = []
+        while True:
+            try:
+                batches.append(self.sample_queue.get_nowait())
+            except queue.Empty:
+                break
+
+        if batches:
+            # Add new data points to live storage, complete storage and session stats
+            timestamps = np.concatenate([timestamps for timestamps, _ in batches])
+            latencies = np.concatenate([np.asarray(latencies, dtype=np.uint32) for _, latencies in batches])
+            self.timestamps.extend(timestamps)
+            self.latencies.extend(latencies)
+            if self.history is not None:
+                self.history.extend(timestamps, latencies)
+            self.stats.add(latencies)
             
-            # Add new data point to both live and complete storage
-            self.timestamps.append(timestamp)
-            self.latencies.append(latency)
-            self.all_timestamps.append(timestamp)
-            self.all_latencies.append(latency)
+            # Update plot data, the live window has a fixed size so this costs the same every frame
+            window_times = self.to_datetime64(self.timestamps.values())
+            window_latencies = self.latencies.values()
+            self.line.set_data(window_times, window_latencies)
             
-            # Keep only the last max_points for live display
-            if len(self.timestamps) > self.max_points:
-                self.timestamps.pop(0)
-                self.latencies.pop(0)
+            # Update axis limits
+            if len(window_times) > 1:
+                margin = np.timedelta64(30, 's')  # 30-second margin
+                self.ax.set_xlim(window_times[0] - margin, window_times[-1] + margin)
             
-            # Update plot data
-            if self.timestamps:
-                self.line.set_data(self.timestamps, self.latencies)
-                
-                # Update axis limits
-                if len(self.timestamps) > 1:
-                    time_range = self.timestamps[-1] - self.timestamps[0]
-                    margin = timedelta(seconds=30)  # 30-second margin
-                    
-                    self.ax.set_xlim(self.timestamps[0] - margin, 
-                                   self.timestamps[-1] + margin)
-                
-                # Auto-scale y-axis with some padding
-                if self.latencies:
-                    min_lat = min(self.latencies)
-                    max_lat = max(self.latencies)
-                    padding = (max_lat - min_lat) * 0.1 + 100  # 10% padding + 100µs
-                    self.ax.set_ylim(max(0, min_lat - padding), max_lat + padding)
+            # Auto-scale y-axis with some padding
+            min_lat = int(window_latencies.min())
+            max_lat = int(window_latencies.max())
+            padding = (max_lat - min_lat) * 0.1 + 100  # 10% padding + 100µs
+            self.ax.set_ylim(max(0, min_lat - padding), max_lat + padding)
+
+            self.ax.set_title(f'ESP32 BLE Communication Latency (mean {self.stats.mean:.0f} ± {self.stats.std:.0f} µs, '
+                              f'p50 {self.stats.percentile(50):.0f} µs, p99 {self.stats.percentile(99):.0f} µs)')
             
-            # Print data to console
-            print(f"{timestamp.strftime('%H:%M:%S')} - Latency: {latency} µs")
+            # Print the newest sample to console
+            more = f" (+{len(latencies) - 1} more)" if len(latencies) > 1 else ""
+            newest = datetime.fromtimestamp(timestamps[-1] / 1e6)
+            print(f"{newest.strftime('%H:%M:%S')} - Latency: {latencies[-1]} µs{more}")
         
         return self.line,
     
     def save_data_to_csv(self):
-        """Save all collected data to CSV file"""
-        if not self.all_timestamps:
-            print("No data to save")
-            return None
-            
-        filename = f"latency_data_{self.session_start.strftime('%Y-%m-%d_%H-%M-%S')}.csv"
-        filepath = os.path.join(os.getcwd(), filename)
-        
+        """Finish writing the session's CSV files (samples are written as they arrive)"""
         try:
-            with open(filepath, 'w', newline='') as csvfile:
-                writer = csv.writer(csvfile)
-                writer.writerow(['Timestamp', 'Latency_Microseconds'])
-                
-                for timestamp, latency in zip(self.all_timestamps, self.all_latencies):
-                    writer.writerow([timestamp.strftime('%Y-%m-%d %H:%M:%S.%f'), latency])
-            
-            print(f"Data saved to: {filepath}")
-            return filepath
+            self.csv_writer.close()
         except Exception as e:
             print(f"Error saving CSV: {e}")
             return None
+
+        if not self.csv_writer.paths:
+            print("No data to save")
+            return None
+            
+        for filepath in self.csv_writer.paths:
+            print(f"Data saved to: {filepath}")
+        if self.csv_writer.recording:
+            print(f"Recording saved to: {self.csv_writer.recording_path}")
+        return self.csv_writer.paths
     
     def create_final_graph(self):
         """Create and save a final static graph with all data"""
-        if not self.all_timestamps:
+        if self.history is None:
+            print("In-memory history disabled, skipping final graph (all data is in the CSV files)")
+            return None
+        if not len(self.history):
             print("No data to plot")
             return None
             
         filename = f"latency_graph_{self.session_start.strftime('%Y-%m-%d_%H-%M-%S')}.png"
-        filepath = os.path.join(os.getcwd(), filename)
+        filepath = os.path.join(self.output_dir, filename)
         
         try:
             # Create a new figure for the final graph
             fig, ax = plt.subplots(figsize=(14, 8))
             
             # Plot all data points
-            ax.plot(self.all_timestamps, self.all_latencies, 'b-', linewidth=1.5, 
+            all_timestamps, all_latencies = self.history.arrays()
+            ax.plot(self.to_datetime64(all_timestamps), all_latencies, 'b-', linewidth=1.5, 
                    marker='o', markersize=3, alpha=0.7, label='BLE Latency')
             
-            # Add statistics to the plot
-            if self.all_latencies:
-                avg_latency = sum(self.all_latencies) / len(self.all_latencies)
-                min_latency = min(self.all_latencies)
-                max_latency = max(self.all_latencies)
+            # Add statistics to the plot, from the running session stats
+            if self.stats.count:
+                avg_latency = self.stats.mean
+                min_latency = int(self.stats.min)
+                max_latency = int(self.stats.max)
                 
                 # Add horizontal lines for statistics
                 ax.axhline(y=avg_latency, color='r', linestyle='--', alpha=0.7, 
@@ -173,9 +471,10 @@ class LatencyMonitor:
                           label=f'Maximum: {max_latency} µs')
                 
                 # Add statistics text box
-                stats_text = f'Session Stats:\nSamples: {len(self.all_latencies)}\n'
-                stats_text += f'Duration: {(self.all_timestamps[-1] - self.all_timestamps[0]).total_seconds():.1f}s\n'
-                stats_text += f'Avg: {avg_latency:.1f} µs\nMin: {min_latency} µs\nMax: {max_latency} µs'
+                stats_text = f'Session Stats:\nSamples: {self.stats.count}\n'
+                stats_text += f'Duration: {(all_timestamps[-1] - all_timestamps[0]) / 1e6:.1f}s\n'
+                stats_text += f'Avg: {avg_latency:.1f} µs\nStd Dev: {self.stats.std:.1f} µs\nMin: {min_latency} µs\nMax: {max_latency} µs\n'
+                stats_text += f'p50: {self.stats.percentile(50):.0f} µs\np99: {self.stats.percentile(99):.0f} µs'
                 
                 ax.text(0.02, 0.98, stats_text, transform=ax.transAxes, 
                        verticalalignment='top', bbox=dict(boxstyle='round', facecolor='wheat', alpha=0.8))
@@ -204,26 +503,48 @@ class LatencyMonitor:
             print(f"Error creating final graph: {e}")
             return None
     
-    def start_monitoring(self):
+    def run_headless(self):
+        """Redraw the plot off-screen as fast as possible until the reader stops (the end of a replay),
+        then report ingestion and frame rates"""
+        frames = 0
+        start = time.perf_counter()
+        while self.reader_thread.is_alive():
+            self.update_plot(frames)
+            self.fig.canvas.draw()
+            frames += 1
+        self.update_plot(frames)
+        elapsed = time.perf_counter() - start
+
+        print(f"\nIngested {self.stats.count:,} samples in {elapsed:.2f}s ({self.stats.count / elapsed:,.0f} samples/s)")
+        print(f"Rendered {frames:,} frames ({frames / elapsed:,.1f} fps)")
+
+    def start_monitoring(self, headless=False):
         """Start the real-time monitoring"""
         if not self.connect_serial():
             sys.exit(1)
         
         print("Starting latency monitoring...")
         print("Waiting for ESP32 latency data...")
-        print("Close the plot window to stop monitoring.\n")
+        if not headless:
+            print("Close the plot window to stop monitoring.\n")
+        self.csv_writer.start()
+        self.start_reader()
         
         # Create animation
         ani = animation.FuncAnimation(
             self.fig, self.update_plot, interval=100, blit=False, cache_frame_data=False
-        )
+        ) if not headless else None
         
         try:
-            plt.show()
+            if headless:
+                self.run_headless()
+            else:
+                plt.show()
         except KeyboardInterrupt:
             print("\nMonitoring stopped by user")
         finally:
             # Save data and create final graph when session ends
+            self.stop_reader()
             print("\nSaving session data...")
             self.save_data_to_csv()
             self.create_final_graph()
@@ -252,6 +573,24 @@ def main():
                        help='Maximum number of data points to display (default: 100)')
     parser.add_argument('--list-ports', '-l', action='store_true',
                        help='List available serial ports and exit')
+    parser.add_argument('--replay', '-r', type=str, metavar='FILE',
+                       help='Replay a latency recording, CSV file or serial log instead of reading a serial port')
+    parser.add_argument('--speed', type=float, default=1.0,
+                       help='Replay speed, 1 for real-time, N for N times faster, 0 for as fast as possible (default: 1)')
+    parser.add_argument('--headless', action='store_true',
+                       help='Draw off-screen until the replay ends, then report ingestion and frame rates')
+    parser.add_argument('--output-dir', '-o', type=str,
+                       help='Directory for CSV files and the final graph (default: current directory)')
+    parser.add_argument('--flush-interval', type=float, default=1.0,
+                       help='Seconds between flushing CSV data to disk (default: 1)')
+    parser.add_argument('--rotate-mb', type=float,
+                       help='Start a new CSV file after this many megabytes')
+    parser.add_argument('--rotate-hours', type=float,
+                       help='Start a new CSV file after this many hours')
+    parser.add_argument('--record', action='store_true',
+                       help='Also write a binary recording (.rec, see recording.py) for fast offline analysis')
+    parser.add_argument('--no-history', action='store_true',
+                       help='Don\'t keep the session in memory (bounded memory for long runs, skips the final graph)')
     
     args = parser.parse_args()
     
@@ -259,15 +598,23 @@ def main():
         list_serial_ports()
         return
     
-    if not args.port:
-        print("Error: Please specify a serial port with --port")
+    if not args.port and not args.replay:
+        print("Error: Please specify a serial port with --port (or a file with --replay)")
         print("Use --list-ports to see available ports")
         list_serial_ports()
         sys.exit(1)
     
+    if args.headless:
+        if not args.replay:
+            print("Error: --headless needs a file to --replay")
+            sys.exit(1)
+        plt.switch_backend('Agg')
+    
     # Create and start monitor
-    monitor = LatencyMonitor(args.port, args.baudrate, args.max_points)
-    monitor.start_monitoring()
+    monitor = LatencyMonitor(args.port, args.baudrate, args.max_points, args.output_dir, not args.no_history, args.flush_interval,
+                             int(args.rotate_mb * 1024 * 1024) if args.rotate_mb else None,
+                             args.rotate_hours * 3600 if args.rotate_hours else None, args.record, args.replay, args.speed)
+    monitor.start_monitoring(args.headless)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
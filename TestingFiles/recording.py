@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+Session Recording Format
+Compact binary recordings shared by SwingPlotter.py and latency_plotter.py, plus converters to and from their CSV layouts.
+
+A recording is a small header followed by fixed-width little-endian records:
+    8 bytes   magic, b'PPREC1\\0\\0'
+    4 bytes   header length (uint32, little-endian)
+    N bytes   JSON header: {"kind": ..., "columns": [[name, numpy dtype], ...], "created": ..., "meta": {...}},
+              padded with spaces so records start on an 8 byte boundary
+    records   one packed record per sample, in the column order of the header
+
+Records are only ever appended, so a recording interrupted by a crash is still readable (a partial record at
+the end is ignored). Readers map the file with np.memmap, so multi-GB recordings are never loaded into memory.
+
+Usage:
+    python recording.py info session.rec
+    python recording.py from-csv latency_data.csv latency_data.rec
+    python recording.py to-csv session.rec session.csv
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+from datetime import datetime
+
+import numpy as np
+
+MAGIC = b'PPREC1\0\0'
+PREFIX_SIZE = len(MAGIC) + 4
+
+# Column layouts of each kind of recording
+LAYOUTS = {
+    'latency': [('timestamp_us', '<i8'), ('latency_us', '<u4')],      # epoch microseconds, 12 bytes per sample
+    'swing':   [('time_ms', '<u4'), ('speed', '<f4'), ('is_swing', 'u1')],  # paddle millis(), 9 bytes per sample
+}
+
+# CSV headers of each kind, as written by latency_plotter.py and printed over serial by the paddle (swing CSVs may have no header)
+CSV_HEADERS = {
+    'latency': ['Timestamp', 'Latency_Microseconds'],
+    'swing':   ['time_ms', 'speed', 'is_swing'],
+}
+CSV_TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+class RecordingError(Exception):
+    """Raised for files that aren't recordings, or don't match the expected layout"""
+
+def record_dtype(columns):
+    """Packed NumPy record dtype for a list of (name, dtype) columns"""
+    return np.dtype([(name, dtype) for name, dtype in columns])
+
+def read_header(file):
+    """Read the header of an open recording, returning (header dict, offset of the first record)"""
+    prefix = file.read(PREFIX_SIZE)
+    if len(prefix) < PREFIX_SIZE or prefix[:len(MAGIC)] != MAGIC:
+        raise RecordingError(f"{getattr(file, 'name', 'file')} is not a session recording")
+    length = int.from_bytes(prefix[len(MAGIC):], 'little')
+    header = json.loads(file.read(length).decode('utf-8'))
+    return header, PREFIX_SIZE + length
+
+class RecordingWriter:
+    """Appends records to a recording, creating it with a header if it doesn't exist.
+    Appending to an existing recording requires the same kind and columns"""
+
+    def __init__(self, path, kind, meta=None, columns=None):
+        self.path = path
+        self.kind = kind
+        self.columns = [list(column) for column in (columns or LAYOUTS[kind])]
+        self.dtype = record_dtype(self.columns)
+
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, 'rb') as file:
+                header, offset = read_header(file)
+            if header['kind'] != kind or header['columns'] != self.columns:
+                raise RecordingError(f"{path} is a {header['kind']} recording with columns {header['columns']}, expected {kind} with {self.columns}")
+
+            # Drop a partial record left by a crash, so appended records stay aligned
+            size = os.path.getsize(path)
+            whole = offset + (size - offset) // self.dtype.itemsize * self.dtype.itemsize
+            self.file = open(path, 'r+b')
+            self.file.truncate(whole)
+            self.file.seek(whole)
+        else:
+            self.file = open(path, 'wb')
+            header = json.dumps({'kind': kind, 'columns': self.columns, 'created': datetime.now().isoformat(), 'meta': meta or {}}).encode('utf-8')
+            header += b' ' * (-(PREFIX_SIZE + len(header)) % 8)
+            self.file.write(MAGIC + len(header).to_bytes(4, 'little') + header)
+
+    def append(self, **columns):
+        """Append records from equal-length column arrays (or scalars), e.g. append(timestamp_us=times, latency_us=values)"""
+        lengths = {np.size(values) for values in columns.values()}
+        if len(lengths) != 1:
+            raise ValueError(f"Columns must have the same length, got {lengths}")
+        records = np.empty(lengths.pop(), dtype=self.dtype)
+        for name in self.dtype.names:
+            records[name] = columns[name]
+        self.append_records(records)
+
+    def append_records(self, records):
+        """Append a structured array with this recording's dtype"""
+        self.file.write(np.ascontiguousarray(records, dtype=self.dtype).tobytes())
+
+    def flush(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        if not self.file.closed:
+            self.file.flush()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+class Recording:
+    """A recording opened for reading. `records` is a read-only np.memmap structured array, so
+    columns (e.g. recording.records['latency_us']) are views into the file, not copies"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as file:
+            self.header, self.offset = read_header(file)
+        self.kind = self.header['kind']
+        self.meta = self.header.get('meta', {})
+        self.dtype = record_dtype(self.header['columns'])
+
+        # A partial record at the end (from a crash mid-write) is ignored
+        self.count = (os.path.getsize(path) - self.offset) // self.dtype.itemsize
+        if self.count:
+            self.records = np.memmap(path, dtype=self.dtype, mode='r', offset=self.offset, shape=(self.count,))
+        else:
+            self.records = np.empty(0, dtype=self.dtype)
+
+    def __len__(self):
+        return self.count
+
+    def chunks(self, chunk_size=1_000_000):
+        """Iterate over the records in chunks (memmap views), for bounded-memory processing"""
+        for start in range(0, self.count, chunk_size):
+            yield self.records[start:start + chunk_size]
+
+def open_recording(path, kind=None):
+    """Open a recording for reading, optionally checking its kind"""
+    recording = Recording(path)
+    if kind and recording.kind != kind:
+        raise RecordingError(f"{path} is a {recording.kind} recording, expected {kind}")
+    return recording
+
+def is_recording(path):
+    """Check whether a file starts with the recording magic"""
+    with open(path, 'rb') as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+def _local_timestamps_to_epoch_us(stamps):
+    # Convert local 'YYYY-mm-dd HH:MM:SS.ffffff' strings to epoch microseconds, vectorized with a per-chunk UTC offset
+    # (rows are converted one at a time only if a chunk crosses a daylight saving change)
+    naive = np.array([stamp.replace(' ', 'T') for stamp in stamps], dtype='datetime64[us]').astype(np.int64)
+    offsets = [int(datetime.strptime(stamps[i], CSV_TIMESTAMP_FORMAT).astimezone().utcoffset().total_seconds() * 1e6) for i in (0, -1)]
+    if offsets[0] == offsets[1]:
+        return naive - offsets[0]
+    return np.array([int(datetime.strptime(stamp, CSV_TIMESTAMP_FORMAT).timestamp() * 1e6) for stamp in stamps], dtype=np.int64)
+
+def _csv_row_chunks(csv_path, chunk_size):
+    # Yield lists of CSV rows, skipping a header row if present
+    with open(csv_path, newline='') as file:
+        rows = csv.reader(file)
+        chunk = []
+        for row in rows:
+            if not row:
+                continue
+            if not chunk and row[0] in (CSV_HEADERS['latency'][0], CSV_HEADERS['swing'][0]):
+                continue
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+def iter_chunks(path, kind='latency', chunk_size=1_000_000):
+    """Iterate over a recording or CSV file of the given kind in chunks of structured records (recording dtype),
+    so files of any size can be processed in bounded memory"""
+    if is_recording(path):
+        yield from open_recording(path, kind).chunks(chunk_size)
+        return
+
+    dtype = record_dtype(LAYOUTS[kind])
+    for rows in _csv_row_chunks(path, chunk_size):
+        records = np.empty(len(rows), dtype=dtype)
+        if kind == 'latency':
+            records['timestamp_us'] = _local_timestamps_to_epoch_us([row[0] for row in rows])
+            records['latency_us'] = [row[1] for row in rows]
+        else:
+            records['time_ms'] = [row[0] for row in rows]
+            records['speed'] = [row[1] for row in rows]
+            records['is_swing'] = [row[2].strip() == '1' for row in rows]
+        yield records
+
+def csv_to_recording(csv_path, recording_path, kind='latency', chunk_size=100_000):
+    """Convert a latency CSV (latency_plotter.py) or swing CSV (time_ms,speed,is_swing lines) to a recording,
+    appending if the recording exists. Returns the number of records written"""
+    count = 0
+    with RecordingWriter(recording_path, kind, meta={'source': os.path.basename(csv_path)}) as writer:
+        for records in iter_chunks(csv_path, kind, chunk_size):
+            writer.append_records(records)
+            count += len(records)
+    return count
+
+def recording_to_csv(recording_path, csv_path, chunk_size=100_000):
+    """Convert a recording back to the CSV layout of its kind. Returns the number of records written"""
+    recording = open_recording(recording_path)
+    with open(csv_path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(CSV_HEADERS[recording.kind])
+        for chunk in recording.chunks(chunk_size):
+            if recording.kind == 'latency':
+                stamps = [datetime.fromtimestamp(us / 1e6).strftime(CSV_TIMESTAMP_FORMAT) for us in chunk['timestamp_us'].tolist()]
+                writer.writerows(zip(stamps, chunk['latency_us'].tolist()))
+            else:
+                speeds = [f"{speed:.6g}" for speed in chunk['speed'].tolist()]
+                writer.writerows(zip(chunk['time_ms'].tolist(), speeds, chunk['is_swing'].tolist()))
+    return len(recording)
+
+def main():
+    parser = argparse.ArgumentParser(description='Inspect and convert session recordings')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    info = subparsers.add_parser('info', help='Show the header and record count of a recording')
+    info.add_argument('recording')
+
+    from_csv = subparsers.add_parser('from-csv', help='Convert a CSV file to a recording (appends if it exists)')
+    from_csv.add_argument('csv')
+    from_csv.add_argument('recording')
+    from_csv.add_argument('--kind', choices=sorted(LAYOUTS), default='latency', help='Kind of CSV (default: latency)')
+
+    to_csv = subparsers.add_parser('to-csv', help='Convert a recording to CSV')
+    to_csv.add_argument('recording')
+    to_csv.add_argument('csv')
+
+    args = parser.parse_args()
+    try:
+        if args.command == 'info':
+            recording = open_recording(args.recording)
+            print(json.dumps(recording.header, indent=2))
+            print(f"{len(recording)} records, {recording.dtype.itemsize} bytes each")
+        elif args.command == 'from-csv':
+            count = csv_to_recording(args.csv, args.recording, args.kind)
+            print(f"Wrote {count} records to {args.recording}")
+        else:
+            count = recording_to_csv(args.recording, args.csv)
+            print(f"Wrote {count} rows to {args.csv}")
+    except (RecordingError, OSError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
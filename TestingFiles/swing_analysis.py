@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+Swing Detection Analysis
+Re-runs the paddle's swing detector offline over sessions recorded by SwingPlotter.py (.rec recordings or
+time_ms,speed,is_swing CSV files), and compares its swings with the ones the firmware flagged (is_swing).
+
+The detector follows the speed rules of ESP_PCB.ino: a swing starts when the speed rises above the threshold and
+the cooldown since the end of the last swing has passed, and ends when the speed drops below the threshold or the
+swing has lasted max_duration. The firmware also requires 2 m/s^2 of dynamic acceleration to start a swing, which
+recordings don't include, so swings it rejected for that reason show up here as extra detections.
+
+Sweep mode evaluates a grid of thresholds and cooldowns (debounce windows) across many recordings in a process
+pool, and ranks the parameters by their agreement with the firmware.
+
+Usage:
+    python swing_analysis.py session1.rec session2.csv --threshold 0.7 --cooldown 500
+    python swing_analysis.py sessions/*.rec --sweep --thresholds 0.5:1.0:0.05 --cooldowns 200,300,500,700
+"""
+
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from recording import RecordingError, iter_chunks
+
+# Detector parameters of the firmware (ESP_PCB.ino)
+FIRMWARE_THRESHOLD = 0.70       # m/s
+FIRMWARE_COOLDOWN_MS = 500
+FIRMWARE_MAX_DURATION_MS = 700
+
+# Swing starts within this many milliseconds of each other are the same swing
+DEFAULT_TOLERANCE_MS = 50
+
+def load_swings(path, chunk_size=1_000_000):
+    """Load a swing session as (times in ms, speeds, firmware swing flags) arrays"""
+    chunks = list(iter_chunks(path, 'swing', chunk_size))
+    if not chunks:
+        return np.empty(0, np.int64), np.empty(0, np.float32), np.empty(0, bool)
+    records = np.concatenate(chunks)
+    return records['time_ms'].astype(np.int64), records['speed'], records['is_swing'].astype(bool)
+
+def detect_swings(times, speeds, threshold=FIRMWARE_THRESHOLD, cooldown_ms=FIRMWARE_COOLDOWN_MS,
+                  max_duration_ms=FIRMWARE_MAX_DURATION_MS):
+    """Detect swings in a session, returning (starts, ends) sample index arrays. A swing is active from its
+    start sample up to (not including) its end sample, the sample that ended it (len(times) if it never ended).
+    The per-sample work is vectorized, the loop only runs once per detected swing"""
+    # Integer times and durations, so searches never convert the whole times array to floats
+    # (times are whole milliseconds, so time > start + duration is the same comparison with the duration floored)
+    times = np.asarray(times, dtype=np.int64)
+    cooldown_ms = np.int64(np.floor(cooldown_ms))
+    max_duration_ms = np.int64(np.floor(max_duration_ms))
+    n = len(times)
+    candidates = np.flatnonzero(speeds > threshold)
+    below = np.flatnonzero(speeds < threshold)
+
+    starts, ends = [], []
+    cursor = 0
+    while True:
+        # First sample above the threshold, after the last swing and its cooldown
+        if ends:
+            cursor = max(ends[-1] + 1, int(np.searchsorted(times, times[ends[-1]] + cooldown_ms, 'right')))
+        k = np.searchsorted(candidates, cursor)
+        if k == len(candidates):
+            break
+        start = int(candidates[k])
+
+        # Ends at the next sample below the threshold, or the first sample past the maximum duration
+        k = np.searchsorted(below, start, 'right')
+        end_by_speed = int(below[k]) if k < len(below) else n
+        end_by_time = int(np.searchsorted(times, times[start] + max_duration_ms, 'right'))
+        starts.append(start)
+        ends.append(min(end_by_speed, end_by_time))
+        if ends[-1] >= n:
+            break
+
+    return np.array(starts, dtype=np.int64), np.array(ends, dtype=np.int64)
+
+def swing_flags(n, starts, ends):
+    """Per-sample active swing flags, like the firmware's is_swing, from swing start and end indexes"""
+    edges = np.zeros(n + 1, dtype=np.int32)
+    np.add.at(edges, starts, 1)
+    np.add.at(edges, ends, -1)
+    return np.cumsum(edges[:-1]) > 0
+
+def flag_starts(flags):
+    """Start sample indexes of the swings in a series of swing flags"""
+    return np.flatnonzero(flags & ~np.r_[False, flags[:-1]])
+
+def match_swings(detected_times, reference_times, tolerance_ms=DEFAULT_TOLERANCE_MS):
+    """Number of detected swings that match a reference swing starting within tolerance_ms,
+    each reference swing matching at most one detected swing (both lists sorted)"""
+    matched = 0
+    j = 0
+    for start in detected_times.tolist():
+        while j < len(reference_times) and reference_times[j] < start - tolerance_ms:
+            j += 1
+        if j < len(reference_times) and reference_times[j] <= start + tolerance_ms:
+            matched += 1
+            j += 1
+    return matched
+
+def compare_detection(times, speeds, firmware_flags, threshold, cooldown_ms, max_duration_ms=FIRMWARE_MAX_DURATION_MS,
+                      tolerance_ms=DEFAULT_TOLERANCE_MS):
+    """Run the detector on a session and compare it with the firmware swing flags"""
+    starts, ends = detect_swings(times, speeds, threshold, cooldown_ms, max_duration_ms)
+    flags = swing_flags(len(times), starts, ends)
+    firmware_starts = flag_starts(firmware_flags)
+    peaks = np.maximum.reduceat(np.where(flags, speeds, 0), starts) if len(starts) else np.empty(0)  # peak of each swing
+
+    return {
+        'threshold': float(threshold),
+        'cooldown_ms': float(cooldown_ms),
+        'samples': len(times),
+        'detected': len(starts),
+        'firmware': len(firmware_starts),
+        'matched': match_swings(times[starts], times[firmware_starts], tolerance_ms),
+        'sample_agreement': float(np.count_nonzero(flags == firmware_flags)),
+        'mean_peak_speed': float(peaks.mean()) if len(peaks) else None,
+        'max_peak_speed': float(peaks.max()) if len(peaks) else None,
+    }
+
+def summarize(result):
+    """Add precision, recall, F1 and the agreement fraction to a (possibly summed) comparison result"""
+    detected, firmware, matched = result['detected'], result['firmware'], result['matched']
+    result['precision'] = matched / detected if detected else None
+    result['recall'] = matched / firmware if firmware else None
+    result['f1'] = 2 * matched / (detected + firmware) if detected + firmware else None
+    result['agreement'] = result['sample_agreement'] / result['samples'] if result['samples'] else None
+    return result
+
+def analyze_file(path, threshold=FIRMWARE_THRESHOLD, cooldown_ms=FIRMWARE_COOLDOWN_MS, max_duration_ms=FIRMWARE_MAX_DURATION_MS,
+                 tolerance_ms=DEFAULT_TOLERANCE_MS):
+    """Detection results of one session for a single set of parameters"""
+    times, speeds, firmware_flags = load_swings(path)
+    result = compare_detection(times, speeds, firmware_flags, threshold, cooldown_ms, max_duration_ms, tolerance_ms)
+    result['name'] = os.path.basename(path)
+    return summarize(result)
+
+def _sweep_file(path, thresholds, cooldowns, max_duration_ms, tolerance_ms):
+    # Worker task: load a session once and evaluate part of the parameter grid on it
+    times, speeds, firmware_flags = load_swings(path)
+    return [compare_detection(times, speeds, firmware_flags, threshold, cooldown_ms, max_duration_ms, tolerance_ms)
+            for threshold in thresholds for cooldown_ms in cooldowns]
+
+def sweep(paths, thresholds, cooldowns, max_duration_ms=FIRMWARE_MAX_DURATION_MS, tolerance_ms=DEFAULT_TOLERANCE_MS, workers=None):
+    """Evaluate every (threshold, cooldown) pair on every session in a process pool, returning one result per pair
+    with the counts summed over all sessions, best F1 first"""
+    workers = workers or os.cpu_count() or 1
+
+    # One task per session, with the thresholds split up when there are fewer sessions than workers
+    splits = min(len(thresholds), max(1, -(-workers // len(paths))))
+    threshold_groups = [group.tolist() for group in np.array_split(np.asarray(thresholds), splits)]
+
+    totals = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        tasks = [pool.submit(_sweep_file, path, group, cooldowns, max_duration_ms, tolerance_ms)
+                 for path in paths for group in threshold_groups]
+        for task in tasks:
+            for result in task.result():
+                key = (result['threshold'], result['cooldown_ms'])
+                total = totals.setdefault(key, {'threshold': key[0], 'cooldown_ms': key[1], 'sessions': 0, 'samples': 0,
+                                                'detected': 0, 'firmware': 0, 'matched': 0, 'sample_agreement': 0.0})
+                total['sessions'] += 1
+                for field in ('samples', 'detected', 'firmware', 'matched', 'sample_agreement'):
+                    total[field] += result[field]
+
+    results = [summarize(total) for total in totals.values()]
+    results.sort(key=lambda r: (r['f1'] or 0, r['agreement'] or 0), reverse=True)
+    return results
+
+def format_table(results, columns):
+    """Text table of results, with (label, format function) columns"""
+    table = [[label for label, _ in columns]]
+    table += [[format_value(result) for _, format_value in columns] for result in results]
+    widths = [max(len(row[i]) for row in table) for i in range(len(columns))]
+    lines = ['  '.join(cell.ljust(widths[0]) if i == 0 else cell.rjust(widths[i]) for i, cell in enumerate(row)) for row in table]
+    lines.insert(1, '-' * len(lines[0]))
+    return '\n'.join(lines)
+
+def number(value, digits=3):
+    return '-' if value is None else f"{value:,.{digits}f}"
+
+COMPARISON_COLUMNS = [
+    ('Detected', lambda r: f"{r['detected']:,}"),
+    ('Firmware', lambda r: f"{r['firmware']:,}"),
+    ('Matched', lambda r: f"{r['matched']:,}"),
+    ('Precision', lambda r: number(r['precision'])),
+    ('Recall', lambda r: number(r['recall'])),
+    ('F1', lambda r: number(r['f1'])),
+    ('Agreement', lambda r: number(r['agreement'])),
+]
+
+def parse_grid(text):
+    """Parse parameter values given as a list (0.6,0.7,0.8) or an inclusive range (start:stop:step)"""
+    if ':' in text:
+        start, stop, step = (float(value) for value in text.split(':'))
+        if step <= 0:
+            raise argparse.ArgumentTypeError(f"Step must be positive: {text}")
+        return [round(value, 6) for value in np.arange(start, stop + step / 2, step).tolist()]
+    return [float(value) for value in text.split(',')]
+
+def main():
+    parser = argparse.ArgumentParser(description='Re-run swing detection on recorded sessions and compare it with the firmware')
+    parser.add_argument('files', nargs='+', help='Swing recordings (.rec) or CSV files')
+    parser.add_argument('--threshold', type=float, default=FIRMWARE_THRESHOLD,
+                       help=f'Swing speed threshold in m/s (default: {FIRMWARE_THRESHOLD})')
+    parser.add_argument('--cooldown', type=float, default=FIRMWARE_COOLDOWN_MS,
+                       help=f'Milliseconds after a swing before the next can start (default: {FIRMWARE_COOLDOWN_MS})')
+    parser.add_argument('--max-duration', type=float, default=FIRMWARE_MAX_DURATION_MS,
+                       help=f'Maximum swing length in milliseconds (default: {FIRMWARE_MAX_DURATION_MS})')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE_MS,
+                       help=f'Swings starting within this many milliseconds of a firmware swing match it (default: {DEFAULT_TOLERANCE_MS})')
+    parser.add_argument('--sweep', action='store_true',
+                       help='Evaluate a grid of thresholds and cooldowns across all files')
+    parser.add_argument('--thresholds', type=parse_grid, default=parse_grid('0.5:1.0:0.05'),
+                       help='Sweep thresholds, as a list (0.6,0.7) or range (start:stop:step) (default: 0.5:1.0:0.05)')
+    parser.add_argument('--cooldowns', type=parse_grid, default=parse_grid('200,300,400,500,600,700'),
+                       help='Sweep cooldowns in milliseconds, as a list or range (default: 200,300,400,500,600,700)')
+    parser.add_argument('--workers', type=int,
+                       help='Worker processes for the sweep (default: number of CPUs)')
+    parser.add_argument('--top', type=int, default=20,
+                       help='Number of sweep results to print (default: 20)')
+    parser.add_argument('--json', type=str,
+                       help='Save the full results to a JSON file')
+    args = parser.parse_args()
+
+    try:
+        if args.sweep:
+            results = sweep(args.files, args.thresholds, args.cooldowns, args.max_duration, args.tolerance, args.workers)
+            print(f"{len(results)} parameter sets over {len(args.files)} sessions, best F1 first:\n")
+            print(format_table(results[:args.top], [('Threshold', lambda r: f"{r['threshold']:g}"),
+                                                    ('Cooldown (ms)', lambda r: f"{r['cooldown_ms']:g}")] + COMPARISON_COLUMNS))
+        else:
+            results = [analyze_file(path, args.threshold, args.cooldown, args.max_duration, args.tolerance) for path in args.files]
+            print(format_table(results, [('Session', lambda r: r['name']), ('Samples', lambda r: f"{r['samples']:,}")]
+                               + COMPARISON_COLUMNS + [('Max peak (m/s)', lambda r: number(r['max_peak_speed'], 2))]))
+    except (RecordingError, OSError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=2)
+        print(f"Results saved to: {args.json}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+import numpy as np
+import pytest
+
+from latency_analysis import DENSE_LIMIT, LatencyAnalyzer, analyze_file
+from recording import RecordingWriter
+
+
+def add_in_chunks(analyzer, timestamps, latencies, sizes):
+    # Feeds the samples in chunks of the given sizes (cycled), like analyze_file does with a file
+    start = 0
+    for size in iter(lambda: sizes[start % len(sizes)], None):
+        if start >= len(latencies):
+            break
+        analyzer.add(timestamps[start:start + size], latencies[start:start + size])
+        start += size
+
+
+def sample_session(count=20000, seed=0):
+    rng = np.random.default_rng(seed)
+    latencies = rng.lognormal(8, 0.6, count).astype(np.int64)
+    latencies[rng.choice(count, 50, replace=False)] = rng.integers(DENSE_LIMIT, DENSE_LIMIT * 8, 50)  # sparse outliers
+    latencies[:3] = [DENSE_LIMIT - 1, DENSE_LIMIT, 0]
+    timestamps = 1_700_000_000_000_000 + np.arange(count, dtype=np.int64) * 1000
+    return timestamps, latencies
+
+
+def test_latency_analyzer_stats():
+    timestamps, latencies = sample_session()
+    analyzer = LatencyAnalyzer('session', window_seconds=5)
+    add_in_chunks(analyzer, timestamps, latencies, [1, 999, 7000, 3])
+
+    # Percentiles are exact across the dense and sparse counts
+    qs = (0.01, 1, 25, 50, 90, 99, 99.5, 99.9, 99.99, 100)
+    expected = np.percentile(latencies, qs, method='inverted_cdf')
+    assert analyzer.percentiles(qs) == dict(zip(qs, expected.tolist()))
+
+    # Running mean and variance merged chunk by chunk match the whole session
+    result = analyzer.result()
+    assert result['samples'] == len(latencies)
+    assert result['mean_us'] == pytest.approx(latencies.mean(), rel=1e-12)
+    assert result['std_us'] == pytest.approx(latencies.std(ddof=1), rel=1e-9)
+    assert (result['min_us'], result['max_us']) == (0, int(latencies.max()))
+
+    # Jitter continues across chunk boundaries
+    diffs = np.abs(np.diff(latencies))
+    assert result['jitter_us'] == pytest.approx(diffs.mean())
+    assert result['jitter_max_us'] == diffs.max()
+
+    # Windows of 5 seconds
+    assert [window['samples'] for window in result['windows']] == [5000] * 4
+    assert result['windows'][1]['max_us'] == latencies[5000:10000].max()
+    assert result['windows'][2]['mean_us'] == pytest.approx(latencies[10000:15000].mean())
+
+    # Counts at or below edges on both sides of the dense limit
+    edges = [-1, 0, 500, DENSE_LIMIT - 1, DENSE_LIMIT, DENSE_LIMIT * 4, DENSE_LIMIT * 100]
+    assert analyzer.count_at_or_below(edges).tolist() == [int(np.count_nonzero(latencies <= edge)) for edge in edges]
+
+
+def test_latency_analyzer_gaps():
+    # Samples arrive every millisecond in batches of 2 sharing a timestamp, with gaps of 5 ms and 10 ms
+    # (4 and 9 samples dropped), the second one spanning a chunk boundary
+    batches = np.concatenate((np.arange(0, 100), np.arange(104, 200), np.arange(209, 300))) * 1000
+    timestamps = np.repeat(batches, 2)
+    latencies = np.full(len(timestamps), 800)
+
+    for interval_us in (None, 1000):
+        analyzer = LatencyAnalyzer('gaps', gap_factor=3.0, interval_us=interval_us)
+        analyzer.add(timestamps[:391], latencies[:391])
+        analyzer.add(timestamps[391:], latencies[391:])
+        result = analyzer.result()
+
+        assert result['interval_us'] == 1000
+        assert result['gaps'] == 2
+        assert result['gap_total_s'] == pytest.approx(0.015)
+        assert result['dropped_estimate'] == 13
+        assert result['longest_gaps'] == [{'start_us': 199000, 'length_s': 0.01}, {'start_us': 99000, 'length_s': 0.005}]
+        assert result['duration_s'] == pytest.approx(0.299)
+
+
+def test_latency_analyzer_histogram():
+    analyzer = LatencyAnalyzer('histogram')
+    analyzer.add([0, 1, 2, 3, 4], [10, 10, 20, 30, 40])
+    result = analyzer.result(bins=3)
+
+    # The first bin includes the minimum, each bin includes its upper edge
+    assert result['histogram'] == {'edges_us': [10.0, 20.0, 30.0, 40.0], 'counts': [3, 1, 1]}
+    assert result['cdf']['fraction'] == [0.4, 0.6, 0.8, 1.0]
+
+    # Samples above the 99.99th percentile are counted in the last bin
+    analyzer = LatencyAnalyzer('outlier')
+    latencies = np.r_[np.arange(20000) % 100 + 100, DENSE_LIMIT * 2]
+    analyzer.add(np.arange(len(latencies)), latencies)
+    result = analyzer.result(bins=10)
+    assert result['histogram']['edges_us'][0] == 100 and result['histogram']['edges_us'][-1] == 199
+    assert sum(result['histogram']['counts']) == len(latencies)
+    assert result['histogram']['counts'][-1] == 10 * 200 + 1  # 190-199 and the outlier
+    assert result['cdf']['fraction'][-1] == pytest.approx(20000 / 20001)
+
+    assert LatencyAnalyzer('empty').result() == {'name': 'empty', 'samples': 0}
+
+
+def test_analyze_file(tmp_path):
+    timestamps, latencies = sample_session(5000, seed=1)
+    with RecordingWriter(tmp_path / 'session.rec', 'latency') as writer:
+        writer.append(timestamp_us=timestamps, latency_us=latencies)
+
+    # Chunked file analysis gives the same results as the whole session at once
+    analyzer = LatencyAnalyzer('session.rec')
+    analyzer.add(timestamps, latencies)
+    expected = analyzer.result()
+    result = analyze_file(tmp_path / 'session.rec', chunk_size=700)
+    assert result['percentiles_us'] == expected['percentiles_us']
+    assert result['mean_us'] == pytest.approx(expected['mean_us'])
+    assert result['histogram'] == expected['histogram']
+    assert result['windows'] == expected['windows']
@@ -0,0 +1,104 @@
+import os
+import numpy as np
+import pytest
+
+from recording import (MAGIC, PREFIX_SIZE, RecordingError, RecordingWriter, Recording, open_recording, is_recording,
+                       iter_chunks, csv_to_recording, recording_to_csv)
+
+
+def latency_columns(count, start=1_700_000_000_000_000):
+    return {'timestamp_us': start + np.arange(count, dtype=np.int64) * 1500, 'latency_us': (np.arange(count) * 37 % 5000).astype(np.uint32)}
+
+def swing_columns(count):
+    # Speeds are multiples of 1/8, so they survive the CSV round trip exactly
+    return {'time_ms': np.arange(count, dtype=np.uint32) * 10, 'speed': (np.arange(count) % 24 / 8).astype(np.float32), 'is_swing': np.arange(count) % 5 == 0}
+
+
+def test_recording_roundtrip(tmp_path):
+    path = tmp_path / 'latency.rec'
+    columns = latency_columns(1000)
+    with RecordingWriter(path, 'latency', meta={'port': 'COM3'}) as writer:
+        writer.append(**{name: values[:600] for name, values in columns.items()})
+        writer.append(**{name: values[600:] for name, values in columns.items()})
+
+    with open(path, 'rb') as file:
+        assert file.read(len(MAGIC)) == MAGIC
+    assert is_recording(path)
+
+    recording = open_recording(path, 'latency')
+    assert recording.offset % 8 == 0 and recording.offset > PREFIX_SIZE
+    assert os.path.getsize(path) == recording.offset + 1000 * 12
+    assert recording.meta == {'port': 'COM3'}
+    assert isinstance(recording.records, np.memmap)
+    assert len(recording) == 1000
+    for name, values in columns.items():
+        assert np.array_equal(recording.records[name], values)
+
+    # Chunks cover every record once
+    assert [len(chunk) for chunk in recording.chunks(300)] == [300, 300, 300, 100]
+    assert np.array_equal(np.concatenate(list(iter_chunks(path, 'latency', 400)))['latency_us'], columns['latency_us'])
+
+    # Kinds and layouts are checked
+    with pytest.raises(RecordingError):
+        open_recording(path, 'swing')
+    with pytest.raises(RecordingError):
+        RecordingWriter(path, 'swing')
+    with pytest.raises(ValueError):
+        RecordingWriter(tmp_path / 'other.rec', 'latency').append(timestamp_us=[1, 2], latency_us=[1])
+
+    # Empty recordings and files that aren't recordings
+    RecordingWriter(tmp_path / 'empty.rec', 'swing').close()
+    assert len(open_recording(tmp_path / 'empty.rec')) == 0
+    (tmp_path / 'text.rec').write_text('Latency: 5 microseconds\n')
+    assert not is_recording(tmp_path / 'text.rec')
+    with pytest.raises(RecordingError):
+        Recording(tmp_path / 'text.rec')
+
+
+def test_recording_truncated(tmp_path):
+    path = tmp_path / 'swing.rec'
+    columns = swing_columns(100)
+    with RecordingWriter(path, 'swing') as writer:
+        writer.append(**columns)
+
+    # A crash in the middle of a record leaves part of it at the end of the file, which readers ignore
+    with open(path, 'ab') as file:
+        file.write(b'\x01\x02\x03\x04\x05')
+    recording = open_recording(path)
+    assert len(recording) == 100
+    assert np.array_equal(recording.records['speed'], columns['speed'])
+    del recording
+
+    # Appending drops the partial record, so new records stay aligned
+    with RecordingWriter(path, 'swing') as writer:
+        writer.append(time_ms=5000, speed=1.5, is_swing=True)
+    recording = open_recording(path)
+    assert len(recording) == 101
+    assert recording.records[-1].tolist() == (5000, 1.5, 1)
+    assert np.array_equal(recording.records['time_ms'][:100], columns['time_ms'])
+
+
+@pytest.mark.parametrize('kind, columns', [('latency', latency_columns(2500)), ('swing', swing_columns(2500))])
+def test_recording_csv_roundtrip(tmp_path, kind, columns):
+    path = tmp_path / 'session.rec'
+    with RecordingWriter(path, kind) as writer:
+        writer.append(**columns)
+
+    # Recording to CSV and back gives the same records
+    assert recording_to_csv(path, tmp_path / 'session.csv', chunk_size=1000) == 2500
+    assert csv_to_recording(tmp_path / 'session.csv', tmp_path / 'copy.rec', kind, chunk_size=1000) == 2500
+    copy = open_recording(tmp_path / 'copy.rec', kind)
+    assert copy.meta == {'source': 'session.csv'}
+    for name, values in columns.items():
+        assert np.array_equal(copy.records[name], values)
+
+    # Converting into an existing recording appends
+    assert csv_to_recording(tmp_path / 'session.csv', tmp_path / 'copy.rec', kind) == 2500
+    assert len(open_recording(tmp_path / 'copy.rec')) == 5000
+
+
+def test_recording_swing_csv_without_header(tmp_path):
+    # Swing CSVs captured straight from the paddle's serial output have no header
+    (tmp_path / 'swings.csv').write_text('0,0.25,0\n10,0.75,1\n\n20,1.5,1\n')
+    assert csv_to_recording(tmp_path / 'swings.csv', tmp_path / 'swings.rec', 'swing') == 3
+    assert open_recording(tmp_path / 'swings.rec').records.tolist() == [(0, 0.25, 0), (10, 0.75, 1), (20, 1.5, 1)]
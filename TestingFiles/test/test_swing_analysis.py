@@ -0,0 +1,81 @@
+import numpy as np
+
+from recording import RecordingWriter
+from swing_analysis import compare_detection, detect_swings, flag_starts, match_swings, summarize, sweep, swing_flags
+
+
+def swing_series():
+    # 190 samples 10 ms apart
+    speeds = np.zeros(190, dtype=np.float32)
+    speeds[1:5] = [0.7, 0.9, 0.7, 0.8]   # equal to the threshold: can't start a swing, doesn't end one
+    speeds[5] = 0.6                      # below the threshold: ends the swing
+    speeds[55:] = 1.0                    # above the threshold until the end
+    return np.arange(190, dtype=np.int64) * 10, speeds
+
+
+def test_detect_swings():
+    times, speeds = swing_series()
+
+    # The first swing starts above the threshold and ends on the first sample below it (t=50).
+    # The next starts after more than 500 ms (t=560, not t=550), ends once it has lasted more than 700 ms (t=1270, not t=1260),
+    # and the last starts after the cooldown following that and is still active at the end
+    starts, ends = detect_swings(times, speeds, 0.7, 500, 700)
+    assert starts.tolist() == [2, 56, 178]
+    assert ends.tolist() == [5, 127, 190]
+
+    # Without a cooldown, the sample that ended a swing (still above the threshold) can't start the next one
+    starts, ends = detect_swings(times, speeds, 0.7, 0, 700)
+    assert starts.tolist() == [2, 55, 127]
+    assert ends.tolist() == [5, 126, 190]
+
+    # A higher threshold ignores the short peak
+    starts, ends = detect_swings(times, speeds, 0.95, 500, 700)
+    assert starts.tolist() == [55, 177]
+    assert ends.tolist() == [126, 190]
+
+    starts, ends = detect_swings(times[:0], speeds[:0])
+    assert starts.tolist() == ends.tolist() == []
+
+
+def test_swing_flags():
+    flags = swing_flags(10, np.array([1, 6]), np.array([3, 10]))
+    assert flags.tolist() == [False, True, True, False, False, False, True, True, True, True]
+    assert flag_starts(flags).tolist() == [1, 6]
+    assert flag_starts(np.zeros(0, dtype=bool)).tolist() == []
+
+
+def test_match_swings():
+    # Starts match within the tolerance (inclusive), each reference swing at most once
+    assert match_swings(np.array([100, 500, 1000]), np.array([140, 560, 1000, 2000]), 50) == 2
+    assert match_swings(np.array([500]), np.array([550]), 50) == 1
+    assert match_swings(np.array([100, 110]), np.array([105]), 50) == 1
+    assert match_swings(np.array([], dtype=np.int64), np.array([105]), 50) == 0
+
+
+def test_compare_detection():
+    times, speeds = swing_series()
+
+    # The firmware prints its swing flag before handling each sample, so its flags lag one sample behind
+    starts, ends = detect_swings(times, speeds)
+    firmware_flags = swing_flags(len(times), starts + 1, np.minimum(ends + 1, len(times)))
+    result = summarize(compare_detection(times, speeds, firmware_flags, 0.7, 500, tolerance_ms=10))
+    assert (result['detected'], result['firmware'], result['matched']) == (3, 3, 3)
+    assert result['f1'] == 1.0
+    assert result['agreement'] == (190 - 5) / 190
+    assert result['max_peak_speed'] == 1.0
+
+
+def test_sweep(tmp_path):
+    times, speeds = swing_series()
+    starts, ends = detect_swings(times, speeds)
+    with RecordingWriter(tmp_path / 'session.rec', 'swing') as writer:
+        writer.append(time_ms=times, speed=speeds, is_swing=swing_flags(len(times), starts, ends))
+
+    results = sweep([str(tmp_path / 'session.rec')], [0.7, 0.95], [0, 500], workers=1)
+    assert [(result['threshold'], result['cooldown_ms']) for result in results][0] == (0.7, 500)
+    assert len(results) == 4
+    best = results[0]
+    assert (best['sessions'], best['samples'], best['detected'], best['matched']) == (1, 190, 3, 3)
+    assert best['f1'] == best['agreement'] == 1.0
+    assert {(result['threshold'], result['cooldown_ms']): result['detected'] for result in results} == \
+        {(0.7, 500): 3, (0.7, 0): 3, (0.95, 500): 2, (0.95, 0): 2}
@@ -1,38 +1,101 @@
 import os
 import sqlite3
+import calendar
 import hashlib
 import base64
 import string
+import math
 import time
+from collections import OrderedDict
+
+from .database_schema import params_schema, compile_schema
+from .database_export import ExportStream
+from .database_swings import encode_swings, decode_swings, downsample_swings
 
 class restAPI:
     """A RESTful API for the database server of PicklePals. Also controls the SQLite database directly"""
 
     API_KEY_TIMEOUT = 30 * 60
+    IDEMPOTENCY_KEY_TIMEOUT = 24 * 60 * 60
     ADMIN_USER = 0
     UNKNOWN_USER = -1
 
+    # Route table, keyed by endpoint name (the URI after 'pickle/' with '/' replaced by '_', the same as the "_api_" function name)
+    #   auth: whether an API key is required (if authentication is enabled)
+    #   readOnly: True if the endpoint never modifies the database or server state (e.g. the profiler settings and results)
+    #   cacheable: True if the response only depends on the parameters and the database contents
+    #   rateLimit: the RateLimiter limit class for the endpoint
+    ROUTES = {
+        'user_getUsername':  {'auth':True,  'readOnly':True,  'cacheable':True,  'rateLimit':'default'},
+        'user_getStats':     {'auth':True,  'readOnly':True,  'cacheable':True,  'rateLimit':'default'},
+        'user_setUsername':  {'auth':True,  'readOnly':False, 'cacheable':False, 'rateLimit':'default'},
+        'user_create':       {'auth':False, 'readOnly':False, 'cacheable':False, 'rateLimit':'auth'},
+        'user_delete':       {'auth':True,  'readOnly':False, 'cacheable':False, 'rateLimit':'default'},
+        'user_id':           {'auth':True,  'readOnly':True,  'cacheable':True,  'rateLimit':'default'},
+        'user_friends':      {'auth':True,  'readOnly':True,  'cacheable':True,  'rateLimit':'default'},
+        'user_addFriend':    {'auth':True,  'readOnly':False, 'cacheable':False, 'rateLimit':'default'},
+        'user_removeFriend': {'auth':True,  'readOnly':False, 'cacheable':False, 'rateLimit':'default'},
+        'user_games':        {'auth':True,  'readOnly':True,  'cacheable':True,  'rateLimit':'default'},
+        'user_auth':         {'auth':False, 'readOnly':True,  'cacheable':False, 'rateLimit':'auth'},
+        'user_auth_renew':   {'auth':False, 'readOnly':True,  'cacheable':False, 'rateLimit':'auth'},
+        'user_logout':       {'auth':True,  'readOnly':True,  'cacheable':False, 'rateLimit':'default'},
+        'game_get':          {'auth':True,  'readOnly':True,  'cacheable':True,  'rateLimit':'default'},
+        'game_stats':        {'auth':True,  'readOnly':True,  'cacheable':True,  'rateLimit':'default'},
+        'game_register':     {'auth':True,  'readOnly':False, 'cacheable':False, 'rateLimit':'default'},
+        'game_registerStats':{'auth':True,  'readOnly':False, 'cacheable':False, 'rateLimit':'default'},
+        'game_import':       {'auth':True,  'readOnly':False, 'cacheable':False, 'rateLimit':'default'},
+        'game_registerSwings':{'auth':True, 'readOnly':False, 'cacheable':False, 'rateLimit':'default'},
+        'game_swings':       {'auth':True,  'readOnly':True,  'cacheable':True,  'rateLimit':'default'},
+        'admin_profile':     {'auth':True,  'readOnly':False, 'cacheable':False, 'rateLimit':'default'},
+        'admin_profileResults':{'auth':True, 'readOnly':False, 'cacheable':False, 'rateLimit':'default'},
+        'admin_queryStats':  {'auth':True,  'readOnly':True,  'cacheable':False, 'rateLimit':'default'},
+        'admin_export':      {'auth':True,  'readOnly':True,  'cacheable':False, 'rateLimit':'default'},
+        'admin_archive':     {'auth':True,  'readOnly':False, 'cacheable':False, 'rateLimit':'default'},
+        'coffee':            {'auth':False, 'readOnly':True,  'cacheable':False, 'rateLimit':'default'},
+    }
+
+    # Parameters of a single game, shared by pickle/game/register and bulk imports
+    GAME_SCHEMA = {'timestamp':'int', 'game_type':'int', 'winner_id':'int', 'loser_id':'int', 'winner_points':'int', 'loser_points':'int'}
+
+    # Max number of values bound in a single "IN (...)" query, older SQLite builds are limited to 999
+    SQL_CHUNK_SIZE = 500
+
+    # Max number of archive databases attached at once, SQLite allows 10 attached databases by default
+    MAX_ATTACHED_ARCHIVES = 8
+
+    # Default max number of swings returned by pickle/game/swings when downsampling for charts
+    SWING_CHART_POINTS = 200
+
+    # Per-swing series of a user in a game, packed by database_swings (also created in archives)
+    GAME_SWINGS_TABLE = 'game_swings(user_id INT, game_id INT, swing_count INT, swings BLOB)'
+
     class APIError(Exception):
         """An error triggered by the restAPI itself, including an HTTP error code"""
 
-        def __init__(self, message: str, code: int):
+        def __init__(self, message: str, code: int, headers: dict = None):
             """Creates an exception for an error triggered by the database, including HTTP error code
 
             Args:
                 message (str): Message to include in the exception
                 code (int): HTTP status code to send with the response message
+                headers (dict, optional): Extra HTTP headers to send with the response, e.g. Retry-After. Defaults to None.
             """
             self.message = message
             self.code = code
+            self.headers = headers or {}
             super().__init__(self.message)
 
 
-    def __init__(self, dbFile:str = 'pickle.db', useAuth:bool = True, clearDB:bool = False):
+    def __init__(self, dbFile:str = 'pickle.db', useAuth:bool = True, clearDB:bool = False, rateLimiter = None, profiler = None, queryRecorder = None):
         """Creates a RESTful API instance and loads an attached SQLite database
 
         Args:
             dbFile (str, optional): Filepath to the SQLite database file. Defaults to 'pickle.db' in the pwd.
             useAuth (bool, optional): Set to False to disable authentication checks. Defaults to True.
+            clearDB (bool, optional): Set to True to erase the database file before loading. Defaults to False.
+            rateLimiter (RateLimiter, optional): Rate limiter applied to requests in handle_request. Defaults to None (no rate limiting).
+            profiler (RequestProfiler, optional): Profiler for requests in handle_request, controlled through pickle/admin/profile. Defaults to None (no profiling).
+            queryRecorder (QueryRecorder, optional): Records the SQL statements of each request, reported by pickle/admin/queryStats. Defaults to None (no SQL instrumentation).
         """
         self.dbFile = dbFile
 
@@ -40,44 +103,59 @@ class restAPI:
         if clearDB and os.path.isfile(dbFile):
             os.remove(dbFile)
 
-        self._database = sqlite3.connect(dbFile)
-        self._dbCursor = self._database.cursor()
         self._useAuth = useAuth
+        self._rateLimiter = rateLimiter
+        self._profiler = profiler
+        self._queryRecorder = queryRecorder
+        self._database = sqlite3.connect(dbFile)
+        self._dbCursor = self._new_cursor()
         self.__apiKeys = {}
         self.__renewalKeys = {}
+        self.__userSessions = {}
         self.__user_cache = set()
+        self.__friends = {}
+        self.__archives = {}
+        self.__attached = OrderedDict()
+        self._routes = self._compile_routes()
 
         # If the database is uninitialized, initialize it
         self._dbCursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE type='table'")
         if self._dbCursor.fetchone()[0] == 0:
             self._init_db()
 
+        self._create_indexes()
+        self._load_friend_graph()
+        self._load_archives()
+
         
-    def handle_request(self, uri:str, params:dict, api_key:str = None):
+    def handle_request(self, uri:str, params:dict, api_key:str = None, client_addr:str = None):
         """Handles an API request given a url endpoint and parameters
 
         Args:
             url (str): The api endpoint to post to, in URL format. should start with '/pickle/'
             params (dict): Dictionary of parameters used by the endpoint
             api_key (str, optional): API key for authenticating user. Defaults to None (unauthenticated).
+            client_addr (str, optional): Network address of the client, used for rate limiting. Defaults to None.
 
         Raises:
             self.APIError: Any error triggered by the API itself, such as invalid user ID or authentication required
 
         Returns:
-            dict: dictionary of return values (dependent on endpoint)
+            dict: dictionary of return values (dependent on endpoint), or bytes/str/ExportStream for file downloads such as profiler results
         """
         try:
-            # Check that the base of the URI is pickle/
-            uri_parts = uri[1:].split('/',1)
-            if uri_parts[0] != 'pickle':
-                raise self.APIError(f'Base endpoint must be "pickle/": {uri_parts[0]}', 404)
-            
-            # Replace '/' in URI with '_', as that's the convention used for naming api endpoint functions
-            endpoint = uri_parts[1].replace('/', '_')
+            # Look up the endpoint function and route metadata, using the URI as-is for the common case
+            route = self._routes.get(uri)
+            if route is None:
+                route = self._find_route(uri)
+            func, meta = route
+
+            # Rate limit by client address before doing any other work (including checking API keys)
+            if client_addr is not None:
+                self._check_rate_limit(meta['rateLimit'], ('ip', client_addr))
 
             # Check if authentication is required (if it's enabled and if the endpoint requires it)
-            if self._useAuth and (endpoint not in ("user_create", "user_auth", "user_auth_renew", "coffee")):
+            if self._useAuth and meta['auth']:
                 if not api_key:
                     raise self.APIError('Authentication required, please obtain an API key through pickle/user/auth', 401)
 
@@ -87,14 +165,24 @@ class restAPI:
 
                 if sender_id == None:
                     raise self.APIError('API key not recognized, could be out of date or server has restarted. Try requesting another one with pickle/user/auth', 401)
-            
-            # Get the endpoint function, which will be named "self._api_" plus the endpoint URI without pickle and with '/' replaced by '_'
-            func = getattr(self, "_api_" + endpoint, None)
-            if func:
+
+                # Rate limit by user, so one user can't get around the limit by using multiple addresses
+                self._check_rate_limit(meta['rateLimit'], ('user', sender_id))
+
+            endpoint = func.__name__[len('_api_'):]
+            if self._queryRecorder is not None:
+                self._queryRecorder.begin(endpoint)
+
+            try:
+                # Profile the request if it's been chosen by the profiler (except requests controlling the profiler itself)
+                if self._profiler is not None and self._profiler.should_profile(endpoint) and not endpoint.startswith('admin_'):
+                    return self._profiler.run(endpoint, func, params)
+
                 return func(params)
-            
-            else:
-                raise self.APIError(f'Endpoint not found: {uri}', 404)
+
+            finally:
+                if self._queryRecorder is not None:
+                    self._queryRecorder.end()
         
         except Exception as error:
             # If any exception happens, we want to delete the input parameters and API key for security
@@ -103,6 +191,45 @@ class restAPI:
             raise error
 
 
+    def _compile_routes(self):
+        # Builds the dispatch table once, mapping the URI of each endpoint to its function and route metadata
+        routes = {}
+        for endpoint, meta in self.ROUTES.items():
+            # Endpoint functions are named "self._api_" plus the endpoint URI without pickle and with '/' replaced by '_'
+            func = getattr(self, "_api_" + endpoint)
+            route = (func, meta)
+            routes['/pickle/' + endpoint] = route
+            routes['/pickle/' + endpoint.replace('_', '/')] = route
+        return routes
+
+
+    def _find_route(self, uri:str):
+        # Slow path for URIs that aren't in the dispatch table as-is, mixing '/' and '_' (e.g. /pickle/user/auth_renew)
+        # Check that the base of the URI is pickle/
+        uri_parts = uri[1:].split('/',1)
+        if uri_parts[0] != 'pickle':
+            raise self.APIError(f'Base endpoint must be "pickle/": {uri_parts[0]}', 404)
+
+        # Replace '/' in URI with '_', as that's the convention used for naming api endpoint functions
+        endpoint = uri_parts[1].replace('/', '_') if len(uri_parts) > 1 else ''
+        route = self._routes.get('/pickle/' + endpoint)
+        if route is None:
+            raise self.APIError(f'Endpoint not found: {uri}', 404)
+
+        return route
+
+
+    def _check_rate_limit(self, limit_class:str, key):
+        # Takes a token from the client's rate limit bucket, raises a 429 error with Retry-After if it's empty
+        if self._rateLimiter is None:
+            return
+
+        retry_after = self._rateLimiter.consume(limit_class, key)
+        if retry_after:
+            retry_after = math.ceil(retry_after)
+            raise self.APIError(f'Too many requests, try again in {retry_after} seconds', 429, {'Retry-After':str(retry_after)})
+
+
     def _init_db(self):
         # Initializes the SQLite database from scratch (create all tables)
         self._dbCursor.execute('CREATE TABLE users(user_id INT, username TEXT, passwordHash BLOB, salt BLOB, valid INT, gamesPlayed INT, gamesWon INT, averageScore REAL)')
@@ -116,6 +243,191 @@ class restAPI:
         self._database.commit()
         
         
+    def _create_indexes(self):
+        # Creates indexes used for user lookups, duplicate game detection, per-user game queries and time range exports (also added to existing databases)
+        self._dbCursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS users_id ON users(user_id)')
+        self._dbCursor.execute('CREATE INDEX IF NOT EXISTS users_username ON users(username)')
+        self._dbCursor.execute('CREATE INDEX IF NOT EXISTS games_hash ON games(hash)')
+        self._dbCursor.execute('CREATE INDEX IF NOT EXISTS games_winner ON games(winner_id)')
+        self._dbCursor.execute('CREATE INDEX IF NOT EXISTS games_loser ON games(loser_id)')
+        self._dbCursor.execute('CREATE INDEX IF NOT EXISTS games_timestamp ON games(timestamp)')
+        self._dbCursor.execute('CREATE INDEX IF NOT EXISTS games_id ON games(game_id)')
+        self._dbCursor.execute('CREATE INDEX IF NOT EXISTS user_game_stats_game ON user_game_stats(game_id)')
+
+        # Per-swing series, stored in the same database as their game
+        self._dbCursor.execute(f'CREATE TABLE IF NOT EXISTS {self.GAME_SWINGS_TABLE}')
+        self._dbCursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS game_swings_game ON game_swings(game_id, user_id)')
+
+        # Completed game submissions by idempotency key, so retried submissions return the original game
+        self._dbCursor.execute('CREATE TABLE IF NOT EXISTS idempotency_keys(user_id INT, key TEXT, hash TEXT, game_id INT, expiration INT)')
+        self._dbCursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idempotency_keys_key ON idempotency_keys(user_id, key)')
+        self._dbCursor.execute('CREATE INDEX IF NOT EXISTS idempotency_keys_expiration ON idempotency_keys(expiration)')
+        self._database.commit()
+
+
+    def _load_archives(self):
+        # Loads the list of per-year archive databases made by archiveGames (creating the tables that track them if needed)
+        self._dbCursor.execute('CREATE TABLE IF NOT EXISTS archives(year INT, min_game_id INT, max_game_id INT)')
+        self._dbCursor.execute('CREATE TABLE IF NOT EXISTS archived_user_stats(user_id INT, gamesPlayed INT, gamesWon INT, pointsTotal INT)')
+        self._dbCursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS archived_user_stats_id ON archived_user_stats(user_id)')
+        self._database.commit()
+
+        self._dbCursor.execute('SELECT year, min_game_id, max_game_id FROM archives ORDER BY year')
+        self.__archives = {row[0]: row[1:] for row in self._dbCursor.fetchall()}
+        self.__attached.clear()
+
+
+    def _archive_path(self, year:int):
+        # Archives are stored next to the main database, e.g. pickle_2024.db for pickle.db
+        base, ext = os.path.splitext(os.fspath(self.dbFile))
+        return f'{base}_{year}{ext or ".db"}'
+
+
+    @staticmethod
+    def _year_bounds(year:int):
+        # (start, end) unix timestamps of a UTC year, end is exclusive
+        return calendar.timegm((year, 1, 1, 0, 0, 0)), calendar.timegm((year + 1, 1, 1, 0, 0, 0))
+
+
+    def _attach_archive(self, year:int):
+        # Attaches the archive database of a year if it isn't already, detaching the least recently used archive
+        # if too many are attached. Must be called outside of a transaction. Returns the schema name of the archive
+        schema = f'archive_{year}'
+        if schema in self.__attached:
+            self.__attached.move_to_end(schema)
+            return schema
+
+        while len(self.__attached) >= self.MAX_ATTACHED_ARCHIVES:
+            old_schema, _ = self.__attached.popitem(last=False)
+            self._dbCursor.execute(f'DETACH DATABASE {old_schema}')
+
+        self._dbCursor.execute(f'ATTACH DATABASE ? AS {schema}', (self._archive_path(year),))
+        self.__attached[schema] = year
+
+        # Archives made before per-swing series were stored don't have the table yet
+        self._dbCursor.execute(f'CREATE TABLE IF NOT EXISTS {schema}.{self.GAME_SWINGS_TABLE}')
+        self._dbCursor.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS {schema}.game_swings_game ON game_swings(game_id, user_id)')
+        return schema
+
+
+    def _archive_years(self, min_time:int = None, max_time:int = None):
+        # Years of the archives that can hold games in a time range, archives outside the range are skipped
+        years = []
+        for year in self.__archives:
+            start, end = self._year_bounds(year)
+            if (min_time is None or min_time < end) and (max_time is None or max_time >= start):
+                years.append(year)
+        return years
+
+
+    def _game_partitions(self, min_time:int = None, max_time:int = None, oldest_first:bool = False):
+        # Routes a time range to the databases that can hold its games, yielding schema names: the current database first, then
+        # the archives of years in the range (or the archives first, oldest year first, then the current database if oldest_first).
+        # Archives are attached as they're reached (possibly detaching earlier ones), so each partition must be queried before moving on to the next
+        if not oldest_first:
+            yield 'main'
+        for year in self._archive_years(min_time, max_time):
+            yield self._attach_archive(year)
+        if oldest_first:
+            yield 'main'
+
+
+    def _find_game(self, game_id:int):
+        # Routes a game ID to the database holding it, checking the current database first, then archives whose game ID range includes it.
+        # Returns (schema name, game row), or (None, None) if the game doesn't exist
+        self._dbCursor.execute("SELECT * FROM main.games WHERE game_id=?", (game_id,))
+        game = self._dbCursor.fetchone()
+        if game:
+            return 'main', game
+
+        for year, (min_game_id, max_game_id) in self.__archives.items():
+            if min_game_id <= game_id <= max_game_id:
+                schema = self._attach_archive(year)
+                self._dbCursor.execute(f"SELECT * FROM {schema}.games WHERE game_id=?", (game_id,))
+                game = self._dbCursor.fetchone()
+                if game:
+                    return schema, game
+
+        return None, None
+
+
+    def archiveGames(self, before: int):
+        """Moves games from before a timestamp, and their user game stats, out of the current database into per-year archive
+        databases next to it (e.g. pickle_2024.db). Archived games are still returned by every endpoint, but queries on recent
+        games only touch the smaller current database. Each year is moved in its own transaction.
+
+        Args:
+            before (int): unix timestamp, games before it are archived
+
+        Returns:
+            dict: number of games archived, keyed by year
+        """
+        self._dbCursor.execute("SELECT MIN(timestamp) FROM games WHERE timestamp < ?", (before,))
+        first_time = self._dbCursor.fetchone()[0]
+        if first_time is None:
+            return {}
+
+        archived = {}
+        for year in range(time.gmtime(first_time).tm_year, time.gmtime(before - 1).tm_year + 1):
+            start, end = self._year_bounds(year)
+            end = min(end, before)
+
+            self._dbCursor.execute("SELECT COUNT(*) FROM games WHERE timestamp >= ? AND timestamp < ?", (start, end))
+            count = self._dbCursor.fetchone()[0]
+            if not count:
+                continue
+
+            schema = self._attach_archive(year)
+            try:
+                # Archives have the same tables as the current database, with indexes for the lookups routed to them
+                self._dbCursor.execute(f'CREATE TABLE IF NOT EXISTS {schema}.games(game_id INT, timestamp INT, game_type INT, winner_id INT, loser_id INT, winner_points INT, loser_points INT, hash TEXT)')
+                self._dbCursor.execute(f'CREATE TABLE IF NOT EXISTS {schema}.user_game_stats(user_id INT, game_id INT, swing_count INT, swing_hits INT, swing_max REAL, Q1_hits INT, Q2_hits INT, Q3_hits INT, Q4_hits INT)')
+                for index, columns in (('games_id', 'games(game_id)'), ('games_hash', 'games(hash)'), ('games_winner', 'games(winner_id)'),
+                                       ('games_loser', 'games(loser_id)'), ('games_timestamp', 'games(timestamp)'), ('user_game_stats_game', 'user_game_stats(game_id)')):
+                    self._dbCursor.execute(f'CREATE INDEX IF NOT EXISTS {schema}.{index} ON {columns}')
+
+                games = "SELECT game_id FROM main.games WHERE timestamp >= ? AND timestamp < ?"
+                self._dbCursor.execute(f"INSERT INTO {schema}.games SELECT * FROM main.games WHERE timestamp >= ? AND timestamp < ?", (start, end))
+                self._dbCursor.execute(f"INSERT INTO {schema}.user_game_stats SELECT * FROM main.user_game_stats WHERE game_id IN ({games})", (start, end))
+                self._dbCursor.execute(f"INSERT INTO {schema}.game_swings SELECT * FROM main.game_swings WHERE game_id IN ({games})", (start, end))
+
+                # Keep per-user totals of archived games in the current database, so user stats never need to read the archives
+                self._dbCursor.execute(
+                    "INSERT INTO archived_user_stats SELECT user_id, COUNT(*), SUM(won), SUM(points) FROM ("
+                    "SELECT winner_id AS user_id, 1 AS won, winner_points AS points FROM main.games WHERE timestamp >= ? AND timestamp < ? "
+                    "UNION ALL SELECT loser_id, 0, loser_points FROM main.games WHERE timestamp >= ? AND timestamp < ?"
+                    ") WHERE true GROUP BY user_id ON CONFLICT(user_id) DO UPDATE SET gamesPlayed=gamesPlayed+excluded.gamesPlayed, "
+                    "gamesWon=gamesWon+excluded.gamesWon, pointsTotal=pointsTotal+excluded.pointsTotal", (start, end, start, end))
+
+                self._dbCursor.execute(f"DELETE FROM main.user_game_stats WHERE game_id IN ({games})", (start, end))
+                self._dbCursor.execute(f"DELETE FROM main.game_swings WHERE game_id IN ({games})", (start, end))
+                self._dbCursor.execute("DELETE FROM main.games WHERE timestamp >= ? AND timestamp < ?", (start, end))
+
+                self._dbCursor.execute("DELETE FROM archives WHERE year=?", (year,))
+                self._dbCursor.execute(f"INSERT INTO archives SELECT ?, MIN(game_id), MAX(game_id) FROM {schema}.games", (year,))
+                self._database.commit()
+
+            except Exception:
+                self._database.rollback()
+                raise
+
+            archived[year] = count
+            self._dbCursor.execute('SELECT min_game_id, max_game_id FROM archives WHERE year=?', (year,))
+            self.__archives[year] = self._dbCursor.fetchone()
+
+        self.__archives = dict(sorted(self.__archives.items()))
+        return archived
+
+
+    def _load_friend_graph(self):
+        # Loads the friends table into memory as a graph of friend ID sets keyed by user ID, for fast permission checks
+        self.__friends = {}
+        self._dbCursor.execute("SELECT userA, userB FROM friends")
+        for userA, userB in self._dbCursor.fetchall():
+            self.__friends.setdefault(userA, set()).add(userB)
+            self.__friends.setdefault(userB, set()).add(userA)
+
+
     def _check_username(self, username: str):
         # Must be between 5 and 25 characters long
         if not 5 <= len(username) <=25:
@@ -201,9 +513,9 @@ class restAPI:
     
 
     def _are_users_friends(self, userA: int, userB: int):
-        # Checks if two users are friends
-        self._dbCursor.execute("SELECT * FROM friends WHERE (userA=? AND userB=?) OR (userA=? AND userB=?)", (userA, userB, userB, userA))
-        return True if self._dbCursor.fetchone() else False
+        # Checks if two users are friends (using the in-memory friend graph)
+        friends = self.__friends.get(userA)
+        return friends is not None and userB in friends
     
 
     def _user_canView(self, sender_id: int, user_id: int):
@@ -280,15 +592,49 @@ class restAPI:
         renew_key = base64.b64encode(rand_val).decode('utf-8')
 
         # Prevent duplicates by continuously generating new keys until a non-duplicate is found
-        while api_key in self.__renewalKeys:
+        while renew_key in self.__renewalKeys:
             rand_val = os.urandom(12)
             renew_key = base64.b64encode(rand_val).decode('utf-8')
 
         # Store renewal key within local private dictionary
         self.__renewalKeys[renew_key] = user_id
+
+        # Index both keys by user, so all of a user's sessions can be found without scanning every key
+        sessions = self.__userSessions.setdefault(user_id, {'apiKeys':set(), 'renewalKeys':set()})
+        sessions['apiKeys'].add(api_key)
+        sessions['renewalKeys'].add(renew_key)
         return api_key, renew_key
     
 
+    def _revoke_ApiKey(self, api_key:str, renew_key:str):
+        # Removes a single API/renewal key pair (one session), including from the user session index
+        user_id = self.__renewalKeys.pop(renew_key, None)
+        key_info = self.__apiKeys.pop(api_key, None)
+        if key_info:
+            user_id = key_info['user_id']
+
+        sessions = self.__userSessions.get(user_id)
+        if sessions:
+            sessions['apiKeys'].discard(api_key)
+            sessions['renewalKeys'].discard(renew_key)
+            if not sessions['apiKeys'] and not sessions['renewalKeys']:
+                del self.__userSessions[user_id]
+
+
+    def _revoke_user_sessions(self, user_id:int):
+        # Removes every API and renewal key belonging to a user (i.e. logs them out everywhere), returns the number of API keys removed
+        sessions = self.__userSessions.pop(user_id, None)
+        if not sessions:
+            return 0
+
+        for api_key in sessions['apiKeys']:
+            self.__apiKeys.pop(api_key, None)
+        for renew_key in sessions['renewalKeys']:
+            self.__renewalKeys.pop(renew_key, None)
+
+        return len(sessions['apiKeys'])
+    
+
     def _checkApiKey(self, apiKey:str):
         # Checks if an API is registered, and if so returns the associated user ID
         # Also checks if the API key has expired, and raises an exception if so
@@ -299,8 +645,7 @@ class restAPI:
         elif time.time() <  key_info['expiration']:
             user_id = key_info['user_id']
             if self._is_user_deleted(user_id):
-                self.__apiKeys.pop(apiKey)
-                self.__renewalKeys.popitem()
+                self._revoke_user_sessions(user_id)
                 raise self.APIError(f'Authentication attempted for deleted user', 401)
             
             return key_info['user_id']
@@ -308,6 +653,7 @@ class restAPI:
             raise self.APIError('API key has expired, please renew with the renewal key.', 498)
     
 
+    @params_schema(user_id='int_list')
     def _api_user_getUsername(self, params: dict):
         """Retrieves username(s) of user(s) with a given user ID(s).
 
@@ -317,22 +663,9 @@ class restAPI:
         Returns:
             dict: usernames keyed by user ID
         """
-        # Must include user_id to get any usernames
-        if 'user_id' not in params:
-            raise self.APIError(f'Invalid parameters for pickle/user/getUsername: {params}. Must include user_id as an int or list of ints.', 400)
-
-        # If single user ID passed, wrap it in a list for easier processing
-        user_ids = params['user_id']
-        if type(user_ids) is int:
-            user_ids = [user_ids]
-
-        # Check user ID was either an int (now a list) or was already a list
-        if type(user_ids) != list:
-            raise self.APIError(f'Invalid user id(s) type: {user_ids}', 400)
-
         # Loop through each user ID, adding their usernames to a dictionary for output
         result_dict = {}
-        for user_id in user_ids:
+        for user_id in params['user_id']:
             # override for unknown users (user ID -1), so the UI correctly displays their status
             if user_id == self.UNKNOWN_USER:
                 result_dict[user_id] = 'unknown_user'
@@ -350,6 +683,7 @@ class restAPI:
         return result_dict
 
 
+    @params_schema(user_id='int_list', stats='str_list?')
     def _api_user_getStats(self, params: dict):
         """Retrieves user statistics of specific user(s).
         By default, all accessible user stats be returned, but the `stats` parameter can be used to query for specific values.
@@ -357,26 +691,14 @@ class restAPI:
 
         Args:
             'user_id' (int | list(int)): user ID(s) of account(s) to retrieve stats from
+            'stats' (str | list(str)) *(optional)*: the stats to retrieve, defaults to all stats
 
         Returns:
             dict: requested stats keyed by user ID
         """
-        # Must include user_id to get any stats
-        if 'user_id' not in params:
-            raise self.APIError(f'Invalid parameters for pickle/user/getStats, must include user ID(s): {params}', 400)
-        
-        # If single user ID passed, wrap it in a list for easier processing
-        user_ids = params['user_id']
-        if type(user_ids) == int:
-            user_ids = [user_ids]
-
-        # Check user ID was either an int (now a list) or was already a list
-        if type(user_ids) != list:
-            raise self.APIError(f'Invalid user id(s) type: {user_ids}', 400)
-
         # Loop through each user ID, adding their stats to a dictionary for output
         result_dict = {}
-        for user_id in user_ids:
+        for user_id in params['user_id']:
             # Check the user is valid first
             if not self._is_user_account_valid(user_id):
                 raise self.APIError(f'User ID {user_id} is not a valid user', 404)
@@ -405,6 +727,7 @@ class restAPI:
         return result_dict
     
     
+    @params_schema(user_id='int', username='str')
     def _api_user_setUsername(self, params: dict):
         """Changes a user's username to a new one. Raises an APIError if the new username is already taken or invalid.
 
@@ -415,17 +738,10 @@ class restAPI:
         Returns:
             dict: 'success': (bool) True if the username change was successful
         """
-        # We need a user ID to know what account to change the username of
-        if 'user_id' not in params:
-            raise self.APIError(f'Invalid parameters: {params.keys}. Must include user_id', 400)
-        
-        # We need a new username for this endpoint
-        if 'username' not in params:
-            raise self.APIError(f'Invalid parameters: {params.keys}. Must include username', 400)
         username = params['username']
         
         # Check user ID is of a valid account
-        user_id = int(params['user_id'])
+        user_id = params['user_id']
         if not self._is_user_account_valid(user_id):
             raise self.APIError(f'User ID {user_id} is not a valid user', 404)
         
@@ -447,6 +763,7 @@ class restAPI:
         return {'success':True}
     
 
+    @params_schema(username='str', password='str')
     def _api_user_create(self, params: dict):
         """Creates a user account in the database with a given username and password.
 
@@ -457,9 +774,6 @@ class restAPI:
         Returns:
             dict: 'user_id': (int) the user ID of the newly created account.
         """
-        # We need a username and password to create an account
-        if 'username' not in params or 'password' not in params:
-            raise self.APIError(f'Invalid parameters for POST pickle/user: {params}. Must include username and password', 400)
         username = params['username']
         password = params['password']
 
@@ -489,6 +803,7 @@ class restAPI:
         return {'user_id':user_id}
     
 
+    @params_schema(user_id='int')
     def _api_user_delete(self, params: dict):
         """Deletes a user account from the database. This does not only remove the user ID, but instead removes the user data
         (games played/won, average score, etc), removes their password hash, and replaces their username with "deleted_user".
@@ -501,10 +816,7 @@ class restAPI:
         Returns:
             dict: 'success': (bool) True if the user was deleted
         """
-        # We need to know the user ID to delete a user
-        if 'user_id' not in params:
-            raise self.APIError(f'Invalid parameters for DELETE pickle/user, must include user ID: {params}', 400)
-        user_id = int(params['user_id'])
+        user_id = params['user_id']
 
         # Check that the user account exists and is valid
         if not self._is_user_account_valid(user_id):
@@ -514,19 +826,36 @@ class restAPI:
         if not self._user_canEdit(params.get('sender_id'), user_id):
             raise self.APIError(f'Access forbidden to user ID {user_id}', 403)
 
+        # Remove user game stats from archives, one archive at a time as they can't be attached during a transaction
+        for schema in self._game_partitions():
+            if schema != 'main':
+                self._dbCursor.execute(f"DELETE FROM {schema}.user_game_stats WHERE user_id=?", (user_id,))
+                self._dbCursor.execute(f"DELETE FROM {schema}.game_swings WHERE user_id=?", (user_id,))
+                self._database.commit()
+
         # Remove user data, all friend associations, and user game stats
+        self._dbCursor.execute("DELETE FROM archived_user_stats WHERE user_id=?", (user_id,))
         self._dbCursor.execute("UPDATE users SET username='deleted_user', passwordHash=NULL, salt=NULL, valid=0, gamesPlayed=NULL, gamesWon=NULL, averageScore=NULL WHERE user_id=?", (user_id,))
         self._dbCursor.execute("DELETE FROM friends WHERE userA=? OR userB=?", (user_id, user_id))
         self._dbCursor.execute("DELETE FROM user_game_stats WHERE user_id=?", (user_id,))
+        self._dbCursor.execute("DELETE FROM game_swings WHERE user_id=?", (user_id,))
         self._database.commit()
 
+        # Remove user from the friend graph
+        for friend_id in self.__friends.pop(user_id, ()):
+            self.__friends[friend_id].discard(user_id)
+
         # Remove user from user cache
         if user_id in self.__user_cache:
             self.__user_cache.remove(user_id)
 
+        # Log the user out of every session
+        self._revoke_user_sessions(user_id)
+
         return {'success':True}
             
     
+    @params_schema(username='str_list')
     def _api_user_id(self, params: dict):
         """Returns a user ID used by the database for a given username, if the request sender has permission to view the requested user.
 
@@ -536,19 +865,9 @@ class restAPI:
         Returns:
             dict: dictionary of user IDs keyed by username
         """
-        
-        # We need a username to grab a user ID
-        if 'username' not in params:
-            raise self.APIError('GET pickle/user/id requires the parameter "username"', 400)
-        
-        # If only a single username provided, wrap it in a list for easier processing
-        usernames = params['username']
-        if type(usernames) is not list:
-            usernames = [usernames]
-
         # Loop through each username, adding their ID to a dictionary for output
         result_dict = {}
-        for username in usernames:
+        for username in params['username']:
             # Check username is valid before we subject it to a database search
             if not self._check_username(username):
                 raise self.APIError(f'Invalid username {username}', 400)
@@ -566,6 +885,7 @@ class restAPI:
         return result_dict
         
         
+    @params_schema(user_id='int')
     def _api_user_friends(self, params: dict):
         """Returns a dictionary of users who the current user is friends with.
         The dict is keyed by user ID and contains username, games played against that user, and win rate against that user.
@@ -576,44 +896,46 @@ class restAPI:
         Returns:
             dict: keyed by user ID and contains username, games played against that user, and win rate against that user
         """
-        # We need a user ID to pull from
-        if 'user_id' not in params:
-            raise self.APIError('ERROR: pickle/user/friends must include "user_id" parameter', 400)
-        user_id = int(params['user_id'])
+        user_id = params['user_id']
 
         # Check that the user exists and is valid
         if not self._is_user_account_valid(user_id):
             raise self.APIError(f'User ID {user_id} is not a valid user', 404)
 
-        # Pull list of user IDs of all friends
-        self._dbCursor.execute("SELECT (CASE WHEN userA=? THEN userB ELSE userA END) FROM friends WHERE (userA=? OR userB=?)", (user_id, user_id, user_id,))
-        friend_list = self._dbCursor.fetchall()
+        # Pull list of user IDs of all friends from the friend graph
+        friend_list = sorted(self.__friends.get(user_id, ()))
+
+        # Count the games and wins against every opponent, in the current database and every archive
+        head_to_head = {}
+        for schema in self._game_partitions():
+            self._dbCursor.execute(f"SELECT CASE WHEN winner_id=? THEN loser_id ELSE winner_id END AS opponent_id, COUNT(*), SUM(winner_id=?) "
+                                   f"FROM {schema}.games WHERE winner_id=? OR loser_id=? GROUP BY opponent_id", (user_id, user_id, user_id, user_id))
+            for opponent_id, games, wins in self._dbCursor.fetchall():
+                total = head_to_head.setdefault(opponent_id, [0, 0])
+                total[0] += games
+                total[1] += wins
 
         # Loop through friends, adding their username/stats to a dictionary for output
         result = {}
-        for id in friend_list:
+        for friend_id in friend_list:
             # Grab username from database
-            self._dbCursor.execute("SELECT username FROM users WHERE user_id=?", (id[0],))
+            self._dbCursor.execute("SELECT username FROM users WHERE user_id=?", (friend_id,))
             username = self._dbCursor.fetchone()[0]
 
-            # Grab the winner of every game the two players have played
-            self._dbCursor.execute("SELECT winner_id FROM games WHERE (winner_id=? AND loser_id=?) OR (winner_id=? AND loser_id=?)", (user_id, id[0], id[0], user_id))
-            games = self._dbCursor.fetchall()
-            gameCount = len(games) # Total number of games is just the length of the list of winners
-
-            # Calculate win rate based on how many times the winner ID was user_id
+            # Calculate win rate based on how many of the games against the friend were won
+            gameCount, winCount = head_to_head.get(friend_id, (0, 0))
             if gameCount > 0:
-                winCount = games.count((user_id,))
                 winRate = winCount / gameCount
             else:
                 winRate = None # Exception for if you haven't played any games
                 
             # Add'em to the dictionary for output
-            result[id[0]] = {'username':username, 'gamesPlayed':gameCount, 'winRate':winRate}
+            result[friend_id] = {'username':username, 'gamesPlayed':gameCount, 'winRate':winRate}
         
         return result
     
 
+    @params_schema(user_id='int', friend_id='int?', friend_username='str?')
     def _api_user_addFriend(self, params: dict):
         """Adds a friend to the user's friend list. The friend to add is specified with either their user ID (friend_id),
         or their username (friend_username). Only one of these may be included in the request.
@@ -626,10 +948,7 @@ class restAPI:
         Returns:
             dict: 'success': (bool) True if the friend was added successfully
         """
-        # Must include user_id of user to initiate friendship
-        if 'user_id' not in params:
-            raise self.APIError('Must include "user_id" parameter', 400)
-        user_id = int(params['user_id'])
+        user_id = params['user_id']
 
         # Check that the user_id account is valid
         if not self._is_user_account_valid(user_id):
@@ -642,7 +961,7 @@ class restAPI:
         # Handle friend ID separately from friend username based on which is provided
         if 'friend_id' in params and not 'friend_username' in params:
             # Check provided friend ID is of a valid user
-            friend_id = int(params['friend_id'])
+            friend_id = params['friend_id']
             if not self._is_user_account_valid(friend_id):
                 raise self.APIError(f'User ID {friend_id} is not a valid user', 404)
 
@@ -666,17 +985,18 @@ class restAPI:
             raise self.APIError(f'Cannot add yourself as a friend', 403)
         
         # Check that friend relation isn't already in the database (no duplicate friend entries)
-        self._dbCursor.execute("SELECT COUNT(*) FROM friends WHERE (userA=? AND userB=?) OR (userA=? AND userB=?)", (user_id, friend_id, friend_id, user_id))
-        existing_count = self._dbCursor.fetchone()[0]
-        if existing_count > 0:
+        if self._are_users_friends(user_id, friend_id):
             raise self.APIError('Users are already friends', 403)
         
-        # Mark users as friends in the database
+        # Mark users as friends in the database and the friend graph
         self._dbCursor.execute("INSERT INTO friends VALUES (?, ?)", (user_id, friend_id))
         self._database.commit()
+        self.__friends.setdefault(user_id, set()).add(friend_id)
+        self.__friends.setdefault(friend_id, set()).add(user_id)
         return {'success':True}
     
 
+    @params_schema(user_id='int', friend_id='int')
     def _api_user_removeFriend(self, params: dict):
         """Removes a friend from the user's friend list, specified using the friends user ID (`friend_id`).
 
@@ -687,20 +1007,13 @@ class restAPI:
         Returns:
             dict: 'success': (bool) True if the friend was removed successfully
         """
-        # Must include user ID of user to initiate removal
-        if 'user_id' not in params:
-            raise self.APIError('must include "user_id" parameter', 400)
-        user_id = int(params['user_id'])
+        user_id = params['user_id']
+        friend_id = params['friend_id']
 
         # Check that the user is valid
         if not self._is_user_account_valid(user_id):
             raise self.APIError(f'User ID {user_id} is not a valid user', 404)
 
-        # Must include the user ID of the friend to remove
-        if 'friend_id' not in params:
-            raise self.APIError('must include "friend_id" parameter', 400)
-        friend_id = int(params['friend_id'])
-
         # Check the friend's user ID is valid
         if not self._is_user_account_valid(friend_id):
             raise self.APIError(f'User ID {friend_id} is not a valid user', 404)
@@ -710,16 +1023,18 @@ class restAPI:
             raise self.APIError(f'Access forbidden to user ID {user_id}', 403)
         
         # Check if users are actually friends
-        self._dbCursor.execute("SELECT COUNT(*) FROM friends WHERE (userA=? AND userB=?) OR (userA=? AND userB=?)", (user_id, friend_id, friend_id, user_id))
-        if self._dbCursor.fetchone()[0] == 0:
+        if not self._are_users_friends(user_id, friend_id):
             raise self.APIError(f'User {user_id} is not friends with user {friend_id}, cannot remove friendship if it doesn\'t exist :(', 404)
 
         # Remove friendship from database :(
         self._dbCursor.execute("DELETE FROM friends WHERE (userA=? AND userB=?) OR (userA=? AND userB=?)", (user_id, friend_id, friend_id, user_id))
         self._database.commit()
+        self.__friends[user_id].discard(friend_id)
+        self.__friends[friend_id].discard(user_id)
         return {'success':True}
         
 
+    @params_schema(user_id='int', won='bool?', opponent_id='int?', min_time='int?', max_time='int?')
     def _api_user_games(self, params: dict):
         """Returns a list of game IDs for which the given user (by user ID) has participated in.
 
@@ -733,10 +1048,7 @@ class restAPI:
         Returns:
             (dict): 'game_ids': comma separated list of game IDs
         """
-        # Must include user ID to pull games from
-        if 'user_id' not in params:
-            raise self.APIError('must include "user_id" parameter', 400)
-        user_id = int(params['user_id'])
+        user_id = params['user_id']
 
         # Check that the user is valid
         if not self._is_user_account_valid(user_id):
@@ -748,19 +1060,19 @@ class restAPI:
         
         # If opponent ID specified, record it for later filtering
         if 'opponent_id' in params:
-            opponent_id = int(params['opponent_id'])
+            opponent_id = params['opponent_id']
             if not self._is_user_id_valid(opponent_id):
                 raise self.APIError(f'Opponent with user ID {opponent_id} is not a valid user', 404)
         else:
             opponent_id = None
         
-        # Setup base SQL request
-        request = "SELECT game_id FROM games WHERE "
+        # Setup base SQL conditions
+        request = ""
         request_params = []
 
         # Filtering for games won vs lost
         if 'won' in params:
-            if bool(params['won']) == True:
+            if params['won']:
                 # Filter for the current user as the winner
                 request += "winner_id=?"
                 request_params.append(user_id)
@@ -795,20 +1107,24 @@ class restAPI:
         # Filter between min and/or max timestamps if they're provided
         if 'min_time' in params:
             request += " AND timestamp >=?"
-            request_params.append(int(params['min_time']))
+            request_params.append(params['min_time'])
 
         if 'max_time' in params:
             request += " AND timestamp <=?"
-            request_params.append(int(params['max_time']))
+            request_params.append(params['max_time'])
+
 
+        # Query list of games from the current database and any archives in the time range, and return (oldest game first)
+        game_ids = []
+        for schema in self._game_partitions(params.get('min_time'), params.get('max_time')):
+            self._dbCursor.execute(f"SELECT game_id FROM {schema}.games WHERE {request}", request_params)
+            game_ids.extend(game[0] for game in self._dbCursor.fetchall())
 
-        # Query list of games and return
-        self._dbCursor.execute(request, request_params)
-        games_list = self._dbCursor.fetchall()
-        result = {'game_ids': [game[0] for game in games_list]}
+        result = {'game_ids': sorted(game_ids)}
         return result
         
     
+    @params_schema(username='str', password='str')
     def _api_user_auth(self, params: dict):
         """Authenticates using a username and password, returns an API token for accessing
         user account data and a renewal key for generating a new API token.
@@ -822,11 +1138,8 @@ class restAPI:
             'apiKey' (str): API key/token for future authentication
             'renewalKey' (str): renewal key/token, used to get a new API token without logging in via username/password
         """
-        # Must specify username and password
-        if 'username' not in params or 'password' not in params:
-            raise self.APIError(f'Invalid parameters {params}. Must include username and password', 400)
-        username = str(params['username'])
-        password = str(params['password'])
+        username = params['username']
+        password = params['password']
 
         # Check authentication with username/password
         user_id = self._check_userAuth(username, password)
@@ -840,6 +1153,7 @@ class restAPI:
             raise self.APIError(f'Authentication failed for user {username}', 401)
         
 
+    @params_schema(apiKey='str', renewalKey='str')
     def _api_user_auth_renew(self, params: dict):
         """Renews an API key with a new one based on an existing renewal key.
         Takes in the user ID and existing renewal key, and returns a new API key and new renewal key.
@@ -853,12 +1167,8 @@ class restAPI:
             'apiKey' (str): new API key/token for future authentication
             'renewalKey' (str): new renewal key/token, used to get a new API token without logging in via username/password
         """
-        # Must include apiKey and renewalKey parameters
-        if 'apiKey' not in params or 'renewalKey' not in params:
-            raise self.APIError(f'Invalid parameters for POST pickle/auth/renew, must include apiKey and renewalKey: {params}', 400)
-        
-        old_key = str(params['apiKey'])
-        old_renew_key = str(params['renewalKey'])
+        old_key = params['apiKey']
+        old_renew_key = params['renewalKey']
         
         renew_key_user = self.__renewalKeys.get(old_renew_key)
         if renew_key_user == None:
@@ -869,8 +1179,7 @@ class restAPI:
             raise self.APIError(f'Key renewal failed, old api key not recognized', 401)
 
         if old_key_user and old_key_user['user_id'] == renew_key_user:
-            self.__apiKeys.pop(old_key)
-            self.__renewalKeys.pop(old_renew_key)
+            self._revoke_ApiKey(old_key, old_renew_key)
             api_key, renew_key = self._gen_ApiKey(renew_key_user)
             return {'apiKey':api_key, 'renewalKey':renew_key}
         
@@ -878,6 +1187,30 @@ class restAPI:
             raise self.APIError(f'Key renewal failed, old api key and renewal key do not match', 401)
     
 
+    @params_schema(user_id='int')
+    def _api_user_logout(self, params: dict):
+        """Logs a user out of every session, invalidating all of their API and renewal keys.
+
+        Args:
+            'user_id' (int): user ID of the account to log out
+
+        Returns:
+            dict: 'sessions' (int): the number of sessions that were logged out
+        """
+        user_id = params['user_id']
+
+        # Check that the user account exists and is valid
+        if not self._is_user_account_valid(user_id):
+            raise self.APIError(f'User ID {user_id} is not a valid user', 404)
+
+        # Check that we have perms to log out the user
+        if not self._user_canEdit(params.get('sender_id'), user_id):
+            raise self.APIError(f'Access forbidden to user ID {user_id}', 403)
+
+        return {'sessions':self._revoke_user_sessions(user_id)}
+
+
+    @params_schema(game_id='int_list')
     def _api_game_get(self, params: dict):
         """Returns the data for a given game, specified by `game_id`.
 
@@ -894,20 +1227,10 @@ class restAPI:
             'loser_points' (int): number of points the loser scored
 
         """
-        # Must specify the game ID(s) in order to pull data from them
-        if 'game_id' not in params:
-            raise self.APIError(f'must specify game_id parameter!', 400)
-        
-        # If game ID passed as a single int, convert to list for better handling later
-        game_ids = params['game_id']
-        if type(game_ids) is not list:
-            game_ids = [game_ids]
-
         # Iterate through each game ID, pulling the game data and adding to the result dict
         result_dict = {}
-        for game_id in game_ids:
-            self._dbCursor.execute("SELECT * FROM games WHERE game_id=?", (game_id,))
-            game = self._dbCursor.fetchone()
+        for game_id in params['game_id']:
+            _, game = self._find_game(game_id)
 
             if not game:
                 raise self.APIError(f'Game for game_id {game_id} not found', 404)
@@ -917,6 +1240,7 @@ class restAPI:
         return result_dict
     
 
+    @params_schema(user_id='int', game_id='int_list?')
     def _api_game_stats(self, params: dict):
         """Returns the game statistics of a user associated with a specific game ID.
         Returns `None` for any games which don't have registered game stats. If the game ID is not specified,
@@ -929,10 +1253,7 @@ class restAPI:
         Returns:
             _type_: _description_
         """
-        # We must include user ID (can't search by game for example)
-        if 'user_id' not in params:
-            raise self.APIError('user_id missing from parameters', 400)
-        user_id = int(params['user_id'])
+        user_id = params['user_id']
 
         # Check that user is valid
         if not self._is_user_account_valid(user_id):
@@ -942,34 +1263,36 @@ class restAPI:
         if not self._user_canView(params.get('sender_id'), user_id):
             raise self.APIError(f'Access forbidden to user ID {user_id}', 403)
 
-        # If game ID passed as a single int, convert to list for better handling later
+        # Use the requested game ID(s) if provided
         if 'game_id' in params:
             game_ids = params['game_id']
-            if type(game_ids) is not list:
-                game_ids = [game_ids]
         
         # If game ID not present, pull all games that the user has stats in
         else:
-            self._dbCursor.execute("SELECT game_id FROM user_game_stats WHERE user_id=?", (user_id,))
-            game_ids = [id[0] for id in self._dbCursor.fetchall()]
+            game_ids = []
+            for schema in self._game_partitions():
+                self._dbCursor.execute(f"SELECT game_id FROM {schema}.user_game_stats WHERE user_id=?", (user_id,))
+                game_ids.extend(id[0] for id in self._dbCursor.fetchall())
 
         # Iterate through every game ID, pulling stat data if found for the given user
         stats = {}
         for id in game_ids:
-                # Check if the user has stats for the current game
-                self._dbCursor.execute("SELECT timestamp FROM games WHERE game_id=?", (id,))
-                timestamp = self._dbCursor.fetchone()
+                # Check if the user has stats for the current game, in the database holding the game
+                schema, game = self._find_game(id)
 
-                if timestamp:
-                    # Pull user stats and add to response dict
-                    self._dbCursor.execute("SELECT * FROM user_game_stats WHERE game_id=? AND user_id=?", (id, user_id))
+                game_stats = None
+                if game:
+                    # Pull user stats
+                    self._dbCursor.execute(f"SELECT * FROM {schema}.user_game_stats WHERE game_id=? AND user_id=?", (id, user_id))
                     game_stats = self._dbCursor.fetchone()
 
+                # Add to response dict if the game exists and the user has stats in it
+                if game_stats:
                     stats[id] = {
-                        "timestamp":timestamp[0],
+                        "timestamp":game[1],
                         "swing_count": game_stats[2],
                         "swing_hits": game_stats[3],
-                        "hit_percentage": game_stats[3] / game_stats[2],
+                        "hit_percentage": game_stats[3] / game_stats[2] if game_stats[2] else None, # no swings, no percentage
                         "swing_max": game_stats[4],
                         "Q1_hits": game_stats[5],
                         "Q2_hits": game_stats[6],
@@ -982,10 +1305,14 @@ class restAPI:
         return stats
 
 
+    @params_schema(**GAME_SCHEMA, idempotency_key='str?')
     def _api_game_register(self, params: dict):
         """Used to register a game in the database. All information about the game must be provided.
         Returns the game ID of the newly registered game.
 
+        Clients that retry submissions (e.g. over a flaky connection) should send a unique idempotency key with each game.
+        Repeating a request with the same key within IDEMPOTENCY_KEY_TIMEOUT returns the original game ID instead of a duplicate error.
+
         Args:
             'timestamp' (int): Unix timestamp of when the game began
             'game_type' (int): an int representing the game type
@@ -993,58 +1320,51 @@ class restAPI:
             'loser_id' (int): user ID of the losing played
             'winner_points' (int): the number of points scored by the winning player
             'loser_points' (int): the number of points scored by the losing player
+            'idempotency_key' (str): *(optional)* unique key for this submission, chosen by the client
 
         Returns:
             dict: 'game_id' (int): the game ID of the newly registered game
         """
-        # Check all the relevant parameters were included
-        if any(key not in params for key in ('timestamp', 'game_type', 'winner_id', 'loser_id', 'winner_points', 'loser_points')):
-            raise self.APIError(f'Invalid parameters for POST pickle/game: {params}', 400)
-
-        timestamp = int(params['timestamp'])
-        game_type = int(params['game_type'])
-        winner_id = int(params['winner_id'])
-        loser_id = int(params['loser_id'])
-        winner_points = int(params['winner_points'])
-        loser_points = int(params['loser_points'])
-
-        # Check both users are valid
-        if not self._is_user_id_valid(winner_id):
-            raise self.APIError(f'User ID {winner_id} is not a valid user', 404)
-        if not self._is_user_id_valid(loser_id):
-            raise self.APIError(f'User ID {loser_id} is not a valid user', 404)
-        
-        # Check that score is valid
-        if 11 < winner_points < 15:
-            if winner_points - loser_points != 2:
-                raise self.APIError(f'Invalid game score, {winner_points} to {loser_points}', 400)
-        elif winner_points == 15:
-            if winner_points - loser_points > 2:
-                raise self.APIError(f'Invalid game score, {winner_points} to {loser_points}', 400)
-        elif winner_points < 11:
-            raise self.APIError(f'Invalid game score, {winner_points} to {loser_points}', 400)
-        elif loser_points >= 11:
-            raise self.APIError(f'Invalid game score, {winner_points} to {loser_points}', 400)
+        timestamp = params['timestamp']
+        game_type = params['game_type']
+        winner_id = params['winner_id']
+        loser_id = params['loser_id']
+        winner_points = params['winner_points']
+        loser_points = params['loser_points']
 
-        # Search for duplicate game in database using hash
         hash = f'{winner_id}:{loser_id}:{timestamp}'
-        self._dbCursor.execute("SElECT COUNT(*) FROM games WHERE hash=?", (hash,))
-        if self._dbCursor.fetchone()[0] > 0:
-            raise self.APIError(f'Duplicate game attempted to be registered!', 403)
+
+        # A retry of a completed submission returns the original game, without any other work. Keys belong to the sender
+        idempotency_key = params.get('idempotency_key')
+        if idempotency_key is not None:
+            key_owner = params.get('sender_id', self.UNKNOWN_USER)
+            self._dbCursor.execute("SELECT hash, game_id FROM idempotency_keys WHERE user_id=? AND key=? AND expiration>=?", (key_owner, idempotency_key, int(time.time())))
+            submission = self._dbCursor.fetchone()
+            if submission:
+                if submission[0] != hash:
+                    raise self.APIError(f'Idempotency key {idempotency_key} was already used for a different game', 409)
+                return {'game_id':submission[1]}
+
+        # Check both users are valid and the score is valid
+        self._check_game(winner_id, loser_id, winner_points, loser_points)
+
+        # Search for duplicate game in database using hash (including the archive of the game's year)
+        for schema in self._game_partitions(timestamp, timestamp):
+            self._dbCursor.execute(f"SELECT COUNT(*) FROM {schema}.games WHERE hash=?", (hash,))
+            if self._dbCursor.fetchone()[0] > 0:
+                raise self.APIError(f'Duplicate game attempted to be registered!', 403)
         
-        # If there are registered games, the next game is has the ID of the last one + 1
-        self._dbCursor.execute("SELECT game_id FROM games ORDER BY game_id DESC LIMIT 1")
-        game_id_raw = self._dbCursor.fetchone()
-        if game_id_raw:
-            game_id = game_id_raw[0] + 1
-        # If there are no registered games, make the first ID 0
-        else:
-            game_id = 0
+        game_id = self._next_game_id()
 
-        # Add game to database
+        # Add game to database, along with its idempotency key in the same transaction
         self._dbCursor.execute(
             "INSERT INTO games VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
             (game_id, timestamp, game_type, winner_id, loser_id, winner_points, loser_points, hash))
+        if idempotency_key is not None:
+            now = int(time.time())
+            self._dbCursor.execute("DELETE FROM idempotency_keys WHERE expiration<?", (now,))
+            self._dbCursor.execute("INSERT OR REPLACE INTO idempotency_keys VALUES (?, ?, ?, ?, ?)",
+                                   (key_owner, idempotency_key, hash, game_id, now + self.IDEMPOTENCY_KEY_TIMEOUT))
         self._database.commit()
 
         # Update user stats for both players
@@ -1054,6 +1374,25 @@ class restAPI:
         return {'game_id':game_id}
 
 
+    @params_schema(games='list')
+    def _api_game_import(self, params: dict):
+        """Registers a batch of games in the database at once (admin only). The whole batch is validated first and
+        inserted in a single transaction, then the stats of every affected user are recomputed once.
+
+        Args:
+            'games' (list(dict)): the games to register, each with the same parameters as pickle/game/register
+
+        Returns:
+            dict: 'game_ids' (list(int)): the game IDs of the newly registered games, in the same order as the input
+        """
+        # Bulk imports bypass the per-game checks of regular users, so they're restricted to admin
+        if self._useAuth and params.get('sender_id') != self.ADMIN_USER:
+            raise self.APIError('Only admin is allowed to import games', 403)
+
+        return {'game_ids':self.importGames(params['games'])}
+
+
+    @params_schema(user_id='int', game_id='int', swing_count='int', swing_hits='int', swing_max='float', Q1_hits='int', Q2_hits='int', Q3_hits='int', Q4_hits='int')
     def _api_game_registerStats(self, params: dict):
         """Registers game stats for a specific user associated with a specific game
 
@@ -1071,31 +1410,27 @@ class restAPI:
         Returns:
             dict: 'success' (bool): True if the game was registered successfully
         """
-        # Check all the relevant parameters were included
-        if any(key not in params for key in ('user_id', 'game_id', 'swing_count', 'swing_hits', 'swing_max', 'Q1_hits', 'Q2_hits', 'Q3_hits', 'Q4_hits')):
-            raise self.APIError(f'Invalid parameters for pickle/game/registerStats: {params}', 400)
-
-        user_id = int(params['user_id'])
-        game_id = int(params['game_id'])
-        swing_count = int(params['swing_count'])
-        swing_hits = int(params['swing_hits'])
-        swing_max = float(params['swing_max'])
-        Q1_hits = int(params['Q1_hits'])
-        Q2_hits = int(params['Q2_hits'])
-        Q3_hits = int(params['Q3_hits'])
-        Q4_hits = int(params['Q4_hits'])
+        user_id = params['user_id']
+        game_id = params['game_id']
+        swing_count = params['swing_count']
+        swing_hits = params['swing_hits']
+        swing_max = params['swing_max']
+        Q1_hits = params['Q1_hits']
+        Q2_hits = params['Q2_hits']
+        Q3_hits = params['Q3_hits']
+        Q4_hits = params['Q4_hits']
 
         # Check user is valid
         if not self._is_user_account_valid(user_id):
             raise self.APIError(f'User ID {user_id} is not a valid user', 404)
         
-        # Check that the referenced game actually exists
-        self._dbCursor.execute("SELECT COUNT(*) FROM games WHERE game_id=?", (game_id,))
-        if not self._dbCursor.fetchone()[0]:
+        # Check that the referenced game actually exists, stats are stored in the same database as the game (which may be an archive)
+        schema, game = self._find_game(game_id)
+        if not game:
             raise self.APIError(f'Game ID {game_id} not found in database', 404)
         
         # Check that there isn't another stat record for the same game and user
-        self._dbCursor.execute("SELECT COUNT(*) FROM user_game_stats WHERE game_id=? AND user_id=?", (game_id, user_id))
+        self._dbCursor.execute(f"SELECT COUNT(*) FROM {schema}.user_game_stats WHERE game_id=? AND user_id=?", (game_id, user_id))
         if self._dbCursor.fetchone()[0]:
             raise self.APIError(f'Not allowed to register multiple game stats with the same game ID ({game_id}) and user ID ({user_id})', 403)
 
@@ -1105,42 +1440,403 @@ class restAPI:
 
         # Write to database
         self._dbCursor.execute(
-            "INSERT INTO user_game_stats VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            f"INSERT INTO {schema}.user_game_stats VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
             (user_id, game_id, swing_count, swing_hits, swing_max, Q1_hits, Q2_hits, Q3_hits, Q4_hits))
         self._database.commit()
 
         return {'success':True}
 
+
+    @params_schema(user_id='int', game_id='int', speeds='list', times='list')
+    def _api_game_registerSwings(self, params: dict):
+        """Registers the individual swings of a user in a game, as reported by the paddle for every swing.
+        The series is stored as a single packed blob (see database_swings) rather than a row per swing.
+
+        Args:
+            'user_id' (int): the user ID of the swings to record
+            'game_id' (int): the game ID of the game
+            'speeds' (list): the speed (float) of each swing
+            'times' (list): the time (int) of each swing, in milliseconds since the start of the game, in increasing order
+
+        Returns:
+            dict: 'success' (bool): True if the swings were registered successfully
+        """
+        user_id = params['user_id']
+        game_id = params['game_id']
+
+        # Check user is valid
+        if not self._is_user_account_valid(user_id):
+            raise self.APIError(f'User ID {user_id} is not a valid user', 404)
+
+        # Check user has edit perms
+        if not self._user_canEdit(params.get('sender_id'), user_id):
+            raise self.APIError(f'Access forbidden to user ID {user_id}', 403)
+
+        try:
+            swings = encode_swings(params['speeds'], params['times'])
+        except ValueError as error:
+            raise self.APIError(str(error), 400)
+
+        # Swings are stored in the same database as the game (which may be an archive)
+        schema, game = self._find_game(game_id)
+        if not game:
+            raise self.APIError(f'Game ID {game_id} not found in database', 404)
+
+        try:
+            self._dbCursor.execute(f"INSERT INTO {schema}.game_swings VALUES (?, ?, ?, ?)", (user_id, game_id, len(params['speeds']), swings))
+        except sqlite3.IntegrityError:
+            raise self.APIError(f'Not allowed to register multiple swing series with the same game ID ({game_id}) and user ID ({user_id})', 403)
+        self._database.commit()
+
+        return {'success':True}
+
+
+    @params_schema(user_id='int', game_id='int', points='int?')
+    def _api_game_swings(self, params: dict):
+        """Returns the individual swings of a user in a game. Long series can be downsampled for charts, keeping the slowest
+        and fastest swing of each part of the game.
+
+        Args:
+            'user_id' (int): the user ID to request the swings of
+            'game_id' (int): the game ID of the game
+            'points' (int): *(optional)* max number of swings to return (1 returns the fastest swing), or 0 for the full series. Defaults to SWING_CHART_POINTS.
+
+        Returns:
+            dict: 'swing_count' (int): total number of swings, 'downsampled' (bool): whether swings were left out,
+            'speeds' (list): the speed of each returned swing, 'times' (list): the time of each returned swing in milliseconds since the start of the game
+        """
+        user_id = params['user_id']
+        game_id = params['game_id']
+        points = params.get('points', self.SWING_CHART_POINTS)
+
+        # Check that user is valid
+        if not self._is_user_account_valid(user_id):
+            raise self.APIError(f'User ID {user_id} is not a valid user', 404)
+
+        # Check user has view perms
+        if not self._user_canView(params.get('sender_id'), user_id):
+            raise self.APIError(f'Access forbidden to user ID {user_id}', 403)
+
+        if points < 0:
+            raise self.APIError(f'Number of points must not be negative: {points}', 400)
+
+        schema, game = self._find_game(game_id)
+        swings = None
+        if game:
+            self._dbCursor.execute(f"SELECT swing_count, swings FROM {schema}.game_swings WHERE game_id=? AND user_id=?", (game_id, user_id))
+            swings = self._dbCursor.fetchone()
+        if not swings:
+            raise self.APIError(f'No swings registered for user ID {user_id} in game ID {game_id}', 404)
+
+        speeds, times = decode_swings(swings[1])
+        if points:
+            speeds, times = downsample_swings(speeds, times, points)
+
+        return {'swing_count':swings[0], 'downsampled':len(speeds) < swings[0], 'speeds':speeds, 'times':times}
+
         
+    @params_schema(enabled='bool', mode='str?', sample_rate='float?', endpoint='str?', interval='float?')
+    def _api_admin_profile(self, params: dict):
+        """Turns request profiling on or off and changes its settings (admin only). Results collected so far are kept.
+
+        Args:
+            'enabled' (bool): whether to profile requests
+            'mode' (str): *(optional)* 'cprofile' for deterministic profiling, or 'sample' for low overhead stack sampling
+            'sample_rate' (float): *(optional)* fraction of all requests to profile, from 0 to 1
+            'endpoint' (str): *(optional)* endpoint to profile every request of (e.g. 'user/friends'), or '' for none
+            'interval' (float): *(optional)* seconds between stack samples in 'sample' mode
+
+        Returns:
+            dict: the new profiler settings, plus 'profiled_requests' and 'samples' collected so far
+        """
+        profiler = self._check_admin_tool(params.get('sender_id'), self._profiler, 'profiler')
+
+        try:
+            profiler.configure(params['enabled'], params.get('mode'), params.get('sample_rate'), params.get('endpoint'), params.get('interval'))
+        except ValueError as error:
+            raise self.APIError(str(error), 400)
+
+        return profiler.status()
+
+
+    @params_schema(format='str?', reset='bool?')
+    def _api_admin_profileResults(self, params: dict):
+        """Downloads the aggregated profiler results (admin only)
+
+        Args:
+            'format' (str): *(optional)* 'pstats' (default) for cProfile results in the binary pstats format, or 'collapsed' for
+                stack samples as flamegraph collapsed stacks text
+            'reset' (bool): *(optional)* set to true to discard the results after downloading them
+
+        Returns:
+            bytes or str: the results file, sent as the raw response body
+        """
+        profiler = self._check_admin_tool(params.get('sender_id'), self._profiler, 'profiler')
+
+        results_format = params.get('format', 'pstats')
+        if results_format == 'pstats':
+            results = profiler.pstats_data()
+        elif results_format == 'collapsed':
+            results = profiler.collapsed_stacks()
+        else:
+            raise self.APIError(f'Profiler results format must be "pstats" or "collapsed": {results_format}', 400)
+
+        if params.get('reset'):
+            profiler.reset()
+
+        return results
+
+
+    @params_schema(reset='bool?')
+    def _api_admin_queryStats(self, params: dict):
+        """Returns SQL query metrics collected by the query recorder (admin only)
+
+        Args:
+            'reset' (bool): *(optional)* set to true to discard the metrics after returning them
+
+        Returns:
+            dict: 'endpoints': per-endpoint 'requests', 'statements', 'time_ms', 'max_statements' and 'n_plus_one' (number of requests
+            that repeated a statement), 'slow_queries': recent slow statements with their query plans, 'n_plus_one': recent
+            requests that repeated a statement, with the repeated statement shapes
+        """
+        recorder = self._check_admin_tool(params.get('sender_id'), self._queryRecorder, 'query recorder')
+
+        metrics = recorder.metrics()
+        if params.get('reset'):
+            recorder.reset()
+
+        return metrics
+
+
+    @params_schema(table='str', format='str?', min_time='int?', max_time='int?', since='int?')
+    def _api_admin_export(self, params: dict):
+        """Streams a table out as CSV or NDJSON (admin only), for analysis and nightly incremental exports. Archived games are included
+
+        Args:
+            'table' (str): 'games', 'user_game_stats' or 'users' (user aggregates)
+            'format' (str): *(optional)* 'csv' (default) or 'ndjson'
+            'min_time' (int): *(optional)* only export rows of games at or after this timestamp
+            'max_time' (int): *(optional)* only export rows of games at or before this timestamp
+            'since' (int): *(optional)* only export rows of games registered after this cursor, from the X-Export-Cursor header of a previous export (not for users)
+
+        Returns:
+            ExportStream: the export, streamed as the raw response body with the cursor in the X-Export-Cursor header
+        """
+        if self._useAuth and params.get('sender_id') != self.ADMIN_USER:
+            raise self.APIError('Only admin is allowed to export data', 403)
+
+        # Games and stats are exported from the archives in the time range, then the current database
+        min_time, max_time = params.get('min_time'), params.get('max_time')
+        try:
+            return ExportStream(self._database, params['table'], params.get('format', 'csv'), min_time, max_time, params.get('since'),
+                                partitions=self._game_partitions(min_time, max_time, oldest_first=True))
+        except ValueError as error:
+            raise self.APIError(str(error), 400)
+
+
+    @params_schema(before='int')
+    def _api_admin_archive(self, params: dict):
+        """Moves old games and their stats into per-year archive databases (admin only), see restAPI.archiveGames
+
+        Args:
+            'before' (int): unix timestamp, games before it are archived
+
+        Returns:
+            dict: 'archived': number of games archived, keyed by year
+        """
+        if self._useAuth and params.get('sender_id') != self.ADMIN_USER:
+            raise self.APIError('Only admin is allowed to archive games', 403)
+
+        return {'archived':self.archiveGames(params['before'])}
+
+
+    def _check_admin_tool(self, sender_id, tool, name:str):
+        # Admin tools (profiler, query recorder) are restricted to admin, returns the tool if it's enabled on this server
+        if self._useAuth and sender_id != self.ADMIN_USER:
+            raise self.APIError(f'Only admin is allowed to use the {name}', 403)
+        if tool is None:
+            raise self.APIError(f'The {name} is not enabled on this server', 404)
+        return tool
+
+
     def _api_coffee(self, params: dict):
         raise self.APIError("Why...? We don't serve coffee here, just... idk, go find a cafe or something, maybe there's a pickleball court nearby", 418)
         
 
-    def updateUserGameStats(self, user_id: int):
+    def _check_game(self, winner_id: int, loser_id: int, winner_points: int, loser_points: int):
+        # Checks that both players of a game are valid users and that the score is valid, raises an APIError if not
+        if not self._is_user_id_valid(winner_id):
+            raise self.APIError(f'User ID {winner_id} is not a valid user', 404)
+        if not self._is_user_id_valid(loser_id):
+            raise self.APIError(f'User ID {loser_id} is not a valid user', 404)
+        
+        if 11 < winner_points < 15:
+            if winner_points - loser_points != 2:
+                raise self.APIError(f'Invalid game score, {winner_points} to {loser_points}', 400)
+        elif winner_points == 15:
+            if winner_points - loser_points > 2:
+                raise self.APIError(f'Invalid game score, {winner_points} to {loser_points}', 400)
+        elif winner_points < 11:
+            raise self.APIError(f'Invalid game score, {winner_points} to {loser_points}', 400)
+        elif loser_points >= 11:
+            raise self.APIError(f'Invalid game score, {winner_points} to {loser_points}', 400)
 
-        if not self._is_user_account_valid(user_id):
-            return False
 
-        self._dbCursor.execute('SELECT COUNT(*) FROM games WHERE winner_id=? OR loser_id=?', (user_id, user_id))
-        gamesPlayed = self._dbCursor.fetchone()[0]
+    def _next_game_id(self):
+        # If there are registered games, the next game is has the ID of the last one + 1 (including archived games)
+        self._dbCursor.execute("SELECT game_id FROM games ORDER BY game_id DESC LIMIT 1")
+        game_id_raw = self._dbCursor.fetchone()
+        last_ids = [game_id_raw[0]] if game_id_raw else []
+        last_ids.extend(max_game_id for _, max_game_id in self.__archives.values())
 
-        self._dbCursor.execute('SELECT COUNT(*) FROM games WHERE winner_id=?', (user_id,))
-        gamesWon = self._dbCursor.fetchone()[0]
+        if last_ids:
+            return max(last_ids) + 1
+        # If there are no registered games, make the first ID 0
+        else:
+            return 0
 
-        self._dbCursor.execute('SELECT AVG(CASE WHEN winner_id=? THEN winner_points ELSE loser_points END) FROM games WHERE winner_id=? OR loser_id=?', (user_id, user_id, user_id))
-        averageScore = self._dbCursor.fetchone()[0]
 
-        self._dbCursor.execute('UPDATE users SET gamesPlayed=?, gamesWon=?, averageScore=? WHERE user_id=?', (gamesPlayed, gamesWon, averageScore, user_id))
-        self._database.commit()
+    _validate_game = staticmethod(compile_schema('game_import', GAME_SCHEMA))
+
+    def importGames(self, games: list):
+        """Registers a batch of games in a single transaction. Every game is validated (same rules as pickle/game/register,
+        including duplicates within the batch) before anything is written, and user stats are recomputed once at the end.
+
+        Args:
+            games (list(dict)): the games to register, each a dict with the parameters of pickle/game/register
+
+        Raises:
+            self.APIError: if any game in the batch is invalid, in which case no games are registered
+
+        Returns:
+            list(int): the game IDs of the registered games, in the same order as the input
+        """
+        # Validate every game before touching the database
+        rows = []
+        hashes = {}
+        for index, game in enumerate(games):
+            try:
+                game = self._validate_game(game, self.APIError)
+                self._check_game(game['winner_id'], game['loser_id'], game['winner_points'], game['loser_points'])
+            except self.APIError as error:
+                raise self.APIError(f'Game {index}: {error.message}', error.code)
+
+            hash = f'{game["winner_id"]}:{game["loser_id"]}:{game["timestamp"]}'
+            if hash in hashes:
+                raise self.APIError(f'Game {index}: Duplicate of game {hashes[hash]} in the same batch', 403)
+            hashes[hash] = index
+            rows.append((game['timestamp'], game['game_type'], game['winner_id'], game['loser_id'], game['winner_points'], game['loser_points'], hash))
+
+        # Check for games that are already in the database (using the hash index), or in the archive of their year
+        partition_hashes = {None:list(hashes)}
+        if self.__archives:
+            for hash, index in hashes.items():
+                for year in self._archive_years(rows[index][0], rows[index][0]):
+                    partition_hashes.setdefault(year, []).append(hash)
+
+        for year, hash_list in partition_hashes.items():
+            schema = 'main' if year is None else self._attach_archive(year)
+            for start in range(0, len(hash_list), self.SQL_CHUNK_SIZE):
+                chunk = hash_list[start:start + self.SQL_CHUNK_SIZE]
+                self._dbCursor.execute(f"SELECT hash FROM {schema}.games WHERE hash IN ({','.join('?' * len(chunk))}) LIMIT 1", chunk)
+                duplicate = self._dbCursor.fetchone()
+                if duplicate:
+                    raise self.APIError(f'Game {hashes[duplicate[0]]}: Duplicate game attempted to be registered!', 403)
+
+        # Insert all games and update stats in one transaction
+        try:
+            first_id = self._next_game_id()
+            self._dbCursor.executemany(
+                "INSERT INTO games VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                ((first_id + index,) + row for index, row in enumerate(rows)))
+
+            user_ids = {row[2] for row in rows} | {row[3] for row in rows}
+            self.updateUsersGameStats(user_ids, commit=False)
+            self._database.commit()
+
+        except Exception:
+            self._database.rollback()
+            raise
+
+        return list(range(first_id, first_id + len(rows)))
+
+
+    def updateUsersGameStats(self, user_ids, commit: bool = True):
+        """Recomputes gamesPlayed, gamesWon and averageScore for a set of users, with one query per chunk of users
+        rather than three per user. Invalid user IDs (unknown, deleted or admin) are skipped.
+
+        Args:
+            user_ids (iterable(int)): user IDs to recompute stats of
+            commit (bool, optional): Set to False to leave the update uncommitted (e.g. as part of a bigger transaction). Defaults to True.
+
+        Returns:
+            int: number of users updated
+        """
+        user_ids = list(set(user_ids))
+
+        updates = []
+        for start in range(0, len(user_ids), self.SQL_CHUNK_SIZE):
+            # Only valid accounts have stats, check the whole chunk at once
+            chunk = user_ids[start:start + self.SQL_CHUNK_SIZE]
+            self._dbCursor.execute(f"SELECT user_id FROM users WHERE valid=1 AND user_id IN ({','.join('?' * len(chunk))})", chunk)
+            chunk = [row[0] for row in self._dbCursor.fetchall()]
+            if not chunk:
+                continue
+
+            placeholders = ','.join('?' * len(chunk))
+            self._dbCursor.execute(
+                f"SELECT user_id, COUNT(*), SUM(won), SUM(points) FROM ("
+                f"SELECT winner_id AS user_id, 1 AS won, winner_points AS points FROM games WHERE winner_id IN ({placeholders}) "
+                f"UNION ALL SELECT loser_id, 0, loser_points FROM games WHERE loser_id IN ({placeholders})"
+                f") GROUP BY user_id", chunk + chunk)
+            stats = {row[0]: row[1:] for row in self._dbCursor.fetchall()}
+
+            # Add the totals of archived games, which are kept in the current database
+            archived = {}
+            if self.__archives:
+                self._dbCursor.execute(f"SELECT user_id, gamesPlayed, gamesWon, pointsTotal FROM archived_user_stats WHERE user_id IN ({placeholders})", chunk)
+                archived = {row[0]: row[1:] for row in self._dbCursor.fetchall()}
+
+            for user_id in chunk:
+                gamesPlayed, gamesWon, pointsTotal = stats.get(user_id, (0, 0, 0))
+                archivedPlayed, archivedWon, archivedPoints = archived.get(user_id, (0, 0, 0))
+                gamesPlayed += archivedPlayed
+                gamesWon += archivedWon
+                averageScore = (pointsTotal + archivedPoints) / gamesPlayed if gamesPlayed else None
+                updates.append((gamesPlayed, gamesWon, averageScore, user_id))
+
+        self._dbCursor.executemany('UPDATE users SET gamesPlayed=?, gamesWon=?, averageScore=? WHERE user_id=?', updates)
+        if commit:
+            self._database.commit()
+        return len(updates)
+
+
+    def updateUserGameStats(self, user_id: int):
+
+        if not self._is_user_account_valid(user_id):
+            return False
+
+        # Same computation as bulk updates, so archived games are included the same way
+        self.updateUsersGameStats([user_id])
         return True
     
 
+    def _new_cursor(self):
+        # Creates the database cursor, instrumented if there's a query recorder
+        if self._queryRecorder is not None:
+            return self._queryRecorder.cursor(self._database)
+        return self._database.cursor()
+
     def openCon(self):
         self._database = sqlite3.connect(self.dbFile)
-        self._dbCursor = self._database.cursor()
+        self._dbCursor = self._new_cursor()
+        self._load_friend_graph()
+        self._load_archives()
 
     def close(self):
         self._dbCursor.close()
         self._database.close()
+        self.__attached.clear()
         self.__apiKeys.clear()
         self.__renewalKeys.clear()
+        self.__userSessions.clear()
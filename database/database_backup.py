@@ -0,0 +1,158 @@
+import argparse
+import os
+import sqlite3
+import threading
+import time
+
+class _BackupRestarted(Exception):
+    # Raised from the progress callback to abort a stepped backup that keeps being restarted by writes
+    pass
+
+class BackupScheduler:
+    """Makes consistent online backups of the SQLite database with the SQLite backup API, on a schedule in a background thread.
+    Pages are copied in small steps with a pause between steps, so requests on the server's own connection are never
+    blocked for long. Only the newest `keep` backups are kept.
+
+    Writes from other connections between steps make SQLite restart the backup from the first page, so under sustained
+    writes a stepped backup might never finish. After `max_restarts` restarts the backup is finished in a single step instead"""
+
+    def __init__(self, db_path:str, backup_dir:str, interval:float = 3600, keep:int = 24, pages:int = 64, step_delay:float = 0.005,
+                 max_restarts:int = 3):
+        """Creates a backup scheduler, which doesn't start until start() is called
+
+        Args:
+            db_path (str): Filepath of the SQLite database to back up
+            backup_dir (str): Directory to write backups to (created if it doesn't exist)
+            interval (float, optional): Seconds between scheduled backups. Defaults to 3600.
+            keep (int, optional): Number of backups to keep, older backups are deleted. Defaults to 24.
+            pages (int, optional): Number of database pages copied per step. Defaults to 64.
+            step_delay (float, optional): Seconds to pause between steps, releasing the database to other connections. Defaults to 0.005.
+            max_restarts (int, optional): Number of times a stepped backup may be restarted by writes before it is finished in a single step. Defaults to 3.
+        """
+        self.db_path = str(db_path)
+        self.backup_dir = str(backup_dir)
+        self.interval = interval
+        self.keep = keep
+        self.pages = pages
+        self.step_delay = step_delay
+        self.max_restarts = max_restarts
+
+        self.last_backup = None
+        self.last_error = None
+        self.last_restarts = 0
+        self._remaining = None
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+
+    def backup_now(self):
+        """Writes a backup immediately (on the calling thread) and removes old backups past the retention limit
+
+        Returns:
+            str: filepath of the new backup
+        """
+        # Only one backup at a time, e.g. if a manual backup overlaps a scheduled one
+        with self._lock:
+            os.makedirs(self.backup_dir, exist_ok=True)
+            name = time.strftime('pickle-%Y%m%d-%H%M%S', time.gmtime())
+            path = os.path.join(self.backup_dir, name + '.db')
+            suffix = 1
+            while os.path.exists(path):
+                path = os.path.join(self.backup_dir, f'{name}_{suffix}.db')
+                suffix += 1
+
+            # Write to a temporary file first, so a crash mid-backup never leaves a partial file that looks like a backup
+            tmp_path = path + '.tmp'
+            source = sqlite3.connect(self.db_path)
+            destination = sqlite3.connect(tmp_path)
+            try:
+                self.last_restarts = 0
+                self._remaining = None
+                try:
+                    source.backup(destination, pages=self.pages, progress=self._progress)
+                except _BackupRestarted:
+                    # Copy everything in one step, which holds the read lock until done so writes can't restart it
+                    source.backup(destination, pages=-1)
+            finally:
+                destination.close()
+                source.close()
+
+            os.replace(tmp_path, path)
+            self.last_backup = path
+            self._prune()
+            return path
+
+
+    def _progress(self, status, remaining, total):
+        # Called by sqlite after each step of pages, pausing lets writers on other connections get the database
+        # More pages remaining than after the last step means a write restarted the backup
+        if self._remaining is not None and remaining > self._remaining:
+            self.last_restarts += 1
+            if self.last_restarts > self.max_restarts:
+                raise _BackupRestarted()
+        self._remaining = remaining
+
+        if remaining and self.step_delay:
+            time.sleep(self.step_delay)
+
+
+    def _prune(self):
+        # Deletes the oldest backups past the retention limit
+        if self.keep > 0:
+            for path in self.list_backups()[:-self.keep]:
+                os.remove(path)
+
+
+    def list_backups(self):
+        # Filepaths of existing backups, oldest first (the timestamped names sort chronologically)
+        if not os.path.isdir(self.backup_dir):
+            return []
+        names = sorted(name for name in os.listdir(self.backup_dir) if name.startswith('pickle-') and name.endswith('.db'))
+        return [os.path.join(self.backup_dir, name) for name in names]
+
+
+    def start(self):
+        # Starts the background backup thread, the first backup is taken immediately
+        if self._thread is None:
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        # Stops the background backup thread, waiting for a backup in progress to finish
+        if self._thread is not None:
+            self._stop_event.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.backup_now()
+                self.last_error = None
+            except Exception as error:
+                # Keep the schedule running, the next backup might succeed (e.g. after disk space is freed)
+                self.last_error = error
+                print(f'Database backup failed: {error}')
+
+            self._stop_event.wait(self.interval)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exception_type, exception_value, exception_traceback):
+        self.stop()
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Back up a PicklePals database, safe to run while the server is running')
+    parser.add_argument('path', nargs='?', default='database/pickle.db', help='Database file to back up (default: database/pickle.db)')
+    parser.add_argument('backup_dir', nargs='?', default='database/backups', help='Directory to write the backup to (default: database/backups)')
+    parser.add_argument('--keep', type=int, default=24, help='Number of backups to keep in backup_dir (default: 24)')
+    args = parser.parse_args()
+
+    backup = BackupScheduler(args.path, args.backup_dir, keep=args.keep).backup_now()
+    print(f'Backed up {args.path} to {backup}')
@@ -0,0 +1,323 @@
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+from .database_api import restAPI
+from .database_querystats import QueryRecorder
+from .database_setup import generate_db
+
+# Password of every user made by database_setup.generate_db
+GENERATED_PASSWORD = 'Generated_Pass1'
+
+
+class BenchContext:
+    """State shared by the parameter generators of a benchmark run (random IDs, counters for unique values, etc)"""
+
+    def __init__(self, api:restAPI, num_users:int, num_games:int, seed:int):
+        self.api = api
+        self.num_users = num_users
+        self.num_games = num_games
+        self.rng = random.Random(seed)
+        self.counter = 0
+
+        # Existing friend pairs and game stats to pick from
+        api._dbCursor.execute("SELECT userA, userB FROM friends")
+        self.friend_pairs = api._dbCursor.fetchall()
+        self.rng.shuffle(self.friend_pairs)
+
+        api._dbCursor.execute("SELECT user_id, game_id FROM user_game_stats LIMIT 10000")
+        self.game_stats = api._dbCursor.fetchall()
+
+    def next(self):
+        # Returns a new number every call, for unique usernames, timestamps, etc
+        self.counter += 1
+        return self.counter
+
+    def user(self):
+        return self.rng.randint(1, self.num_users)
+
+    def users(self, count:int):
+        return self.rng.sample(range(1, self.num_users + 1), min(count, self.num_users))
+
+    def game(self):
+        return self.rng.randrange(self.num_games)
+
+    def games(self, count:int):
+        return self.rng.sample(range(self.num_games), min(count, self.num_games))
+
+    def new_game(self):
+        # Games far in the future have unique hashes
+        winner_id, loser_id = self.users(2)
+        return {'timestamp':4000000000 + self.next(), 'game_type':0, 'winner_id':winner_id, 'loser_id':loser_id, 'winner_points':11, 'loser_points':self.rng.randint(0, 9)}
+
+    def new_friend_pair(self):
+        while True:
+            userA, userB = self.users(2)
+            if not self.api._are_users_friends(userA, userB):
+                return userA, userB
+
+    def new_stats_game(self):
+        # Registers a game (untimed) so there's a game without stats to register stats for
+        game = self.new_game()
+        game_id = self.api.importGames([game])[0]
+        return game['winner_id'], game_id
+
+    def new_user(self, games:int = 5):
+        # Creates a user (untimed) with a few games and a friend, so there's a user like the generated ones to delete
+        user_id = self.api._api_user_create({'username':f'bench_user_{self.next()}', 'password':GENERATED_PASSWORD})['user_id']
+        opponents = self.users(games)
+        self.api.importGames([{**self.new_game(), 'winner_id':user_id, 'loser_id':opponent_id} for opponent_id in opponents])
+        self.api._api_user_addFriend({'user_id':user_id, 'friend_id':opponents[0], 'sender_id':0})
+        return user_id
+
+    def session(self, user_id:int):
+        return self.api._api_user_auth({'username':f'gen_user_{user_id}', 'password':GENERATED_PASSWORD})
+
+
+def _stats_params(ctx:BenchContext):
+    user_id, game_id = ctx.new_stats_game()
+    return {'user_id':user_id, 'game_id':game_id, 'swing_count':150, 'swing_hits':90, 'swing_max':20.5, 'Q1_hits':20, 'Q2_hits':25, 'Q3_hits':20, 'Q4_hits':25}
+
+def _swings_params(ctx:BenchContext, count:int = 500):
+    # A game's worth of swings, one every 1-3 seconds
+    user_id, game_id = ctx.new_stats_game()
+    times = list(itertools.accumulate(ctx.rng.randint(1000, 3000) for _ in range(count)))
+    return {'user_id':user_id, 'game_id':game_id, 'speeds':[round(ctx.rng.uniform(2, 25), 2) for _ in range(count)], 'times':times}
+
+def _get_swings_params(ctx:BenchContext, points:int):
+    # Registers a swing series (untimed) to request
+    swings = _swings_params(ctx)
+    ctx.api._api_game_registerSwings({**swings, 'sender_id':0})
+    return {'user_id':swings['user_id'], 'game_id':swings['game_id'], 'points':points}
+
+def _renew_params(ctx:BenchContext):
+    session = ctx.session(ctx.user())
+    return {'apiKey':session['apiKey'], 'renewalKey':session['renewalKey']}
+
+def _logout_params(ctx:BenchContext):
+    user_id = ctx.user()
+    ctx.session(user_id)
+    return {'user_id':user_id}
+
+def _remove_friend_params(ctx:BenchContext):
+    userA, userB = ctx.friend_pairs.pop() if ctx.friend_pairs else ctx.new_friend_pair()
+    if not ctx.api._are_users_friends(userA, userB):
+        ctx.api._api_user_addFriend({'user_id':userA, 'friend_id':userB, 'sender_id':0})
+    return {'user_id':userA, 'friend_id':userB}
+
+
+# Benchmark cases: (name, endpoint, parameter generator). Parameters are generated before the timer starts
+BENCHMARKS = [
+    ('user_getUsername',        'user_getUsername',  lambda ctx: {'user_id':ctx.user()}),
+    ('user_getUsername_batch',  'user_getUsername',  lambda ctx: {'user_id':ctx.users(50)}),
+    ('user_getStats',           'user_getStats',     lambda ctx: {'user_id':ctx.user()}),
+    ('user_getStats_batch',     'user_getStats',     lambda ctx: {'user_id':ctx.users(50)}),
+    ('user_id',                 'user_id',           lambda ctx: {'username':f'gen_user_{ctx.user()}'}),
+    ('user_id_batch',           'user_id',           lambda ctx: {'username':[f'gen_user_{user_id}' for user_id in ctx.users(50)]}),
+    ('user_friends',            'user_friends',      lambda ctx: {'user_id':ctx.user()}),
+    ('user_games',              'user_games',        lambda ctx: {'user_id':ctx.user()}),
+    ('user_games_filtered',     'user_games',        lambda ctx: {'user_id':ctx.user(), 'won':True, 'min_time':int(time.time()) - 30 * 86400}),
+    ('game_get',                'game_get',          lambda ctx: {'game_id':ctx.game()}),
+    ('game_get_batch',          'game_get',          lambda ctx: {'game_id':ctx.games(50)}),
+    ('game_stats',              'game_stats',        lambda ctx: dict(zip(('user_id', 'game_id'), ctx.rng.choice(ctx.game_stats)))),
+    ('game_stats_all',          'game_stats',        lambda ctx: {'user_id':ctx.user()}),
+    ('user_auth',               'user_auth',         lambda ctx: {'username':f'gen_user_{ctx.user()}', 'password':GENERATED_PASSWORD}),
+    ('user_auth_renew',         'user_auth_renew',   _renew_params),
+    ('user_logout',             'user_logout',       _logout_params),
+    ('user_create',             'user_create',       lambda ctx: {'username':f'bench_{ctx.next()}', 'password':'Bench_Pass_123'}),
+    ('user_setUsername',        'user_setUsername',  lambda ctx: {'user_id':ctx.user(), 'username':f'renamed_{ctx.next()}'}),
+    ('user_delete',             'user_delete',       lambda ctx: {'user_id':ctx.new_user()}),
+    ('user_addFriend',          'user_addFriend',    lambda ctx: dict(zip(('user_id', 'friend_id'), ctx.new_friend_pair()))),
+    ('user_removeFriend',       'user_removeFriend', _remove_friend_params),
+    ('game_register',           'game_register',     lambda ctx: ctx.new_game()),
+    ('game_registerStats',      'game_registerStats', _stats_params),
+    ('game_registerSwings',     'game_registerSwings', _swings_params),
+    ('game_swings',             'game_swings',       lambda ctx: _get_swings_params(ctx, 200)),
+    ('game_swings_full',        'game_swings',       lambda ctx: _get_swings_params(ctx, 0)),
+    ('game_import_batch',       'game_import',       lambda ctx: {'games':[ctx.new_game() for _ in range(100)]}),
+]
+
+# Read-only cases whose parameter generators write to the database, which run on a copy of the database like write endpoints
+SETUP_WRITES = {'game_swings', 'game_swings_full'}
+
+
+def build_database(db_dir:str, num_users:int, num_games:int, seed:int = 0):
+    """Returns the path of a generated benchmark database of the given size, generating it if it isn't cached in db_dir"""
+    os.makedirs(db_dir, exist_ok=True)
+    path = os.path.join(db_dir, f'bench_{num_users}u_{num_games}g_{seed}.db')
+    if not os.path.isfile(path):
+        generate_db(path + '.tmp', num_users, num_games, seed=seed)
+        os.replace(path + '.tmp', path)
+    return path
+
+
+def _time_request(api:restAPI, ctx:BenchContext, uri:str, params_gen, api_key:str):
+    # Times a single request through handle_request, returning the time in milliseconds
+    params = params_gen(ctx)
+    start = time.perf_counter()
+    api.handle_request(uri, params, api_key)
+    return (time.perf_counter() - start) * 1000
+
+
+def run_benchmark(db_path:str, num_users:int, num_games:int, cases:list = None, iterations:int = 200, cold_runs:int = 5,
+                  seed:int = 0, only:list = None):
+    """Measures restAPI.handle_request for each benchmark case on a generated database
+
+    Cold timings are the first request on a freshly opened restAPI (empty user cache and SQLite page cache),
+    warm timings are requests after a few warmup requests on the same instance. Endpoints that write to the database
+    run on their own copy of the database, so every case starts from the same data.
+
+    Args:
+        db_path (str): Filepath of a database made by build_database
+        num_users (int): Number of users in the database
+        num_games (int): Number of games in the database
+        cases (list, optional): Benchmark cases to run. Defaults to BENCHMARKS.
+        iterations (int, optional): Number of warm requests timed per case. Defaults to 200.
+        cold_runs (int, optional): Number of cold requests timed per case. Defaults to 5.
+        seed (int, optional): Seed for picking random IDs. Defaults to 0.
+        only (list, optional): Names of the cases to run. Defaults to None (all cases).
+
+    Returns:
+        dict: timings in milliseconds keyed by case name: 'cold_ms', 'warm_ms' (medians), 'warm_p95_ms',
+        plus 'statements': the number of SQL statements executed by a warm request
+    """
+    results = {}
+
+    # The API prints on every login, which would flood the output (and the timings) of the auth benchmarks
+    with tempfile.TemporaryDirectory() as tmp_dir, contextlib.redirect_stdout(io.StringIO()):
+        for name, endpoint, params_gen in (cases or BENCHMARKS):
+            if only and name not in only:
+                continue
+
+            uri = '/pickle/' + endpoint.replace('_', '/')
+            case_db = db_path
+            if not restAPI.ROUTES[endpoint]['readOnly'] or name in SETUP_WRITES:
+                case_db = os.path.join(tmp_dir, f'{name}.db')
+                shutil.copyfile(db_path, case_db)
+
+            # Cold: the first request on a fresh connection
+            cold = []
+            for run in range(cold_runs):
+                api = restAPI(case_db, useAuth=True)
+                ctx = BenchContext(api, num_users, num_games, seed + run)
+                ctx.counter = run * (iterations + 100)
+                admin_key = api._api_user_auth({'username':'admin', 'password':'root'})['apiKey']
+                cold.append(_time_request(api, ctx, uri, params_gen, admin_key))
+                api.close()
+
+            # Warm: repeated requests on the same connection after warming up
+            api = restAPI(case_db, useAuth=True)
+            ctx = BenchContext(api, num_users, num_games, seed)
+            ctx.counter = cold_runs * (iterations + 100)
+            admin_key = api._api_user_auth({'username':'admin', 'password':'root'})['apiKey']
+            for _ in range(min(10, iterations)):
+                _time_request(api, ctx, uri, params_gen, admin_key)
+            warm = sorted(_time_request(api, ctx, uri, params_gen, admin_key) for _ in range(iterations))
+
+            # Count the SQL statements of one more warm request, outside the timed requests so instrumentation doesn't skew them
+            recorder = QueryRecorder()
+            api._dbCursor = recorder.cursor(api._database)
+            with recorder.capture(name) as queries:
+                api.handle_request(uri, params_gen(ctx), admin_key)
+            api.close()
+
+            results[name] = {
+                'cold_ms': round(statistics.median(cold), 4),
+                'warm_ms': round(statistics.median(warm), 4),
+                'warm_p95_ms': round(warm[min(len(warm) - 1, int(len(warm) * 0.95))], 4),
+                'statements': queries.count,
+            }
+
+    return results
+
+
+def compare_results(baseline:dict, current:dict, threshold:float = 0.10, metrics = ('warm_ms', 'cold_ms')):
+    """Compares benchmark results against a baseline
+
+    Args:
+        baseline (dict): Results from a previous run (the 'results' of a saved JSON file)
+        current (dict): Results from this run
+        threshold (float, optional): Relative slowdown flagged as a regression, e.g. 0.10 for 10%. Defaults to 0.10.
+        metrics (tuple, optional): Metrics to compare. Defaults to ('warm_ms', 'cold_ms').
+
+    Returns:
+        list(dict): one entry per case and metric in both results: 'case', 'metric', 'baseline', 'current', 'change' (fraction), 'regression' (bool)
+    """
+    comparison = []
+    for name, timings in current.items():
+        if name not in baseline:
+            continue
+        for metric in metrics:
+            old = baseline[name].get(metric)
+            new = timings.get(metric)
+            if not old or new is None:
+                continue
+
+            change = (new - old) / old
+            comparison.append({'case':name, 'metric':metric, 'baseline':old, 'current':new, 'change':change, 'regression':change > threshold})
+
+    return comparison
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the PicklePals restAPI endpoints on a generated database')
+    parser.add_argument('--users', type=int, default=5000, help='Number of users in the benchmark database (default: 5000)')
+    parser.add_argument('--games', type=int, default=100000, help='Number of games in the benchmark database (default: 100000)')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed (default: 0)')
+    parser.add_argument('--iterations', type=int, default=200, help='Warm requests per case (default: 200)')
+    parser.add_argument('--cold-runs', type=int, default=5, help='Cold requests per case (default: 5)')
+    parser.add_argument('--db-dir', default=os.path.join(tempfile.gettempdir(), 'pickle_bench'),
+                        help='Directory where generated databases are cached')
+    parser.add_argument('--only', nargs='+', help='Only run these cases')
+    parser.add_argument('--out', help='Save results to this JSON file (e.g. to use as a baseline later)')
+    parser.add_argument('--baseline', help='Compare results against this JSON file')
+    parser.add_argument('--threshold', type=float, default=10, help='Percent slowdown flagged as a regression (default: 10)')
+    args = parser.parse_args()
+
+    db_path = build_database(args.db_dir, args.users, args.games, args.seed)
+    results = run_benchmark(db_path, args.users, args.games, iterations=args.iterations, cold_runs=args.cold_runs,
+                            seed=args.seed, only=args.only)
+
+    print(f'{"case":<25}{"cold (ms)":>12}{"warm (ms)":>12}{"p95 (ms)":>12}{"SQL":>6}')
+    for name, timings in results.items():
+        print(f'{name:<25}{timings["cold_ms"]:>12.3f}{timings["warm_ms"]:>12.3f}{timings["warm_p95_ms"]:>12.3f}{timings["statements"]:>6}')
+
+    if args.out:
+        with open(args.out, 'w') as file:
+            json.dump({
+                'meta': {'users':args.users, 'games':args.games, 'seed':args.seed, 'iterations':args.iterations,
+                         'python':platform.python_version(), 'sqlite':sqlite3.sqlite_version, 'time':int(time.time())},
+                'results': results,
+            }, file, indent=2)
+        print(f'Results saved to {args.out}')
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+
+        comparison = compare_results(baseline['results'], results, args.threshold / 100)
+        regressions = [entry for entry in comparison if entry['regression']]
+
+        print(f'\nCompared to {args.baseline}:')
+        for entry in comparison:
+            flag = '  <-- REGRESSION' if entry['regression'] else ''
+            print(f'{entry["case"]:<25}{entry["metric"]:<10}{entry["baseline"]:>10.3f} -> {entry["current"]:>10.3f} ms ({entry["change"]:+.1%}){flag}')
+
+        if regressions:
+            print(f'\n{len(regressions)} regression(s) over {args.threshold}%')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
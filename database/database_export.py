@@ -0,0 +1,198 @@
+import argparse
+import csv
+import io
+import json
+import os
+import sqlite3
+import sys
+
+# Exportable tables: (columns, FROM clause of a database schema, timestamp column for time filters, game ID column for the since cursor)
+# user_game_stats has no timestamp of its own, so it's joined with the games table. Users only export aggregates, never password data.
+# The since cursor is a game ID, which only ever increases (rowids don't, SQLite reuses the rowid of a deleted last row). Users are
+# updated in place, so they can't be exported incrementally
+EXPORT_TABLES = {
+    'games': (
+        ('game_id', 'timestamp', 'game_type', 'winner_id', 'loser_id', 'winner_points', 'loser_points'),
+        '{schema}.games', 'timestamp', 'games.game_id'),
+    'user_game_stats': (
+        ('user_id', 'game_id', 'timestamp', 'swing_count', 'swing_hits', 'swing_max', 'Q1_hits', 'Q2_hits', 'Q3_hits', 'Q4_hits'),
+        '{schema}.user_game_stats JOIN {schema}.games USING (game_id)', 'games.timestamp', 'user_game_stats.game_id'),
+    'users': (
+        ('user_id', 'username', 'valid', 'gamesPlayed', 'gamesWon', 'averageScore'),
+        'main.users', None, None),
+}
+
+EXPORT_FORMATS = ('csv', 'ndjson')
+
+
+class ExportStream:
+    """A streaming export of one table, iterated as chunks of CSV or NDJSON text.
+    Rows are read with fetchmany, so memory use doesn't depend on the number of rows. Games and stats are read from each
+    database schema in `partitions` in turn (e.g. the per-year archives made by restAPI.archiveGames, then main).
+
+    Game and stats exports only include games registered up to when the export was created, `cursor` is the since
+    value to pass to the next export to continue from exactly where this one ends (for incremental/nightly exports).
+    Stats are exported with their game, so stats registered for a game after it was exported aren't in the next export"""
+
+    def __init__(self, connection:sqlite3.Connection, table:str, fmt:str = 'csv', min_time:int = None, max_time:int = None,
+                 since:int = None, batch_size:int = 1000, partitions = ('main',)):
+        """Prepares an export, raising ValueError for invalid options
+
+        Args:
+            connection (sqlite3.Connection): Database connection to export from
+            table (str): Table to export, one of EXPORT_TABLES
+            fmt (str, optional): 'csv' (with a header row) or 'ndjson' (one JSON object per line). Defaults to 'csv'.
+            min_time (int, optional): Only export rows of games at or after this timestamp. Defaults to None.
+            max_time (int, optional): Only export rows of games at or before this timestamp. Defaults to None.
+            since (int, optional): Cursor returned by a previous export, only rows of games registered after it are exported (not supported for users). Defaults to None (all rows).
+            batch_size (int, optional): Number of rows fetched at a time. Defaults to 1000.
+            partitions (iterable, optional): Schema names of the attached databases holding games, in export order. Each schema is
+                only read after the previous one is done, so it can be a generator attaching them as it goes. Defaults to ('main',).
+        """
+        if table not in EXPORT_TABLES:
+            raise ValueError(f'Export table must be one of {", ".join(EXPORT_TABLES)}: {table}')
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f'Export format must be one of {", ".join(EXPORT_FORMATS)}: {fmt}')
+
+        self.columns, from_clause, time_column, cursor_column = EXPORT_TABLES[table]
+        if time_column is None and (min_time is not None or max_time is not None):
+            raise ValueError(f'Time filters are not supported for {table}')
+        if cursor_column is None and since is not None:
+            raise ValueError(f'Incremental exports (since) are not supported for {table}')
+
+        self.table = table
+        self.format = fmt
+        self.batch_size = batch_size
+        self.content_type = 'text/csv; charset=utf-8' if fmt == 'csv' else 'application/x-ndjson'
+        self._connection = connection
+        self._partitions = partitions if time_column is not None else ('main',)
+
+        # Fix the end of the export now (the ID the next game will get), so games added while streaming are left for the next export
+        conditions = []
+        self._params = []
+        self.cursor = None
+        if cursor_column is not None:
+            last_id = self._last_game_id(connection)
+            self.cursor = last_id + 1 if last_id is not None else 0
+            if since is not None:
+                self.cursor = max(self.cursor, since)
+
+            conditions.append(f'{cursor_column} < ?')
+            self._params.append(self.cursor)
+            if since is not None:
+                conditions.append(f'{cursor_column} >= ?')
+                self._params.append(since)
+
+        # Time filtered exports are read in timestamp order through the timestamp index, the unary + stops SQLite
+        # from choosing a game ID range scan of the whole table instead
+        time_filtered = min_time is not None or max_time is not None
+        order = cursor_column or 'rowid'
+        if time_filtered:
+            order = f'{time_column}, {order}'
+            conditions = ['+' + condition for condition in conditions]
+        if min_time is not None:
+            conditions.append(f'{time_column} >= ?')
+            self._params.append(min_time)
+        if max_time is not None:
+            conditions.append(f'{time_column} <= ?')
+            self._params.append(max_time)
+
+        columns = ', '.join('games.timestamp' if column == 'timestamp' and table != 'games' else column for column in self.columns)
+        where = f' WHERE {" AND ".join(conditions)}' if conditions else ''
+        self._sql = f'SELECT {columns} FROM {from_clause}{where} ORDER BY {order}'
+        self.headers = {'X-Export-Cursor': str(self.cursor)} if self.cursor is not None else {}
+
+
+    @staticmethod
+    def _last_game_id(connection:sqlite3.Connection):
+        # Highest game ID registered, including games moved into archives (recorded in the archives table of databases that have one)
+        last_ids = [connection.execute('SELECT MAX(game_id) FROM main.games').fetchone()[0]]
+        if connection.execute("SELECT COUNT(*) FROM main.sqlite_master WHERE type='table' AND name='archives'").fetchone()[0]:
+            last_ids.append(connection.execute('SELECT MAX(max_game_id) FROM main.archives').fetchone()[0])
+        last_ids = [last_id for last_id in last_ids if last_id is not None]
+        return max(last_ids) if last_ids else None
+
+
+    def __iter__(self):
+        # Yields the export as text chunks, one per batch of rows
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator='\n') if self.format == 'csv' else None
+        if writer:
+            writer.writerow(self.columns)
+
+        # The cursor of each partition is closed before moving on, so the next one can be attached
+        for schema in self._partitions:
+            cursor = self._connection.cursor()
+            try:
+                cursor.execute(self._sql.format(schema=schema), self._params)
+                while True:
+                    rows = cursor.fetchmany(self.batch_size)
+                    if not rows:
+                        break
+
+                    if writer:
+                        writer.writerows(rows)
+                    else:
+                        for row in rows:
+                            buffer.write(json.dumps(dict(zip(self.columns, row))))
+                            buffer.write('\n')
+
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+            finally:
+                cursor.close()
+
+        # The header is still sent for an empty CSV export
+        if buffer.tell():
+            yield buffer.getvalue()
+
+
+    def write(self, out):
+        """Writes the whole export to a text file object
+
+        Returns:
+            int: the export cursor, see ExportStream (None for users)
+        """
+        for chunk in self:
+            out.write(chunk)
+        return self.cursor
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export PicklePals data as CSV or NDJSON, safe to run while the server is running')
+    parser.add_argument('table', choices=EXPORT_TABLES, help='Table to export')
+    parser.add_argument('--db', default='database/pickle.db', help='Database file (default: database/pickle.db)')
+    parser.add_argument('--format', choices=EXPORT_FORMATS, default='csv', help='Output format (default: csv)')
+    parser.add_argument('--out', help='Output file (default: stdout)')
+    parser.add_argument('--min-time', type=int, help='Only export games at or after this unix timestamp')
+    parser.add_argument('--max-time', type=int, help='Only export games at or before this unix timestamp')
+    parser.add_argument('--since', type=int, help='Only export rows of games registered after this cursor (printed by a previous export, not supported for users)')
+    parser.add_argument('--cursor-file', help='Read the since cursor from this file if it exists, and save the new cursor to it after exporting')
+    args = parser.parse_args()
+
+    since = args.since
+    if args.cursor_file and since is None and os.path.isfile(args.cursor_file):
+        with open(args.cursor_file) as file:
+            since = int(file.read().strip())
+
+    connection = sqlite3.connect(args.db)
+    try:
+        export = ExportStream(connection, args.table, args.format, args.min_time, args.max_time, since)
+    except ValueError as error:
+        parser.error(str(error))
+
+    if args.out:
+        with open(args.out, 'w', newline='') as file:
+            cursor = export.write(file)
+    else:
+        cursor = export.write(sys.stdout)
+    connection.close()
+
+    if cursor is not None:
+        if args.cursor_file:
+            with open(args.cursor_file, 'w') as file:
+                file.write(str(cursor))
+
+        print(f'Export cursor: {cursor}', file=sys.stderr)
@@ -0,0 +1,259 @@
+import argparse
+import itertools
+import json
+import multiprocessing
+import random
+import threading
+import time
+
+import requests
+
+from .database_api import restAPI
+from .database_server import PickleServer
+
+# Password of every user made by database_setup.generate_db
+GENERATED_PASSWORD = 'Generated_Pass1'
+
+# Relative weight of each action a simulated app user performs
+DEFAULT_MIX = {
+    'getStats': 30,
+    'friends': 20,
+    'games': 20,
+    'gameGet': 15,
+    'gameStats': 5,
+    'register': 5,
+    'renew': 5,
+}
+
+# Timestamps for registered games, far in the future and shared by all threads so game hashes never collide
+_timestamps = itertools.count(5000000000)
+
+
+class SimulatedUser:
+    """A simulated app user, which logs in and then performs a random mix of requests against a PickleServer"""
+
+    def __init__(self, url:str, num_users:int, mix:dict, rng:random.Random):
+        self.url = url.rstrip('/')
+        self.num_users = num_users
+        self.rng = rng
+        self.actions = list(mix)
+        self.weights = list(mix.values())
+        self.session = requests.Session()
+        self.user_id = rng.randint(1, num_users)
+        self.api_key = None
+        self.renewal_key = None
+        self.game_ids = []
+
+        # (action, latency in seconds, success) of every request
+        self.results = []
+
+    def _post(self, action:str, endpoint:str, params:dict):
+        # Sends a request, recording its latency and whether it succeeded. Returns the response JSON (None if it failed)
+        headers = {'Authorization':f'Bearer {self.api_key}'} if self.api_key else {}
+        start = time.perf_counter()
+        try:
+            response = self.session.post(f'{self.url}/pickle/{endpoint}', json=params, headers=headers, timeout=30)
+            ok = response.status_code == 200
+        except requests.RequestException:
+            response = None
+            ok = False
+
+        self.results.append((action, time.perf_counter() - start, ok))
+        return response.json() if ok else None
+
+    def login(self):
+        keys = self._post('auth', 'user/auth', {'username':f'gen_user_{self.user_id}', 'password':GENERATED_PASSWORD})
+        if keys:
+            self.api_key = keys['apiKey']
+            self.renewal_key = keys['renewalKey']
+
+        # Find some games to browse
+        games = self._post('games', 'user/games', {'user_id':self.user_id})
+        if games:
+            self.game_ids = games['game_ids'][-50:]
+
+    def step(self):
+        # Performs one random action from the endpoint mix
+        action = self.rng.choices(self.actions, self.weights)[0]
+
+        # Users with no games yet can only browse their profile
+        if action in ('gameGet', 'gameStats') and not self.game_ids:
+            action = 'getStats'
+
+        if action == 'getStats':
+            self._post(action, 'user/getStats', {'user_id':self.user_id})
+        elif action == 'friends':
+            self._post(action, 'user/friends', {'user_id':self.user_id})
+        elif action == 'games':
+            self._post(action, 'user/games', {'user_id':self.user_id, 'min_time':int(time.time()) - 30 * 86400})
+        elif action == 'gameGet':
+            self._post(action, 'game/get', {'game_id':self.rng.choice(self.game_ids)})
+        elif action == 'gameStats':
+            self._post(action, 'game/stats', {'user_id':self.user_id, 'game_id':self.game_ids[-10:]})
+        elif action == 'register':
+            opponent_id = self.rng.randint(1, self.num_users)
+            while opponent_id == self.user_id:
+                opponent_id = self.rng.randint(1, self.num_users)
+            game = self._post(action, 'game/register', {'timestamp':next(_timestamps), 'game_type':0, 'winner_id':self.user_id, 'loser_id':opponent_id,
+                                                         'winner_points':11, 'loser_points':self.rng.randint(0, 9)})
+            if game:
+                self.game_ids.append(game['game_id'])
+                self._post('registerStats', 'game/registerStats', {'user_id':self.user_id, 'game_id':game['game_id'], 'swing_count':120, 'swing_hits':80,
+                                                                   'swing_max':21.5, 'Q1_hits':20, 'Q2_hits':20, 'Q3_hits':20, 'Q4_hits':20})
+        elif action == 'renew':
+            keys = self._post(action, 'user/auth/renew', {'apiKey':self.api_key, 'renewalKey':self.renewal_key})
+            if keys:
+                self.api_key = keys['apiKey']
+                self.renewal_key = keys['renewalKey']
+
+
+def _percentile(sorted_values:list, fraction:float):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def summarize(results:list, duration:float):
+    """Summarizes (action, latency, success) results from a load test level
+
+    Returns:
+        dict: 'requests', 'throughput' (requests/s), 'error_rate', latency percentiles in ms ('p50_ms', 'p90_ms', 'p99_ms', 'max_ms'),
+        and 'actions' with the request count, error rate and p50/p99 latency of each action
+    """
+    def stats(subset):
+        latencies = sorted(latency * 1000 for _, latency, _ in subset)
+        errors = sum(1 for _, _, ok in subset if not ok)
+        return {
+            'requests': len(subset),
+            'error_rate': errors / len(subset) if subset else 0,
+            'p50_ms': _percentile(latencies, 0.50),
+            'p90_ms': _percentile(latencies, 0.90),
+            'p99_ms': _percentile(latencies, 0.99),
+            'max_ms': latencies[-1] if latencies else None,
+        }
+
+    summary = stats(results)
+    summary['throughput'] = len(results) / duration if duration > 0 else 0
+
+    by_action = {}
+    for result in results:
+        by_action.setdefault(result[0], []).append(result)
+    summary['actions'] = {action: stats(subset) for action, subset in sorted(by_action.items())}
+    return summary
+
+
+def run_level(url:str, concurrency:int, duration:float, num_users:int, mix:dict = None, seed:int = 0):
+    """Runs a number of concurrent simulated users against a server for a fixed duration.
+    Logins happen before the timed period starts.
+
+    Args:
+        url (str): Base URL of the server, e.g. 'http://localhost:8080'
+        concurrency (int): Number of simulated users, each in its own thread
+        duration (float): Length of the timed period in seconds
+        num_users (int): Number of generated user accounts (gen_user_1 .. gen_user_N) in the server's database
+        mix (dict, optional): Relative weights of each action. Defaults to DEFAULT_MIX.
+        seed (int, optional): Random seed. Defaults to 0.
+
+    Returns:
+        dict: see summarize, plus 'concurrency'
+    """
+    users = [SimulatedUser(url, num_users, mix or DEFAULT_MIX, random.Random(seed * 100003 + i)) for i in range(concurrency)]
+    for user in users:
+        user.login()
+        user.results.clear()
+
+    start_barrier = threading.Barrier(concurrency + 1)
+    stop_time = [0.0]
+
+    def worker(user:SimulatedUser):
+        start_barrier.wait()
+        while time.perf_counter() < stop_time[0]:
+            user.step()
+
+    threads = [threading.Thread(target=worker, args=(user,), daemon=True) for user in users]
+    for thread in threads:
+        thread.start()
+
+    stop_time[0] = time.perf_counter() + duration
+    start_barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    summary = summarize([result for user in users for result in user.results], elapsed)
+    summary['concurrency'] = concurrency
+    return summary
+
+
+def find_saturation(levels:list, min_gain:float = 0.10):
+    # Returns the first concurrency level where adding users no longer increases throughput by at least min_gain
+    for previous, current in zip(levels, levels[1:]):
+        if current['throughput'] < previous['throughput'] * (1 + min_gain):
+            return previous['concurrency']
+    return None
+
+
+def _serve(db_path:str, port:int):
+    # Runs a PickleServer in a child process, so the load generator doesn't compete with it for the GIL
+    server = PickleServer(restAPI(db_path, useAuth=True), port)
+    with server:
+        while True:
+            time.sleep(0.5)
+
+
+def _parse_mix(text:str):
+    mix = {}
+    for item in text.split(','):
+        action, weight = item.split('=')
+        if action not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f'Unknown action {action}, must be one of {", ".join(DEFAULT_MIX)}')
+        mix[action] = float(weight)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test a PicklePals server with concurrent simulated app users')
+    parser.add_argument('--url', default='http://localhost:8080', help='Server URL (default: http://localhost:8080)')
+    parser.add_argument('--db', help='Start a server on this database (made by database_setup --users) instead of using a running one')
+    parser.add_argument('--users', type=int, required=True, help='Number of generated users in the server database')
+    parser.add_argument('--levels', default='1,2,4,8,16,32', help='Comma separated concurrency levels (default: 1,2,4,8,16,32)')
+    parser.add_argument('--duration', type=float, default=10, help='Seconds to run each level (default: 10)')
+    parser.add_argument('--mix', type=_parse_mix, help=f'Endpoint mix as action=weight pairs, e.g. getStats=5,register=1 (actions: {", ".join(DEFAULT_MIX)})')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed (default: 0)')
+    parser.add_argument('--out', help='Save the report to this JSON file')
+    args = parser.parse_args()
+
+    server = None
+    if args.db:
+        port = int(args.url.rsplit(':', 1)[1])
+        server = multiprocessing.Process(target=_serve, args=(args.db, port), daemon=True)
+        server.start()
+        time.sleep(1)
+
+    print('Note: the server should run without rate limiting (noRateLimit), or most requests will be rejected with 429\n')
+    print(f'{"users":>6}{"requests":>10}{"req/s":>10}{"p50 ms":>10}{"p90 ms":>10}{"p99 ms":>10}{"errors":>9}')
+
+    levels = []
+    try:
+        for concurrency in (int(level) for level in args.levels.split(',')):
+            level = run_level(args.url, concurrency, args.duration, args.users, args.mix, args.seed)
+            levels.append(level)
+            print(f'{concurrency:>6}{level["requests"]:>10}{level["throughput"]:>10.1f}{level["p50_ms"] or 0:>10.2f}'
+                  f'{level["p90_ms"] or 0:>10.2f}{level["p99_ms"] or 0:>10.2f}{level["error_rate"]:>9.1%}')
+    finally:
+        if server:
+            server.terminate()
+
+    saturation = find_saturation(levels)
+    if saturation:
+        print(f'\nThroughput stops scaling at about {saturation} concurrent users')
+
+    if args.out:
+        with open(args.out, 'w') as file:
+            json.dump({'levels':levels, 'saturation':saturation}, file, indent=2)
+        print(f'Report saved to {args.out}')
+
+
+if __name__ == '__main__':
+    main()
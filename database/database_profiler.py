@@ -0,0 +1,195 @@
+import cProfile
+import marshal
+import pstats
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+class RequestProfiler:
+    """An on-demand profiler for live API requests, which profiles a fraction of requests or every request to one endpoint.
+    Starts disabled, and can be configured at runtime (e.g. through pickle/admin/profile).
+
+    Two modes are supported:
+        'cprofile': deterministic profiling of each sampled request with cProfile, aggregated into pstats data
+        'sample': a background thread samples the stacks of sampled requests every `interval` seconds, aggregated into
+            collapsed stacks ("frame;frame;frame count" lines, as used by flamegraph.pl and speedscope)
+    """
+
+    MODES = ('cprofile', 'sample')
+
+    def __init__(self, rng:random.Random = None):
+        """Creates a disabled request profiler
+
+        Args:
+            rng (random.Random, optional): Random number generator used to choose sampled requests, mostly useful for testing. Defaults to a new Random.
+        """
+        self.enabled = False
+        self.mode = 'cprofile'
+        self.sample_rate = 0.0
+        self.endpoint = None
+        self.interval = 0.001
+
+        self._rng = rng or random.Random()
+        self._lock = threading.Lock()
+        self._stats = None
+        self._stacks = Counter()
+        self._profiled = 0
+
+        # Thread IDs of requests currently being stack sampled, mapped to their endpoint names (guarded by _lock)
+        self._active = {}
+        self._sampler = None
+
+
+    def configure(self, enabled:bool, mode:str = None, sample_rate:float = None, endpoint:str = None, interval:float = None):
+        """Changes the profiler settings, keeping results collected so far
+
+        Args:
+            enabled (bool): Whether to profile requests at all
+            mode (str, optional): 'cprofile' or 'sample'. Defaults to the current mode.
+            sample_rate (float, optional): Fraction of requests to profile, from 0 to 1. Defaults to the current rate.
+            endpoint (str, optional): Endpoint name (e.g. 'user_friends') to profile every request of, '' to clear it. Defaults to the current endpoint.
+            interval (float, optional): Seconds between stack samples in 'sample' mode. Defaults to the current interval.
+
+        Raises:
+            ValueError: for an unknown mode, or a sample rate or interval out of range
+        """
+        if mode is not None and mode not in self.MODES:
+            raise ValueError(f'Profiler mode must be one of {", ".join(self.MODES)}: {mode}')
+        if sample_rate is not None and not 0 <= sample_rate <= 1:
+            raise ValueError(f'Profiler sample rate must be between 0 and 1: {sample_rate}')
+        if interval is not None and interval <= 0:
+            raise ValueError(f'Profiler interval must be positive: {interval}')
+
+        with self._lock:
+            self.enabled = enabled
+            if mode is not None:
+                self.mode = mode
+            if sample_rate is not None:
+                self.sample_rate = sample_rate
+            if endpoint is not None:
+                self.endpoint = endpoint.replace('/', '_') or None
+            if interval is not None:
+                self.interval = interval
+
+        # The sampler thread only runs while it has something to do
+        if self.enabled and self.mode == 'sample':
+            self._start_sampler()
+        else:
+            self._stop_sampler()
+
+
+    def should_profile(self, endpoint:str):
+        # Decides whether to profile a request, this is the only cost added to requests while the profiler is disabled
+        if not self.enabled:
+            return False
+        if endpoint == self.endpoint:
+            return True
+        return self.sample_rate > 0 and self._rng.random() < self.sample_rate
+
+
+    def run(self, endpoint:str, func, params:dict):
+        """Calls an endpoint function while profiling it, and returns its result"""
+        if self.mode == 'sample':
+            thread_id = threading.get_ident()
+            with self._lock:
+                self._active[thread_id] = endpoint
+            try:
+                return func(params)
+            finally:
+                with self._lock:
+                    del self._active[thread_id]
+                    self._profiled += 1
+
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(func, params)
+        finally:
+            with self._lock:
+                if self._stats is None:
+                    self._stats = pstats.Stats(profile)
+                else:
+                    self._stats.add(profile)
+                self._profiled += 1
+
+
+    def status(self):
+        # Current settings and amount of data collected
+        return {
+            'enabled': self.enabled,
+            'mode': self.mode,
+            'sample_rate': self.sample_rate,
+            'endpoint': self.endpoint,
+            'interval': self.interval,
+            'profiled_requests': self._profiled,
+            'samples': sum(self._stacks.values()),
+        }
+
+
+    def pstats_data(self):
+        """Returns the aggregated cProfile results, in the binary format written by pstats.Stats.dump_stats
+        (load with pstats.Stats(filename) after saving to a file). Empty if nothing was profiled in 'cprofile' mode"""
+        with self._lock:
+            if self._stats is None:
+                return b''
+            return marshal.dumps(self._stats.stats)
+
+
+    def collapsed_stacks(self):
+        """Returns the aggregated stack samples as collapsed stacks, one "endpoint;frame;frame count" line per unique stack,
+        with the outermost frame first. Empty if nothing was sampled in 'sample' mode"""
+        with self._lock:
+            return ''.join(f'{stack} {count}\n' for stack, count in self._stacks.most_common())
+
+
+    def reset(self):
+        # Discards all results collected so far
+        with self._lock:
+            self._stats = None
+            self._stacks.clear()
+            self._profiled = 0
+
+
+    def _start_sampler(self):
+        if self._sampler is None:
+            self._sampler = threading.Thread(target=self._sample_loop, daemon=True)
+            self._sampler.start()
+
+    def _stop_sampler(self):
+        sampler = self._sampler
+        self._sampler = None
+        if sampler is not None and sampler is not threading.current_thread():
+            sampler.join()
+
+    def _sample_loop(self):
+        # Runs until the sampler is stopped (configure sets self._sampler to a different value)
+        current = threading.current_thread()
+        while self._sampler is current:
+            # Snapshot the active requests, request threads add and remove themselves while the sampler runs
+            with self._lock:
+                active = list(self._active.items())
+
+            if active:
+                frames = sys._current_frames()
+                samples = []
+                for thread_id, endpoint in active:
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        samples.append(self._collapse(endpoint, frame))
+
+                with self._lock:
+                    self._stacks.update(samples)
+
+            time.sleep(self.interval)
+
+    @staticmethod
+    def _collapse(endpoint:str, frame):
+        # Builds a collapsed stack string from a frame, with the endpoint as the root in place of the server frames above run()
+        stack = []
+        while frame is not None and frame.f_code is not RequestProfiler.run.__code__:
+            code = frame.f_code
+            stack.append(f'{code.co_name} ({code.co_filename.rsplit("/", 1)[-1]}:{code.co_firstlineno})')
+            frame = frame.f_back
+        stack.append(endpoint)
+        return ';'.join(reversed(stack))
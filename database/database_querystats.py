@@ -0,0 +1,218 @@
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# A statement shape run this many times in one request is flagged as an N+1 query pattern
+N_PLUS_ONE_THRESHOLD = 10
+
+# Literal values and "IN (?, ?, ...)" lists are collapsed so statements with the same structure have the same shape
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"\b\d+(\.\d+)?\b")
+_PARAM_LIST_RE = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_SPACE_RE = re.compile(r"\s+")
+
+def statement_shape(sql:str):
+    # Normalizes an SQL statement into its shape, e.g. "SELECT * FROM games WHERE game_id IN (?, ?)" -> "SELECT * FROM games WHERE game_id IN (?+)"
+    shape = _STRING_RE.sub('?', sql)
+    shape = _NUMBER_RE.sub('?', shape)
+    shape = _PARAM_LIST_RE.sub('(?+)', shape)
+    return _SPACE_RE.sub(' ', shape).strip()
+
+
+class RequestQueries:
+    """The SQL statements executed during a single request (or a QueryRecorder.capture block)"""
+
+    def __init__(self, endpoint:str):
+        self.endpoint = endpoint
+
+        # (sql, seconds) of each statement, in the order they were executed
+        self.statements = []
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    @property
+    def time(self):
+        return sum(seconds for _, seconds in self.statements)
+
+    def shapes(self):
+        # Number of times each statement shape was executed
+        shapes = {}
+        for sql, _ in self.statements:
+            shape = statement_shape(sql)
+            shapes[shape] = shapes.get(shape, 0) + 1
+        return shapes
+
+    def repeated(self, threshold:int = N_PLUS_ONE_THRESHOLD):
+        # Statement shapes executed at least threshold times, the signature of an N+1 query pattern
+        return {shape: count for shape, count in self.shapes().items() if count >= threshold}
+
+    def assert_max_queries(self, max_count:int):
+        """Test helper, fails with a list of the executed statements if more than max_count statements were run"""
+        if self.count > max_count:
+            listing = '\n'.join(f'  {sql}' for sql, _ in self.statements)
+            raise AssertionError(f'{self.endpoint} executed {self.count} SQL statements, expected at most {max_count}:\n{listing}')
+
+    def assert_no_repeats(self, threshold:int = N_PLUS_ONE_THRESHOLD):
+        """Test helper, fails with the repeated shapes if any statement shape was executed threshold or more times (an N+1 query pattern)"""
+        repeated = self.repeated(threshold)
+        if repeated:
+            listing = '\n'.join(f'  {count}x {shape}' for shape, count in repeated.items())
+            raise AssertionError(f'{self.endpoint} repeated SQL statements {threshold} or more times (N+1 pattern):\n{listing}')
+
+
+class InstrumentedCursor:
+    """Wraps an sqlite3 cursor, timing every execute/executemany and reporting it to a QueryRecorder.
+    Everything else (fetchone, rowcount, iteration...) is passed through to the real cursor"""
+
+    def __init__(self, cursor, recorder):
+        self._cursor = cursor
+        self._recorder = recorder
+
+    def execute(self, sql:str, parameters = ()):
+        start = time.perf_counter()
+        self._cursor.execute(sql, parameters)
+        self._recorder.record(self._cursor.connection, sql, parameters, time.perf_counter() - start)
+        return self
+
+    def executemany(self, sql:str, seq_of_parameters):
+        start = time.perf_counter()
+        self._cursor.executemany(sql, seq_of_parameters)
+        self._recorder.record(self._cursor.connection, sql, None, time.perf_counter() - start)
+        return self
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class QueryRecorder:
+    """Collects SQL statement counts and times per request, a slow query log with query plans, and N+1 query patterns.
+    Pass one to restAPI to instrument its database cursor"""
+
+    def __init__(self, slow_threshold:float = 0.05, n_plus_one_threshold:int = N_PLUS_ONE_THRESHOLD, max_log:int = 100):
+        """Creates a query recorder
+
+        Args:
+            slow_threshold (float, optional): Statements taking at least this many seconds are added to the slow query log. Defaults to 0.05.
+            n_plus_one_threshold (int, optional): Requests repeating a statement shape this many times are flagged as N+1. Defaults to N_PLUS_ONE_THRESHOLD.
+            max_log (int, optional): Number of entries kept in the slow query and N+1 logs. Defaults to 100.
+        """
+        self.slow_threshold = slow_threshold
+        self.n_plus_one_threshold = n_plus_one_threshold
+
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._endpoints = {}
+        self._slow_queries = deque(maxlen=max_log)
+        self._n_plus_one = deque(maxlen=max_log)
+
+
+    def cursor(self, connection):
+        # Creates an instrumented cursor for a database connection
+        return InstrumentedCursor(connection.cursor(), self)
+
+
+    def begin(self, endpoint:str):
+        # Starts recording the statements of a request on the current thread
+        self._local.request = RequestQueries(endpoint)
+
+    def end(self):
+        """Stops recording the current request and adds it to the per-endpoint totals
+
+        Returns:
+            RequestQueries: the statements executed by the request, or None if no request was being recorded
+        """
+        request = getattr(self._local, 'request', None)
+        self._local.request = None
+        if request is None:
+            return None
+
+        repeated = request.repeated(self.n_plus_one_threshold)
+        with self._lock:
+            totals = self._endpoints.setdefault(request.endpoint, {'requests':0, 'statements':0, 'time_ms':0.0, 'max_statements':0, 'n_plus_one':0})
+            totals['requests'] += 1
+            totals['statements'] += request.count
+            totals['time_ms'] += request.time * 1000
+            totals['max_statements'] = max(totals['max_statements'], request.count)
+            if repeated:
+                totals['n_plus_one'] += 1
+                self._n_plus_one.append({'endpoint':request.endpoint, 'time':time.time(), 'repeated':repeated})
+
+        return request
+
+
+    @contextmanager
+    def capture(self, name:str = 'capture'):
+        """Test helper, records every statement run in the with block on this thread
+
+        Example:
+            with recorder.capture() as queries:
+                api._api_user_friends({'user_id':1})
+            queries.assert_max_queries(3)
+        """
+        outer = getattr(self._local, 'request', None)
+        self.begin(name)
+        request = self._local.request
+        try:
+            yield request
+        finally:
+            self.end()
+            self._local.request = outer
+
+
+    def record(self, connection, sql:str, parameters, seconds:float):
+        # Called by InstrumentedCursor after each statement
+        request = getattr(self._local, 'request', None)
+        if request is not None:
+            request.statements.append((sql, seconds))
+
+        if seconds >= self.slow_threshold:
+            self._log_slow_query(connection, sql, parameters, seconds, request)
+
+
+    def _log_slow_query(self, connection, sql:str, parameters, seconds:float, request):
+        # Adds a statement to the slow query log along with its query plan, so full table scans are easy to spot
+        plan = None
+        if parameters is not None and sql.lstrip()[:6].upper() in ('SELECT', 'UPDATE', 'DELETE', 'INSERT'):
+            try:
+                plan = [row[-1] for row in connection.execute('EXPLAIN QUERY PLAN ' + sql, parameters).fetchall()]
+            except Exception:
+                pass
+
+        entry = {
+            'endpoint': request.endpoint if request else None,
+            'sql': sql,
+            'time_ms': seconds * 1000,
+            'plan': plan,
+            'full_scan': any(step.startswith('SCAN') and 'USING' not in step for step in plan) if plan else None,
+        }
+        with self._lock:
+            self._slow_queries.append(entry)
+
+
+    def metrics(self):
+        """Returns the collected query metrics
+
+        Returns:
+            dict: 'endpoints': per-endpoint totals ('requests', 'statements', 'time_ms', 'max_statements', 'n_plus_one' request count),
+            'slow_queries': the slow query log, 'n_plus_one': the most recent requests flagged as N+1 with their repeated shapes
+        """
+        with self._lock:
+            return {
+                'endpoints': {endpoint: dict(totals) for endpoint, totals in sorted(self._endpoints.items())},
+                'slow_queries': list(self._slow_queries),
+                'n_plus_one': list(self._n_plus_one),
+            }
+
+    def reset(self):
+        # Discards all collected metrics
+        with self._lock:
+            self._endpoints.clear()
+            self._slow_queries.clear()
+            self._n_plus_one.clear()
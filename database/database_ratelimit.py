@@ -0,0 +1,78 @@
+import threading
+import time
+from collections import OrderedDict
+
+class RateLimiter:
+    """An in-memory token bucket rate limiter for the PicklePals API.
+    Buckets are keyed by limit class and client identity (sender user ID or client address)"""
+
+    # Limits are (tokens refilled per second, bucket capacity) for each limit class
+    DEFAULT_LIMITS = {
+        'default': (10.0, 60),
+        'auth': (0.2, 5),
+    }
+
+    def __init__(self, limits:dict = None, max_buckets:int = 10000, clock = time.monotonic):
+        """Creates a rate limiter with a set of token bucket limit classes
+
+        Args:
+            limits (dict, optional): (rate, capacity) tuples keyed by limit class name. Defaults to DEFAULT_LIMITS.
+            max_buckets (int, optional): Maximum number of buckets kept in memory before the least recently used are evicted. Defaults to 10000.
+            clock (callable, optional): Monotonic time source in seconds, mostly useful for testing. Defaults to time.monotonic.
+        """
+        self.limits = dict(self.DEFAULT_LIMITS)
+        if limits:
+            self.limits.update(limits)
+
+        self.max_buckets = max_buckets
+        self._clock = clock
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+
+    def consume(self, limit_class:str, key, tokens:float = 1):
+        """Attempts to take tokens from the bucket for a given limit class and key
+
+        Args:
+            limit_class (str): Name of the limit class (see DEFAULT_LIMITS)
+            key: Identity of the client, e.g. ('user', 1) or ('ip', '127.0.0.1')
+            tokens (float, optional): Number of tokens this request costs. Defaults to 1.
+
+        Returns:
+            float: 0 if the request is allowed, otherwise the number of seconds until enough tokens are available
+        """
+        rate, capacity = self.limits.get(limit_class, self.limits['default'])
+        bucket_key = (limit_class, key)
+        now = self._clock()
+
+        with self._lock:
+            # Buckets are stored as [tokens, last_update], a new client starts with a full bucket
+            bucket = self._buckets.get(bucket_key)
+            if bucket is None:
+                bucket = [capacity, now]
+                self._buckets[bucket_key] = bucket
+
+                # Evict the least recently used buckets once we're over capacity
+                while len(self._buckets) > self.max_buckets:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(bucket_key)
+
+            # Refill tokens based on the time since the last request
+            bucket[0] = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+
+            if bucket[0] >= tokens:
+                bucket[0] -= tokens
+                return 0
+
+            return (tokens - bucket[0]) / rate
+
+
+    def clear(self):
+        # Removes all buckets (every client starts again with a full bucket)
+        with self._lock:
+            self._buckets.clear()
+
+    def __len__(self):
+        return len(self._buckets)
@@ -0,0 +1,125 @@
+import functools
+
+def _to_int(value):
+    # bool is a subclass of int, but true/false is never a valid ID, count or timestamp
+    if type(value) is bool:
+        raise TypeError(value)
+    # Floats are only accepted if they're whole numbers, int() would silently truncate 3.7 to 3 (inf and nan aren't whole)
+    if type(value) is float and not value.is_integer():
+        raise ValueError(value)
+    return int(value)
+
+def _to_float(value):
+    if type(value) is bool:
+        raise TypeError(value)
+    return float(value)
+
+def _to_str(value):
+    if type(value) is not str:
+        raise TypeError(value)
+    return value
+
+def _to_bool(value):
+    # Accepts JSON booleans, 0/1, or the strings "true"/"false"
+    if type(value) is bool:
+        return value
+    if type(value) is int and value in (0, 1):
+        return bool(value)
+    if type(value) is str and value.lower() in ('true', 'false'):
+        return value.lower() == 'true'
+    raise ValueError(value)
+
+def _to_list(value):
+    if type(value) is not list:
+        raise TypeError(value)
+    return value
+
+def _to_int_list(value):
+    # A single int is wrapped in a list for easier processing
+    if type(value) is list:
+        return [_to_int(item) for item in value]
+    return [_to_int(value)]
+
+def _to_str_list(value):
+    # A single string is wrapped in a list for easier processing
+    if type(value) is list:
+        return [_to_str(item) for item in value]
+    return [_to_str(value)]
+
+
+# Parameter types that can be used in a schema, with their converter and a description used in error messages
+PARAM_TYPES = {
+    'int':      (_to_int,      'an int'),
+    'float':    (_to_float,    'a number'),
+    'str':      (_to_str,      'a string'),
+    'bool':     (_to_bool,     'true or false'),
+    'list':     (_to_list,     'a list'),
+    'int_list': (_to_int_list, 'an int or list of ints'),
+    'str_list': (_to_str_list, 'a string or list of strings'),
+}
+
+
+def compile_schema(endpoint:str, schema:dict):
+    """Compiles a parameter schema into a validator function for an endpoint
+
+    Args:
+        endpoint (str): Name of the endpoint (e.g. 'user_getStats'), used in error messages
+        schema (dict): Parameter types keyed by parameter name. Types are keys of PARAM_TYPES, with a '?' suffix for optional parameters
+
+    Returns:
+        function: validator taking (params, error_class), which returns a dict of the converted parameters (plus 'sender_id' if present)
+        and raises error_class with code 400 for missing or invalid parameters
+    """
+    uri = 'pickle/' + endpoint.replace('_', '/')
+
+    # Resolve the type of each parameter once, so validation is just a loop over (name, required, converter, description)
+    fields = []
+    for name, param_type in schema.items():
+        required = not param_type.endswith('?')
+        converter, description = PARAM_TYPES[param_type.rstrip('?')]
+        fields.append((name, required, converter, description))
+    fields = tuple(fields)
+
+    def validate(params:dict, error_class):
+        if type(params) is not dict:
+            raise error_class(f'Invalid parameters for {uri}, must be a JSON object: {params}', 400)
+
+        # The sender ID is added by handle_request, not the client, so it's passed through as-is
+        result = {}
+        if 'sender_id' in params:
+            result['sender_id'] = params['sender_id']
+
+        for name, required, converter, description in fields:
+            if name not in params:
+                if required:
+                    raise error_class(f'Invalid parameters for {uri}, missing required parameter "{name}"', 400)
+                continue
+
+            try:
+                result[name] = converter(params[name])
+            except (TypeError, ValueError, OverflowError):
+                raise error_class(f'Type Error: parameter "{name}" for {uri} must be {description}: {params[name]}', 400)
+
+        return result
+
+    return validate
+
+
+def params_schema(**schema):
+    """Decorator for restAPI endpoint functions, declaring the endpoint's parameters.
+    The schema is compiled once when the function is defined, and the endpoint receives the validated and converted parameters.
+
+    Args:
+        **schema: Parameter types keyed by parameter name, see compile_schema
+    """
+    def decorator(func):
+        validate = compile_schema(func.__name__[len('_api_'):], schema)
+
+        @functools.wraps(func)
+        def wrapper(self, params:dict):
+            return func(self, validate(params, self.APIError))
+
+        wrapper.schema = schema
+        return wrapper
+
+    return decorator
@@ -6,6 +6,11 @@ import sys
 import time
 
 from .database_api import restAPI
+from .database_ratelimit import RateLimiter
+from .database_profiler import RequestProfiler
+from .database_querystats import QueryRecorder
+from .database_backup import BackupScheduler
+from .database_export import ExportStream
 
 class PickleServer():
     def __init__(self, api:restAPI, port:int):
@@ -45,8 +50,16 @@ class PickleServer():
 
         def __init__(self, api:restAPI, *args, **kwargs):
             self.api = api
+            self.error_headers = {}
             super().__init__(*args, **kwargs)
 
+        def end_headers(self):
+            # Include any extra headers from an API error (e.g. Retry-After) in the error response
+            for key, value in self.error_headers.items():
+                self.send_header(key, value)
+            self.error_headers = {}
+            super().end_headers()
+
         def do_POST(self):
             print(f'{self.command} {self.path}')
 
@@ -68,15 +81,44 @@ class PickleServer():
                     if auth_message_split[0] == 'Bearer':
                         apiKey = auth_message_split[1]
 
-                response = self.api.handle_request(self.path, params, apiKey)
+                response = self.api.handle_request(self.path, params, apiKey, self.client_address[0])
                 print(f'\nResponse JSON:\n--------------\n{response}\n')
 
+                # Streamed downloads (data exports) are written a chunk at a time, ending when the connection closes
+                if isinstance(response, ExportStream):
+                    self.send_response(200)
+                    self.send_header('Content-type', response.content_type)
+                    for key, value in response.headers.items():
+                        self.send_header(key, value)
+                    self.end_headers()
+
+                    # The status was already sent, so a failed export (or a client that disconnected) can't be reported
+                    # with send_error, the response is cut short by closing the connection instead
+                    try:
+                        for chunk in response:
+                            self.wfile.write(chunk.encode('utf-8'))
+                    except Exception as error:
+                        print(f'Export stream failed: {error}')
+                        self.close_connection = True
+                    return
+
+                # File downloads (e.g. profiler results) are sent as-is instead of JSON
+                if isinstance(response, bytes):
+                    content_type = 'application/octet-stream'
+                elif isinstance(response, str):
+                    content_type = 'text/plain; charset=utf-8'
+                    response = response.encode('utf-8')
+                else:
+                    content_type = 'application/json'
+                    response = bytes(json.dumps(response), 'utf-8')
+
                 self.send_response(200)
-                self.send_header('Content-type', 'application/json')
+                self.send_header('Content-type', content_type)
                 self.end_headers()
-                self.wfile.write(bytes(json.dumps(response), 'utf-8'))
+                self.wfile.write(response)
 
             except restAPI.APIError as error:
+                self.error_headers = error.headers
                 self.send_error(error.code, f'API Error: {error}')
 
             except json.decoder.JSONDecodeError as error:
@@ -93,9 +135,17 @@ if __name__ == "__main__":
     auth = not 'noAuth' in sys.argv
     clear = 'clearDB' in sys.argv
     altPort = 'altPort' in sys.argv
+    rateLimit = not 'noRateLimit' in sys.argv
+    backup = not 'noBackup' in sys.argv
 
-    pickleAPI = restAPI(dbFile='database/pickle.db', useAuth=auth, clearDB=clear)
+    pickleAPI = restAPI(dbFile='database/pickle.db', useAuth=auth, clearDB=clear, rateLimiter=RateLimiter() if rateLimit else None, profiler=RequestProfiler(), queryRecorder=QueryRecorder())
     server = PickleServer(pickleAPI, 8080 if altPort else 80)
+
+    # Hourly online backups, which don't block requests while copying
+    backups = BackupScheduler('database/pickle.db', 'database/backups')
+    if backup:
+        backups.start()
+
     with server:
         print(f'PicklePals server started on port {server.port} with authentication {"enabled" if auth else "disabled"}')
 
@@ -104,4 +154,5 @@ if __name__ == "__main__":
                 time.sleep(0.5)
 
         except KeyboardInterrupt:
-            print("Keyboard Interrupt, shutting down server!")
\ No newline at end of file
+            print("Keyboard Interrupt, shutting down server!")
+            backups.stop()
\ No newline at end of file
@@ -1,53 +1,185 @@
+import argparse
+import hashlib
+import itertools
 import random
 import time
 
 from .database_api import restAPI
 
-def setup_db(dbPath:str, users:dict = None, gen_games:int = 0):
+def setup_db(dbPath:str, users:dict = None, gen_games:int = 0, seed:int = None):
     api = restAPI(dbPath, False, True)
+    rng = random.Random(seed)
 
     if users:
         for username,password in users.items():
             api._api_user_create({'username':username, 'password':password})
 
+        # Players are the user IDs of the accounts above plus the unknown user
+        players = [restAPI.UNKNOWN_USER] + list(range(1, len(users) + 1))
+
+        games = []
         for i in range(0, gen_games):
-            user_win = random.randint(0, len(users))
-            user_lose = random.randint(0, len(users)-1)
-            if user_lose >= user_win:
-                user_lose += 1
+            user_win, user_lose = rng.sample(players, 2)
+            points_win, points_lose = _random_score(rng)
+            timestamp = int(time.time() - ((gen_games-i) * 86400))
+            games.append({'timestamp':timestamp, 'game_type':0, 'winner_id':user_win, 'loser_id':user_lose, 'winner_points':points_win, 'loser_points':points_lose})
 
-            if user_win == 0:
-                user_win = -1
-            if user_lose == 0:
-                user_lose = -1
+        api.importGames(games)
 
-            points_win = random.randint(0,15)
-            if points_win < 11:
-                points_win = 11
+    api.close()
 
-            if points_win <= 11:
-                points_lose = random.randint(0,10)
-            else:
-                points_lose = points_win - 2
 
-            timestamp = int(time.time() - ((gen_games-i) * 86400))
+def _random_score(rng:random.Random):
+    # Generates a valid (winner_points, loser_points) score, most games end 11-x but some go to deuce
+    if rng.random() < 0.8:
+        return 11, rng.randint(0, 9)
+
+    points_lose = rng.randint(10, 13)
+    return points_lose + 2, points_lose
+
+
+def _batched(rows, batch_size:int):
+    # Splits an iterable of rows into lists of at most batch_size rows, so huge datasets never sit in memory at once
+    rows = iter(rows)
+    while batch := list(itertools.islice(rows, batch_size)):
+        yield batch
+
+
+def generate_db(dbPath:str, num_users:int, num_games:int, avg_friends:float = 5, stats_fraction:float = 0.5,
+                unknown_rate:float = 0.05, days:int = 365, seed:int = 0, batch_size:int = 50000, password:str = 'Generated_Pass1'):
+    """Generates a large database of realistic synthetic data for benchmarking, written with bulk inserts.
+    The same seed always produces the same database (apart from the current time used for timestamps).
+
+    Args:
+        dbPath (str): Filepath of the SQLite database to create (erased if it exists)
+        num_users (int): Number of user accounts, with usernames "gen_user_(user_id)"
+        num_games (int): Number of games, spread evenly over the last `days` days
+        avg_friends (float, optional): Average number of friends per user. Defaults to 5.
+        stats_fraction (float, optional): Fraction of games with user_game_stats rows for each (known) player. Defaults to 0.5.
+        unknown_rate (float, optional): Probability that a player in a game is the unknown user. Defaults to 0.05.
+        days (int, optional): Number of days of game history. Defaults to 365.
+        seed (int, optional): Seed for the random number generator. Defaults to 0.
+        batch_size (int, optional): Number of rows generated and inserted at a time. Defaults to 50000.
+        password (str, optional): Password of every generated user. Defaults to 'Generated_Pass1'.
+
+    Returns:
+        dict: number of rows generated in each table
+    """
+    if num_users < 2:
+        raise ValueError('Must generate at least 2 users')
+
+    rng = random.Random(seed)
+    api = restAPI(dbPath, False, True)
+    database = api._database
+    cursor = database.cursor()
+
+    # This is a throwaway file until it's finished, so skip waiting for the disk on every write
+    cursor.execute('PRAGMA synchronous=OFF')
+
+    # Building the games indexes once at the end is much faster than updating them on every insert
+    for index in ('games_hash', 'games_winner', 'games_loser', 'games_timestamp', 'user_game_stats_game'):
+        cursor.execute(f'DROP INDEX {index}')
+
+    # Users, each with their own salt (hashing is cheap compared to inserting)
+    def users():
+        for user_id in range(1, num_users + 1):
+            salt = bytearray(rng.randbytes(16))
+            pass_hash = bytearray(hashlib.sha256(salt + password.encode()).digest())
+            yield (user_id, f'gen_user_{user_id}', pass_hash, salt)
 
-            api._api_game_register({'timestamp':timestamp, 'game_type':0, 'winner_id':user_win, 'loser_id':user_lose, 'winner_points':points_win, 'loser_points':points_lose})
-    
+    for batch in _batched(users(), batch_size):
+        cursor.executemany("INSERT INTO users VALUES (?, ?, ?, ?, 1, 0, 0, 0.0)", batch)
+
+    # Friend graph, with no duplicates or self-friendships
+    friend_pairs = set()
+    for _ in range(int(num_users * avg_friends / 2)):
+        userA, userB = rng.sample(range(1, num_users + 1), 2)
+        friend_pairs.add((min(userA, userB), max(userA, userB)))
+
+    for batch in _batched(sorted(friend_pairs), batch_size):
+        cursor.executemany("INSERT INTO friends VALUES (?, ?)", batch)
+
+    # Games, with unique increasing timestamps (so no duplicate hashes) and stats for some of the known players
+    start_time = int(time.time()) - days * 86400
+    interval = max(1, days * 86400 // max(num_games, 1))
+    stats_count = 0
+
+    def random_player():
+        if rng.random() < unknown_rate:
+            return restAPI.UNKNOWN_USER
+        return rng.randint(1, num_users)
+
+    def games():
+        for game_id in range(num_games):
+            winner_id = random_player()
+            loser_id = random_player()
+            while loser_id == winner_id:
+                loser_id = random_player()
+
+            winner_points, loser_points = _random_score(rng)
+            timestamp = start_time + game_id * interval + rng.randrange(interval)
+            yield (game_id, timestamp, 0, winner_id, loser_id, winner_points, loser_points, f'{winner_id}:{loser_id}:{timestamp}')
+
+    def game_stats(game):
+        for user_id in (game[3], game[4]):
+            if user_id == restAPI.UNKNOWN_USER:
+                continue
+
+            # Split hits randomly between the 4 quadrants
+            swing_count = rng.randint(60, 250)
+            swing_hits = rng.randint(swing_count // 3, swing_count)
+            cuts = sorted(rng.randint(0, swing_hits) for _ in range(3))
+            quadrants = (cuts[0], cuts[1] - cuts[0], cuts[2] - cuts[1], swing_hits - cuts[2])
+            yield (user_id, game[0], swing_count, swing_hits, round(rng.uniform(8, 30), 2)) + quadrants
+
+    for batch in _batched(games(), batch_size):
+        cursor.executemany("INSERT INTO games VALUES (?, ?, ?, ?, ?, ?, ?, ?)", batch)
+
+        stats = [row for game in batch if rng.random() < stats_fraction for row in game_stats(game)]
+        cursor.executemany("INSERT INTO user_game_stats VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", stats)
+        stats_count += len(stats)
+
+    # Compute user aggregates once, now that every game is in
+    api._create_indexes()
+    api.updateUsersGameStats(range(1, num_users + 1), commit=False)
+    database.commit()
     api.close()
 
+    return {'users':num_users, 'friends':len(friend_pairs), 'games':num_games, 'user_game_stats':stats_count}
+
 
 
 if __name__ == '__main__':
-    users = {
-        'ninjamike1211': 'passUser_ID1',
-        'aje0714': 'passUser_ID2',
-        'BOT-Lee': 'passUser_ID3',
-        'jpk102pitt': 'passUser_ID4',
-        'testUser': 'test_USER_1234',
-    }
-    gen_games = 200
+    parser = argparse.ArgumentParser(description='Generate a PicklePals database')
+    parser.add_argument('path', nargs='?', default='database/pickle.db',
+                        help='Database file to create (default: database/pickle.db)')
+    parser.add_argument('--users', type=int,
+                        help='Generate a large synthetic database with this many users instead of the default test users')
+    parser.add_argument('--games', type=int, default=200,
+                        help='Number of games to generate (default: 200)')
+    parser.add_argument('--friends', type=float, default=5,
+                        help='Average friends per generated user (default: 5)')
+    parser.add_argument('--stats-fraction', type=float, default=0.5,
+                        help='Fraction of generated games with per-user game stats (default: 0.5)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Random seed (default: 0)')
+    args = parser.parse_args()
 
     print('Generating database...')
-    setup_db('database/pickle.db', users, gen_games)
-    print("Completed!")
+    start = time.time()
+
+    if args.users:
+        counts = generate_db(args.path, args.users, args.games, args.friends, args.stats_fraction, seed=args.seed)
+        print(', '.join(f'{count} {table}' for table, count in counts.items()))
+
+    else:
+        users = {
+            'ninjamike1211': 'passUser_ID1',
+            'aje0714': 'passUser_ID2',
+            'BOT-Lee': 'passUser_ID3',
+            'jpk102pitt': 'passUser_ID4',
+            'testUser': 'test_USER_1234',
+        }
+        setup_db(args.path, users, args.games, args.seed)
+
+    print(f"Completed in {time.time() - start:.1f}s!")
@@ -0,0 +1,89 @@
+import array
+import sys
+
+# Swing series are stored as one blob per user and game: the float32 speeds of every swing, followed by the uint32 times of every swing
+# (milliseconds since the start of the game), both little-endian. That's 8 bytes per swing, instead of a row per swing
+SPEED_TYPECODE = 'f'
+TIME_TYPECODE = 'I'
+BYTES_PER_SWING = array.array(SPEED_TYPECODE).itemsize + array.array(TIME_TYPECODE).itemsize
+MAX_SWING_TIME = 2**32 - 1
+MAX_SWING_SPEED = (2 - 2**-23) * 2**127 # largest float32, faster speeds would be stored as infinity
+
+
+def encode_swings(speeds:list, times:list):
+    """Packs a swing series into a blob, raising ValueError for an invalid series
+
+    Args:
+        speeds (list): swing speed (float) of each swing
+        times (list): time of each swing (int), in milliseconds since the start of the game, in increasing order
+
+    Returns:
+        bytes: the packed series, BYTES_PER_SWING bytes per swing
+    """
+    if len(speeds) != len(times):
+        raise ValueError(f'Swing speeds and times must have the same length ({len(speeds)} speeds, {len(times)} times)')
+
+    for speed in speeds:
+        # Compared without converting to float first, so huge ints don't overflow (NaN fails both comparisons)
+        if type(speed) not in (int, float) or not 0 <= speed <= MAX_SWING_SPEED:
+            raise ValueError(f'Swing speeds must be numbers from 0 to {MAX_SWING_SPEED}: {speed}')
+
+    previous = 0
+    for swing_time in times:
+        if type(swing_time) is not int or not previous <= swing_time <= MAX_SWING_TIME:
+            raise ValueError(f'Swing times must be increasing ints from 0 to {MAX_SWING_TIME}: {swing_time}')
+        previous = swing_time
+
+    speed_array = array.array(SPEED_TYPECODE, speeds)
+    time_array = array.array(TIME_TYPECODE, times)
+    if sys.byteorder == 'big':
+        speed_array.byteswap()
+        time_array.byteswap()
+    return speed_array.tobytes() + time_array.tobytes()
+
+
+def decode_swings(blob:bytes):
+    """Unpacks a blob made by encode_swings
+
+    Returns:
+        tuple: (speeds, times) lists
+    """
+    count = len(blob) // BYTES_PER_SWING
+    split = count * array.array(SPEED_TYPECODE).itemsize
+
+    speed_array = array.array(SPEED_TYPECODE, blob[:split])
+    time_array = array.array(TIME_TYPECODE, blob[split:])
+    if sys.byteorder == 'big':
+        speed_array.byteswap()
+        time_array.byteswap()
+    return speed_array.tolist(), time_array.tolist()
+
+
+def downsample_swings(speeds:list, times:list, points:int):
+    """Reduces a swing series to at most `points` swings for charting. The series is split into equal buckets of swings,
+    and the slowest and fastest swing of each bucket are kept (in time order), so peaks are never lost. A single point keeps the fastest swing
+
+    Returns:
+        tuple: (speeds, times) lists, the original lists if they're already short enough (or points is 0)
+    """
+    if points < 1 or len(speeds) <= points:
+        return speeds, times
+
+    if points == 1:
+        fastest = max(range(len(speeds)), key=speeds.__getitem__)
+        return [speeds[fastest]], [times[fastest]]
+
+    buckets = points // 2
+    sampled_speeds = []
+    sampled_times = []
+    for bucket in range(buckets):
+        start = len(speeds) * bucket // buckets
+        end = len(speeds) * (bucket + 1) // buckets
+
+        low = min(range(start, end), key=speeds.__getitem__)
+        high = max(range(start, end), key=speeds.__getitem__)
+        for index in sorted({low, high}):
+            sampled_speeds.append(speeds[index])
+            sampled_times.append(times[index])
+
+    return sampled_speeds, sampled_times
@@ -1,7 +1,17 @@
+import os
+import json
 import time
+import random
+import sqlite3
+import calendar
+import threading
 import pytest
 from database import database_setup
 from database.database_api import restAPI
+from database.database_ratelimit import RateLimiter
+from database.database_profiler import RequestProfiler
+from database.database_querystats import QueryRecorder, statement_shape
+from database.database_schema import compile_schema
 
 def setup_api(tmp_path, useAuth=False, users=None):
     db_path = tmp_path / 'pickle.db'
@@ -20,7 +30,7 @@ def test_init(tmp_path):
         api._dbCursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
         tables = api._dbCursor.fetchall()
         print(tables)
-        assert tables == [('users',), ('games',), ('user_game_stats',), ('friends',)]
+        assert tables == [('users',), ('games',), ('user_game_stats',), ('friends',), ('game_swings',), ('idempotency_keys',), ('archives',), ('archived_user_stats',)]
 
         # Check default user admin is the only user
         api._dbCursor.execute("SELECT user_id, username, valid, gamesPlayed, gamesWon, averageScore FROM users")
@@ -63,6 +73,73 @@ def test_init(tmp_path):
     run_init_tests()
 
 
+def test_routes(tmp_path):
+    api = setup_api(tmp_path)
+
+    # Every endpoint function has a route, and every route has an endpoint function
+    endpoints = {name[len('_api_'):] for name in dir(api) if name.startswith('_api_')}
+    assert endpoints == set(restAPI.ROUTES)
+
+    # Routes are reachable with '/' or '_' separators
+    func, meta = api._routes['/pickle/user/auth/renew']
+    assert func == api._api_user_auth_renew
+    assert meta == {'auth':False, 'readOnly':True, 'cacheable':False, 'rateLimit':'auth'}
+    assert api._find_route('/pickle/user/auth_renew') == api._routes['/pickle/user/auth/renew']
+    assert api._find_route('/pickle/user_getStats') == api._routes['/pickle/user/getStats']
+
+    # Unknown routes
+    with pytest.raises(restAPI.APIError) as apiError:
+        api._find_route('/notPickle/user/getStats')
+    assert apiError.value.code == 404
+    with pytest.raises(restAPI.APIError) as apiError:
+        api._find_route('/pickle')
+    assert apiError.value.code == 404
+    with pytest.raises(restAPI.APIError) as apiError:
+        api.handle_request('/pickle/user/notAnEndpoint', {})
+    assert apiError.value.code == 404
+
+
+def test_params_schema(tmp_path):
+    api = setup_api(tmp_path, users={'userA':'test_pass101A', 'userB':'test_pass101B'})
+    api._api_game_register({'timestamp':0, 'game_type':0, 'winner_id':1, 'loser_id':2, 'winner_points':11, 'loser_points':3})
+    api._api_game_register({'timestamp':1, 'game_type':0, 'winner_id':2, 'loser_id':1, 'winner_points':11, 'loser_points':3})
+
+    # Compiled validator converts types and wraps single values in lists
+    validate = compile_schema('user_games', {'user_id':'int', 'won':'bool?', 'game_id':'int_list?', 'name':'str_list?'})
+    assert validate({'user_id':'1', 'won':'false', 'game_id':3, 'name':'a', 'extra':5, 'sender_id':0}, restAPI.APIError) == {'user_id':1, 'won':False, 'game_id':[3], 'name':['a'], 'sender_id':0}
+    assert validate({'user_id':1}, restAPI.APIError) == {'user_id':1}
+
+    # Missing and invalid parameters raise consistent 400 errors
+    with pytest.raises(restAPI.APIError) as apiError:
+        validate({'won':True}, restAPI.APIError)
+    assert apiError.value.code == 400
+    assert apiError.value.message == 'Invalid parameters for pickle/user/games, missing required parameter "user_id"'
+    assert validate({'user_id':2.0, 'game_id':[3.0]}, restAPI.APIError) == {'user_id':2, 'game_id':[3]}
+    for bad_params in ({'user_id':'one'}, {'user_id':True}, {'user_id':1, 'won':'maybe'}, {'user_id':1, 'game_id':[1,'a']}, {'user_id':1, 'name':[1]},
+                       {'user_id':3.7}, {'user_id':1, 'game_id':[1, 2.5]}, {'user_id':float('inf')}, {'user_id':float('nan')}):
+        with pytest.raises(restAPI.APIError) as apiError:
+            validate(bad_params, restAPI.APIError)
+        assert apiError.value.code == 400
+        assert apiError.value.message.startswith('Type Error:')
+    with pytest.raises(restAPI.APIError) as apiError:
+        validate([1,2], restAPI.APIError)
+    assert apiError.value.code == 400
+
+    # JSON 1e400 is parsed as infinity, and ints too large for a float overflow
+    with pytest.raises(restAPI.APIError) as apiError:
+        validate(json.loads('{"user_id":1e400}'), restAPI.APIError)
+    assert apiError.value.code == 400
+    with pytest.raises(restAPI.APIError) as apiError:
+        compile_schema('test_float', {'value':'float'})({'value':10**400}, restAPI.APIError)
+    assert apiError.value.code == 400
+
+    # Endpoints receive the converted parameters ("false" used to be truthy)
+    assert api._api_user_games({'user_id':1, 'won':'false'}) == {'game_ids':[1]}
+    assert api._api_user_games({'user_id':'1', 'won':'true'}) == {'game_ids':[0]}
+    assert api._api_user_getUsername({'user_id':'2'}) == {2:'userB'}
+    assert api._api_user_games.schema == {'user_id':'int', 'won':'bool?', 'opponent_id':'int?', 'min_time':'int?', 'max_time':'int?'}
+
+
 def test_check_username(tmp_path):
     api = setup_api(tmp_path)
 
@@ -191,6 +268,30 @@ def test_are_users_friends(tmp_path):
     assert not api._are_users_friends(0, 2)
     assert not api._are_users_friends(0, 3)
 
+def test_friend_graph(tmp_path):
+    api = setup_api(tmp_path, users={'userA':'test_pass101A', 'userB':'test_pass101B', 'userC':'test_pass101C'})
+    api._api_user_addFriend({'user_id':1, 'friend_id':2})
+    api._api_user_addFriend({'user_id':3, 'friend_id':1})
+    assert api._restAPI__friends == {1:{2,3}, 2:{1}, 3:{1}}
+
+    # Graph is loaded from the database on startup
+    api.close()
+    api = restAPI(tmp_path / 'pickle.db', useAuth=False)
+    assert api._restAPI__friends == {1:{2,3}, 2:{1}, 3:{1}}
+    assert api._are_users_friends(3, 1)
+
+    # Removing friends and deleting users keeps the graph consistent
+    api._api_user_removeFriend({'user_id':2, 'friend_id':1})
+    assert not api._are_users_friends(1, 2)
+    api._api_user_delete({'user_id':3})
+    assert not api._are_users_friends(1, 3)
+    assert api._restAPI__friends == {1:set(), 2:set()}
+
+    # Graph matches the database after reconnecting
+    api.close()
+    api.openCon()
+    assert api._restAPI__friends == {}
+
 def test_user_canView(tmp_path):
     api = setup_api(tmp_path, useAuth=True, users={'userA':'test_pass101A', 'userB':'test_pass101B', 'userC':'test_pass101C'})
 
@@ -339,9 +440,7 @@ def test_checkApiKey(tmp_path):
 
     # Delete user and check that it's auth is invalid, and that the key is removed
     api._api_user_delete({'user_id':2, 'sender_id':2})
-    with pytest.raises(restAPI.APIError) as apiError:
-        api._checkApiKey(keyB)
-    assert apiError.value.code == 401
+    assert api._checkApiKey(keyB) == None
     assert keyB not in api._restAPI__apiKeys
     assert keyBVals['renewalKey'] not in api._restAPI__renewalKeys
 
@@ -1194,6 +1293,15 @@ def test_api_game_stats(tmp_path):
         2:None
     }
 
+    # Game exists but user has no stats in it
+    assert api._api_game_stats({'user_id':2, 'game_id':1, 'sender_id':2}) == {1:None}
+
+    # Stats without any swings have no hit percentage
+    api._api_game_registerStats({'user_id':2, 'game_id':1, 'swing_count':0, 'swing_hits':0, 'swing_max':0, 'Q1_hits':0, 'Q2_hits':0, 'Q3_hits':0, 'Q4_hits':0, 'sender_id':0})
+    assert api._api_game_stats({'user_id':2, 'game_id':1, 'sender_id':2}) == {
+        1:{'timestamp':1, 'swing_count':0, 'swing_hits':0, 'hit_percentage':None, 'swing_max':0, 'Q1_hits':0, 'Q2_hits':0, 'Q3_hits':0, 'Q4_hits':0}
+    }
+
     # Test invalid user
     with pytest.raises(restAPI.APIError) as apiError:
         api._api_game_stats({'user_id':3, 'sender_id':3})
@@ -1281,6 +1389,45 @@ def test_api_game_register(tmp_path):
     assert apiError.value.code == 403
 
 
+def test_api_game_register_idempotency(tmp_path):
+    api = setup_api(tmp_path, users={'userA':'test_pass101A', 'userB':'test_pass101B'})
+    game = {'timestamp':0, 'game_type':0, 'winner_id':1, 'loser_id':2, 'winner_points':11, 'loser_points':7}
+
+    # Retrying with the same key returns the original game instead of a duplicate error
+    assert api._api_game_register({**game, 'idempotency_key':'a1', 'sender_id':1}) == {'game_id':0}
+    assert api._api_game_register({**game, 'idempotency_key':'a1', 'sender_id':1}) == {'game_id':0}
+    api._dbCursor.execute("SELECT COUNT(*) FROM games")
+    assert api._dbCursor.fetchone() == (1,)
+    assert api._api_user_getStats({'user_id':1})[1]['gamesPlayed'] == 1
+
+    # Without a key (or with another user's key) the retry is still a duplicate
+    with pytest.raises(restAPI.APIError) as apiError:
+        api._api_game_register(game)
+    assert apiError.value.code == 403
+    with pytest.raises(restAPI.APIError) as apiError:
+        api._api_game_register({**game, 'idempotency_key':'a1', 'sender_id':2})
+    assert apiError.value.code == 403
+
+    # Reusing a key for a different game is a conflict
+    with pytest.raises(restAPI.APIError) as apiError:
+        api._api_game_register({**game, 'timestamp':1, 'idempotency_key':'a1', 'sender_id':1})
+    assert apiError.value.code == 409
+    assert api._api_game_register({**game, 'timestamp':1, 'idempotency_key':'a2', 'sender_id':1}) == {'game_id':1}
+
+    # Expired keys are ignored and purged when the next key is stored
+    api._dbCursor.execute("UPDATE idempotency_keys SET expiration=? WHERE key='a1'", (int(time.time()) - 1,))
+    with pytest.raises(restAPI.APIError) as apiError:
+        api._api_game_register({**game, 'idempotency_key':'a1', 'sender_id':1})
+    assert apiError.value.code == 403
+    assert api._api_game_register({**game, 'timestamp':2, 'idempotency_key':'a3', 'sender_id':1}) == {'game_id':2}
+    api._dbCursor.execute("SELECT user_id, key, game_id FROM idempotency_keys ORDER BY key")
+    assert api._dbCursor.fetchall() == [(1, 'a2', 1), (1, 'a3', 2)]
+
+    # Keys are looked up through the index
+    api._dbCursor.execute("EXPLAIN QUERY PLAN SELECT hash, game_id FROM idempotency_keys WHERE user_id=? AND key=? AND expiration>=?", (1, 'a1', 0))
+    assert 'idempotency_keys_key' in api._dbCursor.fetchone()[-1]
+
+
 def test_api_game_registerStats(tmp_path):
     api = setup_api(tmp_path, useAuth=True, users={'userA':'test_pass101A'})
     api._api_game_register({'timestamp':0, 'game_type':0, 'winner_id':1, 'loser_id':-1, 'winner_points':11, 'loser_points':3, 'sender_id':0})
@@ -1355,3 +1502,451 @@ def test_api_game_registerStats(tmp_path):
     with pytest.raises(restAPI.APIError) as apiError:
         api._api_game_registerStats({'user_id':1, 'game_id':1, 'swing_count':150, 'swing_hits':90, 'swing_max':20, 'Q1_hits':23, 'Q2_hits':24, 'Q3_hits':21, 'Q4_hits':22, 'sender_id':0})
     assert apiError.value.code == 403
+
+
+def test_api_game_registerSwings(tmp_path):
+    api = setup_api(tmp_path, useAuth=True, users={'userA':'test_pass101A', 'userB':'test_pass101B'})
+    api._api_game_register({'timestamp':0, 'game_type':0, 'winner_id':1, 'loser_id':2, 'winner_points':11, 'loser_points':7, 'sender_id':0})
+
+    # Test invalid params
+    with pytest.raises(restAPI.APIError) as apiError:
+        api._api_game_registerSwings({'user_id':1, 'game_id':0, 'speeds':5.0, 'times':[0], 'sender_id':1})
+    assert apiError.value.code == 400
+    with pytest.raises(restAPI.APIError) as apiError:
+        api._api_game_registerSwings({'user_id':1, 'game_id':0, 'speeds':[5.0, 6.0], 'times':[0], 'sender_id':1})
+    assert apiError.value.code == 400
+    with pytest.raises(restAPI.APIError) as apiError:
+        api._api_game_registerSwings({'user_id':1, 'game_id':0, 'speeds':[5.0, 6.0], 'times':[500, 100], 'sender_id':1})
+    assert apiError.value.code == 400
+    with pytest.raises(restAPI.APIError) as apiError:
+        api._api_game_registerSwings({'user_id':1, 'game_id':0, 'speeds':[-5.0], 'times':[0], 'sender_id':1})
+    assert apiError.value.code == 400
+    for speed in (1e40, 10**400):
+        with pytest.raises(restAPI.APIError) as apiError:
+            api._api_game_registerSwings({'user_id':1, 'game_id':0, 'speeds':[speed], 'times':[0], 'sender_id':1})
+        assert apiError.value.code == 400
+
+    # Test invalid user, game and permissions
+    with pytest.raises(restAPI.APIError) as apiError:
+        api._api_game_registerSwings({'user_id':3, 'game_id':0, 'speeds':[5.0], 'times':[0], 'sender_id':0})
+    assert apiError.value.code == 404
+    with pytest.raises(restAPI.APIError) as apiError:
+        api._api_game_registerSwings({'user_id':1, 'game_id':1, 'speeds':[5.0], 'times':[0], 'sender_id':1})
+    assert apiError.value.code == 404
+    with pytest.raises(restAPI.APIError) as apiError:
+        api._api_game_registerSwings({'user_id':1, 'game_id':0, 'speeds':[5.0], 'times':[0], 'sender_id':2})
+    assert apiError.value.code == 403
+
+    # Register swings, stored as a single row of 8 bytes per swing
+    assert api._api_game_registerSwings({'user_id':1, 'game_id':0, 'speeds':[5.5, 12.25, 8], 'times':[1200, 2500, 2500], 'sender_id':1}) == {'success':True}
+    assert api._api_game_registerSwings({'user_id':2, 'game_id':0, 'speeds':[], 'times':[], 'sender_id':0}) == {'success':True}
+    api._dbCursor.execute("SELECT user_id, game_id, swing_count, length(swings) FROM game_swings")
+    assert api._dbCursor.fetchall() == [(1, 0, 3, 24), (2, 0, 0, 0)]
+
+    # Attempt to register duplicate swings
+    with pytest.raises(restAPI.APIError) as apiError:
+        api._api_game_registerSwings({'user_id':1, 'game_id':0, 'speeds':[5.0], 'times':[0], 'sender_id':1})
+    assert apiError.value.code == 403
+
+
+def test_api_game_swings(tmp_path):
+    api = setup_api(tmp_path, useAuth=True, users={'userA':'test_pass101A', 'userB':'test_pass101B'})
+    api._api_game_register({'timestamp':0, 'game_type':0, 'winner_id':1, 'loser_id':2, 'winner_points':11, 'loser_points':7, 'sender_id':0})
+    speeds = [float(i % 7) for i in range(100)]
+    times = [i * 1000 for i in range(100)]
+    api._api_game_registerSwings({'user_id':1, 'game_id':0, 'speeds':speeds, 'times':times, 'sender_id':1})
+
+    # Full and downsampled series
+    assert api._api_game_swings({'user_id':1, 'game_id':0, 'points':0, 'sender_id':1}) == {'swing_count':100, 'downsampled':False, 'speeds':speeds, 'times':times}
+    assert api._api_game_swings({'user_id':1, 'game_id':0, 'sender_id':1}) == {'swing_count':100, 'downsampled':False, 'speeds':speeds, 'times':times}
+    swings = api._api_game_swings({'user_id':1, 'game_id':0, 'points':20, 'sender_id':1})
+    assert swings['downsampled'] and swings['swing_count'] == 100
+    assert len(swings['speeds']) == len(swings['times']) == 20
+    assert max(swings['speeds']) == 6.0 and swings['times'] == sorted(swings['times'])
+    assert api._api_game_swings({'user_id':1, 'game_id':0, 'points':1, 'sender_id':1}) == {'swing_count':100, 'downsampled':True, 'speeds':[6.0], 'times':[6000]}
+
+    # Test invalid params, missing swings and permissions
+    with pytest.raises(restAPI.APIError) as apiError:
+        api._api_game_swings({'user_id':1, 'game_id':0, 'points':-1, 'sender_id':1})
+    assert apiError.value.code == 400
+    with pytest.raises(restAPI.APIError) as apiError:
+        api._api_game_swings({'user_id':2, 'game_id':0, 'sender_id':2})
+    assert apiError.value.code == 404
+    with pytest.raises(restAPI.APIError) as apiError:
+        api._api_game_swings({'user_id':1, 'game_id':1, 'sender_id':1})
+    assert apiError.value.code == 404
+    with pytest.raises(restAPI.APIError) as apiError:
+        api._api_game_swings({'user_id':1, 'game_id':0, 'sender_id':2})
+    assert apiError.value.code == 403
+
+
+def test_rate_limit(tmp_path):
+    now = [0.0]
+    limiter = RateLimiter({'default':(1.0, 3), 'auth':(0.5, 2)}, max_buckets=4, clock=lambda: now[0])
+    api = restAPI(tmp_path / 'pickle.db', useAuth=True, clearDB=True, rateLimiter=limiter)
+    api._api_user_create({'username':'userA', 'password':'test_pass101A'})
+
+    # Auth endpoints use the stricter auth bucket
+    key = api.handle_request('/pickle/user/auth', {'username':'userA', 'password':'test_pass101A'}, client_addr='10.0.0.1')['apiKey']
+    api.handle_request('/pickle/user/auth', {'username':'userA', 'password':'test_pass101A'}, client_addr='10.0.0.1')
+    with pytest.raises(restAPI.APIError) as apiError:
+        api.handle_request('/pickle/user/auth', {'username':'userA', 'password':'test_pass101A'}, client_addr='10.0.0.1')
+    assert apiError.value.code == 429
+    assert apiError.value.headers == {'Retry-After':'2'}
+
+    # Other endpoints from the same address use a separate bucket
+    for i in range(3):
+        api.handle_request('/pickle/user/getStats', {'user_id':1}, key, client_addr='10.0.0.1')
+    with pytest.raises(restAPI.APIError) as apiError:
+        api.handle_request('/pickle/user/getStats', {'user_id':1}, key, client_addr='10.0.0.1')
+    assert apiError.value.code == 429
+
+    # Changing address doesn't get around the per-user bucket
+    with pytest.raises(restAPI.APIError) as apiError:
+        api.handle_request('/pickle/user/getStats', {'user_id':1}, key, client_addr='10.0.0.2')
+    assert apiError.value.code == 429
+    assert apiError.value.headers == {'Retry-After':'1'}
+
+    # Tokens refill over time
+    now[0] += 1.0
+    assert api.handle_request('/pickle/user/getStats', {'user_id':1}, key, client_addr='10.0.0.1') == {1:{'gamesPlayed':0, 'gamesWon':0, 'averageScore':0.0}}
+
+    # Least recently used buckets are evicted once over max_buckets
+    for i in range(3, 10):
+        limiter.consume('default', ('ip', f'10.0.0.{i}'))
+    assert len(limiter) == 4
+
+
+def test_api_user_logout(tmp_path):
+    api = setup_api(tmp_path, useAuth=True, users={'userA':'test_pass101A', 'userB':'test_pass101B'})
+
+    # Log in from a few devices
+    sessionsA = [api._api_user_auth({'username':'userA', 'password':'test_pass101A'}) for i in range(3)]
+    sessionB = api._api_user_auth({'username':'userB', 'password':'test_pass101B'})
+    assert api._restAPI__userSessions[1]['apiKeys'] == {session['apiKey'] for session in sessionsA}
+
+    # Renewing a key replaces it in the session index
+    renewed = api._api_user_auth_renew(sessionsA[0])
+    sessionsA[0] = renewed
+    assert api._restAPI__userSessions[1]['apiKeys'] == {session['apiKey'] for session in sessionsA}
+    assert api._restAPI__userSessions[1]['renewalKeys'] == {session['renewalKey'] for session in sessionsA}
+
+    # Test invalid params and perms
+    with pytest.raises(restAPI.APIError) as apiError:
+        api._api_user_logout({'sender_id':1})
+    assert apiError.value.code == 400
+    with pytest.raises(restAPI.APIError) as apiError:
+        api._api_user_logout({'user_id':1, 'sender_id':2})
+    assert apiError.value.code == 403
+
+    # Log out everywhere, only userA's keys are removed
+    assert api._api_user_logout({'user_id':1, 'sender_id':1}) == {'sessions':3}
+    for session in sessionsA:
+        assert api._checkApiKey(session['apiKey']) == None
+        assert session['renewalKey'] not in api._restAPI__renewalKeys
+    assert api._checkApiKey(sessionB['apiKey']) == 2
+    assert sessionB['renewalKey'] in api._restAPI__renewalKeys
+    assert 1 not in api._restAPI__userSessions
+
+    # Deleting a user removes exactly that user's keys
+    api._api_user_delete({'user_id':2, 'sender_id':0})
+    assert api._restAPI__apiKeys == {}
+    assert api._restAPI__renewalKeys == {}
+
+
+def test_api_game_import(tmp_path):
+    api = setup_api(tmp_path, useAuth=True, users={'userA':'test_pass101A', 'userB':'test_pass101B', 'userC':'test_pass101C'})
+    api._api_game_register({'timestamp':0, 'game_type':0, 'winner_id':1, 'loser_id':2, 'winner_points':11, 'loser_points':3, 'sender_id':0})
+    games = [
+        {'timestamp':1, 'game_type':0, 'winner_id':2, 'loser_id':1, 'winner_points':11, 'loser_points':8},
+        {'timestamp':2, 'game_type':0, 'winner_id':2, 'loser_id':3, 'winner_points':13, 'loser_points':11},
+        {'timestamp':3, 'game_type':0, 'winner_id':3, 'loser_id':-1, 'winner_points':11, 'loser_points':0},
+    ]
+
+    # Only admin may import
+    with pytest.raises(restAPI.APIError) as apiError:
+        api._api_game_import({'games':games, 'sender_id':1})
+    assert apiError.value.code == 403
+
+    # Invalid games reject the whole batch
+    with pytest.raises(restAPI.APIError) as apiError:
+        api._api_game_import({'games':games + [{'timestamp':4, 'game_type':0, 'winner_id':1, 'loser_id':2, 'winner_points':9, 'loser_points':3}], 'sender_id':0})
+    assert apiError.value.code == 400
+    assert apiError.value.message.startswith('Game 3:')
+    with pytest.raises(restAPI.APIError) as apiError:
+        api._api_game_import({'games':games + [{'timestamp':4, 'game_type':0, 'winner_id':5, 'loser_id':2, 'winner_points':11, 'loser_points':3}], 'sender_id':0})
+    assert apiError.value.code == 404
+    with pytest.raises(restAPI.APIError) as apiError:
+        api._api_game_import({'games':games + [games[0]], 'sender_id':0})
+    assert apiError.value.code == 403
+    with pytest.raises(restAPI.APIError) as apiError:
+        api._api_game_import({'games':games + [{'timestamp':0, 'game_type':0, 'winner_id':1, 'loser_id':2, 'winner_points':11, 'loser_points':3}], 'sender_id':0})
+    assert apiError.value.code == 403
+    with pytest.raises(restAPI.APIError) as apiError:
+        api._api_game_import({'games':games[0], 'sender_id':0})
+    assert apiError.value.code == 400
+    api._dbCursor.execute("SELECT COUNT(*) FROM games")
+    assert api._dbCursor.fetchone() == (1,)
+
+    # Valid import
+    assert api._api_game_import({'games':games, 'sender_id':0}) == {'game_ids':[1, 2, 3]}
+    assert api._api_game_get({'game_id':3}) == {3:{'timestamp':3, 'game_type':0, 'winner_id':3, 'loser_id':-1, 'winner_points':11, 'loser_points':0}}
+
+    # Stats match registering games one at a time
+    assert api._api_user_getStats({'user_id':[1,2,3], 'sender_id':0}) == {
+        1:{'gamesPlayed':2, 'gamesWon':1, 'averageScore':9.5},
+        2:{'gamesPlayed':3, 'gamesWon':2, 'averageScore':9.0},
+        3:{'gamesPlayed':2, 'gamesWon':1, 'averageScore':11.0},
+    }
+
+    # Python API with a larger batch, written in a single transaction
+    statements = []
+    api._database.set_trace_callback(statements.append)
+    game_ids = api.importGames([{'timestamp':10 + i, 'game_type':0, 'winner_id':1 + i % 3, 'loser_id':1 + (i + 1) % 3, 'winner_points':11, 'loser_points':i % 10} for i in range(20000)])
+    api._database.set_trace_callback(None)
+    assert game_ids == list(range(4, 20004))
+    assert [statement.split()[0].upper() for statement in statements if statement.split()[0].upper() in ('BEGIN', 'COMMIT', 'ROLLBACK')] == ['BEGIN', 'COMMIT']
+    api._dbCursor.execute("SELECT COUNT(*), MIN(game_id), MAX(game_id) FROM games")
+    assert api._dbCursor.fetchone() == (20004, 0, 20003)
+    assert api._api_user_getStats({'user_id':1, 'stats':['gamesPlayed'], 'sender_id':0}) == {1:{'gamesPlayed':2 + 13333}}
+
+
+def test_generate_db(tmp_path):
+    counts = database_setup.generate_db(tmp_path / 'gen.db', num_users=200, num_games=5000, avg_friends=4, stats_fraction=0.5, seed=1)
+    assert counts['users'] == 200
+    assert counts['games'] == 5000
+    assert 0 < counts['friends'] <= 400
+    assert 0 < counts['user_game_stats'] <= 2 * 5000
+
+    api = restAPI(tmp_path / 'gen.db', useAuth=True)
+    assert api._check_userAuth('gen_user_17', 'Generated_Pass1') == 17
+
+    # Generated games are valid and their aggregates match per-user recomputation
+    api._dbCursor.execute("SELECT COUNT(*) FROM games WHERE winner_id=loser_id OR winner_points<11")
+    assert api._dbCursor.fetchone() == (0,)
+    api._dbCursor.execute("SELECT COUNT(DISTINCT hash) FROM games")
+    assert api._dbCursor.fetchone() == (5000,)
+    api._dbCursor.execute("SELECT COUNT(*) FROM user_game_stats WHERE Q1_hits+Q2_hits+Q3_hits+Q4_hits != swing_hits")
+    assert api._dbCursor.fetchone() == (0,)
+    stats = api._api_user_getStats({'user_id':[1,2,3], 'sender_id':0})
+    for user_id in (1,2,3):
+        api.updateUserGameStats(user_id)
+    assert api._api_user_getStats({'user_id':[1,2,3], 'sender_id':0}) == stats
+
+    # Same seed generates the same data
+    database_setup.generate_db(tmp_path / 'gen2.db', num_users=200, num_games=5000, avg_friends=4, stats_fraction=0.5, seed=1)
+    api2 = restAPI(tmp_path / 'gen2.db', useAuth=True)
+    for query in ("SELECT winner_id, loser_id, winner_points, loser_points FROM games", "SELECT * FROM friends", "SELECT * FROM user_game_stats"):
+        api._dbCursor.execute(query)
+        api2._dbCursor.execute(query)
+        assert api._dbCursor.fetchall() == api2._dbCursor.fetchall()
+
+    # Small test database with random games
+    database_setup.setup_db(tmp_path / 'small.db', {'userA':'test_pass101A', 'userB':'test_pass101B'}, gen_games=50, seed=3)
+    api3 = restAPI(tmp_path / 'small.db', useAuth=False)
+    api3._dbCursor.execute("SELECT COUNT(*) FROM games WHERE winner_id=loser_id OR winner_id NOT IN (-1,1,2) OR loser_id NOT IN (-1,1,2)")
+    assert api3._dbCursor.fetchone() == (0,)
+    assert api3._api_user_getStats({'user_id':1})[1]['gamesPlayed'] > 0
+
+
+def test_profiler(tmp_path):
+    database_setup.setup_db(tmp_path / 'pickle.db', {'userA':'test_pass101A'})
+    profiler = RequestProfiler(random.Random(0))
+    api = restAPI(tmp_path / 'pickle.db', useAuth=False, profiler=profiler)
+
+    # Disabled by default
+    api.handle_request('/pickle/user/getStats', {'user_id':1})
+    assert profiler.status()['profiled_requests'] == 0
+
+    # Invalid settings
+    with pytest.raises(restAPI.APIError) as apiError:
+        api.handle_request('/pickle/admin/profile', {'enabled':True, 'mode':'notAMode'})
+    assert apiError.value.code == 400
+    with pytest.raises(restAPI.APIError) as apiError:
+        api.handle_request('/pickle/admin/profile', {'enabled':True, 'sample_rate':2})
+    assert apiError.value.code == 400
+    with pytest.raises(restAPI.APIError) as apiError:
+        api.handle_request('/pickle/admin/profileResults', {'format':'notAFormat'})
+    assert apiError.value.code == 400
+
+    # Profile a fraction of requests
+    api.handle_request('/pickle/admin/profile', {'enabled':True, 'sample_rate':0.5})
+    for i in range(200):
+        api.handle_request('/pickle/user/getStats', {'user_id':1})
+    assert 60 < profiler.status()['profiled_requests'] < 140
+    assert len(api.handle_request('/pickle/admin/profileResults', {'reset':True})) > 0
+    assert profiler.status()['profiled_requests'] == 0
+    assert api.handle_request('/pickle/admin/profileResults', {}) == b''
+
+    # Stack sampling of a slow endpoint
+    api.handle_request('/pickle/admin/profile', {'enabled':True, 'mode':'sample', 'sample_rate':0, 'endpoint':'user/friends'})
+    slow_friends = api._api_user_friends
+    api._routes['/pickle/user/friends'] = (lambda params: time.sleep(0.05) or slow_friends(params), api._routes['/pickle/user/friends'][1])
+    api._routes['/pickle/user/friends'][0].__name__ = '_api_user_friends'
+    api.handle_request('/pickle/user/friends', {'user_id':1})
+    api.handle_request('/pickle/user/getStats', {'user_id':1})
+
+    status = api.handle_request('/pickle/admin/profile', {'enabled':False})
+    assert status['profiled_requests'] == 1
+    assert status['samples'] > 5
+
+    stacks = api.handle_request('/pickle/admin/profileResults', {'format':'collapsed'})
+    assert all(line.startswith('user_friends;<lambda> (test_api.py:') for line in stacks.splitlines())
+
+    # Concurrent sampled requests while the sampler is running, the sampler must survive them
+    profiler.configure(True, mode='sample', sample_rate=1, interval=1e-5)
+    sampler = profiler._sampler
+    threads = [threading.Thread(target=lambda: [profiler.run('user_getStats', time.sleep, 0) for i in range(200)]) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sampler.is_alive()
+    assert profiler._active == {}
+    profiler.configure(False)
+
+    # Profiler settings and results are server state, the endpoints aren't read-only
+    assert not restAPI.ROUTES['admin_profile']['readOnly']
+    assert not restAPI.ROUTES['admin_profileResults']['readOnly']
+
+    # Without a profiler, profiling isn't available
+    api = restAPI(tmp_path / 'pickle.db', useAuth=False)
+    with pytest.raises(restAPI.APIError) as apiError:
+        api.handle_request('/pickle/admin/profile', {'enabled':True})
+    assert apiError.value.code == 404
+
+
+def test_query_recorder(tmp_path):
+    database_setup.setup_db(tmp_path / 'pickle.db', {'userA':'test_pass101A', 'userB':'test_pass101B'}, gen_games=30, seed=0)
+    recorder = QueryRecorder(slow_threshold=0)
+    api = restAPI(tmp_path / 'pickle.db', useAuth=False, queryRecorder=recorder)
+
+    # Statement shapes ignore literal values and the length of IN lists
+    assert statement_shape('SELECT * FROM games WHERE game_id IN (?, ?,?)  AND  timestamp > 5') == 'SELECT * FROM games WHERE game_id IN (?+) AND timestamp > ?'
+    assert statement_shape("SELECT user_id FROM users WHERE username='bob'") == 'SELECT user_id FROM users WHERE username=?'
+
+    # Assertion helpers
+    with recorder.capture() as queries:
+        api._api_user_getUsername({'user_id':1})
+    queries.assert_max_queries(5)
+    queries.assert_no_repeats()
+    with pytest.raises(AssertionError) as error:
+        queries.assert_max_queries(0)
+    assert 'SELECT' in str(error.value)
+
+    # N+1 detection, game/stats runs 2 queries for every game
+    with recorder.capture() as queries:
+        api._api_game_stats({'user_id':1, 'game_id':list(range(30))})
+    assert queries.repeated() == {'SELECT * FROM main.games WHERE game_id=?':30, 'SELECT * FROM main.user_game_stats WHERE game_id=? AND user_id=?':30}
+    with pytest.raises(AssertionError) as error:
+        queries.assert_no_repeats()
+    assert '30x SELECT * FROM main.games WHERE game_id=?' in str(error.value)
+
+    # Per-endpoint metrics from handle_request
+    recorder.reset()
+    api.handle_request('/pickle/user/getStats', {'user_id':1})
+    api.handle_request('/pickle/game/stats', {'user_id':1, 'game_id':list(range(30))})
+    api.handle_request('/pickle/game/stats', {'user_id':2})
+    metrics = api.handle_request('/pickle/admin/queryStats', {'reset':True})
+    assert set(metrics['endpoints']) == {'user_getStats', 'game_stats'}
+    assert metrics['endpoints']['game_stats']['requests'] == 2
+    assert metrics['endpoints']['game_stats']['max_statements'] == 60
+    assert metrics['endpoints']['game_stats']['n_plus_one'] == 1
+    assert metrics['endpoints']['user_getStats']['n_plus_one'] == 0
+    assert metrics['n_plus_one'][0]['endpoint'] == 'game_stats'
+
+    # Slow query log includes query plans
+    plans = {entry['sql']: entry for entry in metrics['slow_queries']}
+    assert plans['SELECT * FROM main.games WHERE game_id=?']['full_scan'] == False
+    assert plans['SELECT game_id FROM main.user_game_stats WHERE user_id=?']['full_scan'] == True
+    assert plans['SELECT game_id FROM main.user_game_stats WHERE user_id=?']['plan'] == ['SCAN main.user_game_stats']
+    assert set(api.handle_request('/pickle/admin/queryStats', {})['endpoints']) == {'admin_queryStats'}
+
+    # Without a recorder, query stats aren't available
+    api = restAPI(tmp_path / 'pickle.db', useAuth=False)
+    with pytest.raises(restAPI.APIError) as apiError:
+        api.handle_request('/pickle/admin/queryStats', {})
+    assert apiError.value.code == 404
+
+
+def test_api_admin_archive(tmp_path):
+    api = setup_api(tmp_path, useAuth=True, users={'userA':'test_pass101A', 'userB':'test_pass101B', 'userC':'test_pass101C'})
+    year_2021 = calendar.timegm((2021, 6, 1, 0, 0, 0))
+    year_2022 = calendar.timegm((2022, 6, 1, 0, 0, 0))
+    year_2023 = calendar.timegm((2023, 1, 1, 0, 0, 0))
+    now = int(time.time())
+
+    # Games over several years, with stats in an old game
+    games = [(year_2021, 1, 2, 3), (year_2021 + 1, 2, 1, 9), (year_2022, 1, 3, 5), (year_2022 + 1, 3, 2, 0), (now, 1, 2, 7)]
+    for timestamp, winner_id, loser_id, loser_points in games:
+        api._api_game_register({'timestamp':timestamp, 'game_type':0, 'winner_id':winner_id, 'loser_id':loser_id, 'winner_points':11, 'loser_points':loser_points, 'sender_id':0})
+    api._api_game_registerStats({'user_id':1, 'game_id':0, 'swing_count':150, 'swing_hits':90, 'swing_max':20, 'Q1_hits':23, 'Q2_hits':24, 'Q3_hits':21, 'Q4_hits':22, 'sender_id':1})
+    api._api_game_registerSwings({'user_id':1, 'game_id':0, 'speeds':[10.5, 20.0], 'times':[1000, 4000], 'sender_id':1})
+    stats_before = api._api_user_getStats({'user_id':[1, 2, 3], 'sender_id':0})
+    games_before = api._api_user_games({'user_id':1, 'sender_id':0})
+    api._api_user_addFriend({'user_id':1, 'friend_id':2, 'sender_id':1})
+    api._api_user_addFriend({'user_id':1, 'friend_id':3, 'sender_id':1})
+    friends_before = api._api_user_friends({'user_id':1, 'sender_id':1})
+    assert friends_before[2]['gamesPlayed'] == 3 and friends_before[3] == {'username':'userC', 'gamesPlayed':1, 'winRate':1.0}
+
+    # Only admin can archive
+    with pytest.raises(restAPI.APIError) as apiError:
+        api._api_admin_archive({'before':year_2023, 'sender_id':1})
+    assert apiError.value.code == 403
+
+    assert api._api_admin_archive({'before':year_2023, 'sender_id':0}) == {'archived':{2021:2, 2022:2}}
+    assert os.path.isfile(tmp_path / 'pickle_2021.db') and os.path.isfile(tmp_path / 'pickle_2022.db')
+    assert api._api_admin_archive({'before':year_2023, 'sender_id':0}) == {'archived':{}}
+    api._dbCursor.execute("SELECT game_id FROM main.games")
+    assert api._dbCursor.fetchall() == [(4,)]
+
+    # Everything is still returned, from a fresh connection
+    api.close()
+    api = restAPI(tmp_path / 'pickle.db', useAuth=True)
+    assert api._api_user_getStats({'user_id':[1, 2, 3], 'sender_id':0}) == stats_before
+    assert api._api_user_games({'user_id':1, 'sender_id':0}) == games_before
+    assert api._api_user_friends({'user_id':1, 'sender_id':1}) == friends_before
+    assert api._api_game_get({'game_id':[1, 4], 'sender_id':0})[1] == {'timestamp':year_2021 + 1, 'game_type':0, 'winner_id':2, 'loser_id':1, 'winner_points':11, 'loser_points':9}
+    assert api._api_game_stats({'user_id':1, 'sender_id':1})[0]['swing_count'] == 150
+    assert api._api_game_swings({'user_id':1, 'game_id':0, 'sender_id':1})['speeds'] == [10.5, 20.0]
+
+    # Time ranges within the hot window don't attach any archives, others only attach archives in the range
+    api.close()
+    api.openCon()
+    assert api._api_user_games({'user_id':1, 'min_time':year_2023, 'sender_id':0}) == {'game_ids':[4]}
+    assert len(api._restAPI__attached) == 0
+    assert api._api_user_games({'user_id':1, 'max_time':year_2022 - 86400 * 300, 'sender_id':0}) == {'game_ids':[0, 1]}
+    assert list(api._restAPI__attached) == ['archive_2021']
+
+    # Archives are detached when too many are needed at once
+    api.MAX_ATTACHED_ARCHIVES = 1
+    assert api._api_user_games({'user_id':3, 'sender_id':0}) == {'game_ids':[2, 3]}
+    assert api._api_game_get({'game_id':[0, 2], 'sender_id':0}).keys() == {0, 2}
+    assert len(api._restAPI__attached) == 1
+
+    # Duplicates of archived games are still detected
+    with pytest.raises(restAPI.APIError) as apiError:
+        api._api_game_register({'timestamp':year_2021, 'game_type':0, 'winner_id':1, 'loser_id':2, 'winner_points':11, 'loser_points':3, 'sender_id':0})
+    assert apiError.value.code == 403
+    with pytest.raises(restAPI.APIError) as apiError:
+        api.importGames([{'timestamp':year_2022 + 1, 'game_type':0, 'winner_id':3, 'loser_id':2, 'winner_points':11, 'loser_points':0}])
+    assert apiError.value.code == 403
+
+    # New games continue the game IDs and stats include archived games
+    assert api._api_game_register({'timestamp':now + 1, 'game_type':0, 'winner_id':3, 'loser_id':1, 'winner_points':11, 'loser_points':2, 'sender_id':0}) == {'game_id':5}
+    assert api._api_user_getStats({'user_id':3, 'sender_id':0})[3]['gamesPlayed'] == 3
+    assert api._api_user_getStats({'user_id':3, 'sender_id':0})[3]['gamesWon'] == 2
+
+    # Stats for archived games are stored in the archive
+    api._api_game_registerStats({'user_id':2, 'game_id':3, 'swing_count':100, 'swing_hits':40, 'swing_max':18, 'Q1_hits':10, 'Q2_hits':10, 'Q3_hits':10, 'Q4_hits':10, 'sender_id':2})
+    assert api._api_game_stats({'user_id':2, 'game_id':3, 'sender_id':2})[3]['swing_hits'] == 40
+    api._dbCursor.execute("SELECT COUNT(*) FROM main.user_game_stats")
+    assert api._dbCursor.fetchone() == (0,)
+
+    # Deleting a user removes their stats from archives too
+    api._api_user_delete({'user_id':1, 'sender_id':1})
+    assert api._api_game_stats({'user_id':2, 'sender_id':2}) == {3:api._api_game_stats({'user_id':2, 'game_id':3, 'sender_id':2})[3]}
+    archive = sqlite3.connect(tmp_path / 'pickle_2021.db')
+    assert archive.execute("SELECT COUNT(*) FROM user_game_stats WHERE user_id=1").fetchone() == (0,)
+    assert archive.execute("SELECT COUNT(*) FROM game_swings WHERE user_id=1").fetchone() == (0,)
+    archive.close()
@@ -0,0 +1,80 @@
+import sqlite3
+import time
+
+from database import database_setup
+from database.database_api import restAPI
+from database.database_backup import BackupScheduler
+
+def count_rows(db_path, table):
+    database = sqlite3.connect(db_path)
+    count = database.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+    database.close()
+    return count
+
+
+def test_backup_now(tmp_path):
+    db_path = tmp_path / 'pickle.db'
+    database_setup.generate_db(db_path, 200, 5000, seed=0)
+    scheduler = BackupScheduler(db_path, tmp_path / 'backups', keep=2, pages=4, step_delay=0.001)
+
+    # Writes from the API during a backup aren't blocked, and the backup is a consistent snapshot
+    api = restAPI(db_path, useAuth=False)
+    writes = []
+    def progress(status, remaining, total):
+        if len(writes) < 3:
+            writes.append(api._api_game_register({'timestamp':len(writes), 'game_type':0, 'winner_id':1, 'loser_id':2, 'winner_points':11, 'loser_points':5}))
+        BackupScheduler._progress(scheduler, status, remaining, total)
+    scheduler._progress = progress
+
+    backup = scheduler.backup_now()
+    assert len(writes) == 3
+    assert count_rows(backup, 'games') in (5000, 5003)
+    assert count_rows(backup, 'users') == 201
+    assert sqlite3.connect(backup).execute('PRAGMA integrity_check').fetchone() == ('ok',)
+    api.close()
+
+    # Retention keeps only the newest backups
+    backups = [backup, scheduler.backup_now(), scheduler.backup_now()]
+    assert scheduler.list_backups() == backups[1:]
+    assert count_rows(backups[-1], 'games') == 5003
+    assert not list((tmp_path / 'backups').glob('*.tmp'))
+
+
+def test_backup_restarts(tmp_path):
+    db_path = tmp_path / 'pickle.db'
+    database_setup.generate_db(db_path, 50, 2000, seed=0)
+    scheduler = BackupScheduler(db_path, tmp_path / 'backups', pages=4, step_delay=0, max_restarts=3)
+
+    # A write between every step keeps restarting the backup, which is then finished in a single step
+    api = restAPI(db_path, useAuth=False)
+    writes = []
+    def progress(status, remaining, total):
+        writes.append(api._api_game_register({'timestamp':len(writes), 'game_type':0, 'winner_id':1, 'loser_id':2, 'winner_points':11, 'loser_points':5}))
+        BackupScheduler._progress(scheduler, status, remaining, total)
+    scheduler._progress = progress
+
+    backup = scheduler.backup_now()
+    assert scheduler.last_restarts == 4
+    assert count_rows(backup, 'games') == 2000 + len(writes)
+    assert sqlite3.connect(backup).execute('PRAGMA integrity_check').fetchone() == ('ok',)
+    api.close()
+
+    # Backups without writes are never restarted
+    del scheduler._progress
+    scheduler.backup_now()
+    assert scheduler.last_restarts == 0
+
+
+def test_backup_schedule(tmp_path):
+    db_path = tmp_path / 'pickle.db'
+    database_setup.setup_db(db_path, {'userA':'test_pass101A'})
+
+    with BackupScheduler(db_path, tmp_path / 'backups', interval=0.05, keep=3) as scheduler:
+        time.sleep(0.3)
+    assert len(scheduler.list_backups()) == 3
+    assert scheduler.last_error is None
+
+    # Failed backups are reported without stopping the schedule
+    with BackupScheduler(tmp_path / 'missing' / 'pickle.db', tmp_path / 'backups2', interval=0.05) as scheduler:
+        time.sleep(0.1)
+    assert scheduler.last_error is not None
@@ -0,0 +1,36 @@
+import pytest
+
+from database import database_benchmark
+from database.database_api import restAPI
+
+def test_run_benchmark(tmp_path):
+    db_path = database_benchmark.build_database(tmp_path, num_users=300, num_games=2000, seed=2)
+    assert database_benchmark.build_database(tmp_path, num_users=300, num_games=2000, seed=2) == db_path
+
+    # Every case runs without API errors
+    results = database_benchmark.run_benchmark(db_path, 300, 2000, iterations=5, cold_runs=2)
+    assert set(results) == {case[0] for case in database_benchmark.BENCHMARKS}
+    assert all(timings['cold_ms'] > 0 and timings['warm_ms'] > 0 and timings['warm_p95_ms'] >= timings['warm_ms'] for timings in results.values())
+    assert all(timings['statements'] > 0 for name, timings in results.items() if name not in ('user_auth', 'user_auth_renew'))
+
+    # Every endpoint with real work is benchmarked
+    assert {case[1] for case in database_benchmark.BENCHMARKS} == set(restAPI.ROUTES) - {'coffee', 'admin_profile', 'admin_profileResults', 'admin_queryStats', 'admin_export', 'admin_archive'}
+
+    # Write benchmarks don't modify the cached database
+    api = restAPI(db_path, useAuth=False)
+    api._dbCursor.execute("SELECT COUNT(*) FROM games")
+    assert api._dbCursor.fetchone() == (2000,)
+
+def test_compare_results():
+    baseline = {'user_friends':{'cold_ms':2.0, 'warm_ms':1.0}, 'game_register':{'cold_ms':10.0, 'warm_ms':8.0}, 'removed':{'warm_ms':1.0}}
+    current = {'user_friends':{'cold_ms':2.1, 'warm_ms':1.5}, 'game_register':{'cold_ms':5.0, 'warm_ms':8.4}, 'added':{'warm_ms':1.0}}
+
+    comparison = database_benchmark.compare_results(baseline, current, threshold=0.10)
+    assert [(entry['case'], entry['metric'], entry['regression']) for entry in comparison] == [
+        ('user_friends', 'warm_ms', True),
+        ('user_friends', 'cold_ms', False),
+        ('game_register', 'warm_ms', False),
+        ('game_register', 'cold_ms', False),
+    ]
+    assert comparison[0]['change'] == pytest.approx(0.5)
+    assert comparison[3]['change'] == pytest.approx(-0.5)
@@ -0,0 +1,138 @@
+import csv
+import io
+import json
+import sqlite3
+import pytest
+import requests
+
+from database import database_setup
+from database import database_server
+from database.database_api import restAPI
+from database.database_export import ExportStream
+
+def test_export_stream(tmp_path):
+    db_path = tmp_path / 'pickle.db'
+    database_setup.generate_db(db_path, 50, 1000, stats_fraction=0.5, seed=0)
+    connection = sqlite3.connect(db_path)
+
+    # CSV export of every game, in batches
+    export = ExportStream(connection, 'games', 'csv', batch_size=64)
+    assert len(list(export)) == 16
+    rows = list(csv.reader(io.StringIO(''.join(export))))
+    assert rows[0] == ['game_id', 'timestamp', 'game_type', 'winner_id', 'loser_id', 'winner_points', 'loser_points']
+    assert [int(row[0]) for row in rows[1:]] == list(range(1000))
+    assert export.cursor == 1000
+
+    # NDJSON export of stats in a time range
+    timestamps = [row[0] for row in connection.execute('SELECT timestamp FROM games ORDER BY timestamp')]
+    min_time, max_time = timestamps[200], timestamps[399]
+    stats = [json.loads(line) for line in ''.join(ExportStream(connection, 'user_game_stats', 'ndjson', min_time, max_time)).splitlines()]
+    expected = connection.execute('SELECT COUNT(*) FROM user_game_stats JOIN games USING (game_id) WHERE timestamp BETWEEN ? AND ?', (min_time, max_time)).fetchone()[0]
+    assert len(stats) == expected > 0
+    assert all(min_time <= row['timestamp'] <= max_time for row in stats)
+    assert set(stats[0]) == {'user_id', 'game_id', 'timestamp', 'swing_count', 'swing_hits', 'swing_max', 'Q1_hits', 'Q2_hits', 'Q3_hits', 'Q4_hits'}
+
+    # User aggregates never include password data
+    users = list(csv.DictReader(io.StringIO(''.join(ExportStream(connection, 'users')))))
+    assert len(users) == 51
+    assert set(users[0]) == {'user_id', 'username', 'valid', 'gamesPlayed', 'gamesWon', 'averageScore'}
+
+    # Incremental export only includes rows added since the last cursor
+    api = restAPI(db_path, useAuth=False)
+    api._api_game_register({'timestamp':0, 'game_type':0, 'winner_id':1, 'loser_id':2, 'winner_points':11, 'loser_points':5})
+    export = ExportStream(connection, 'games', 'ndjson', since=1000)
+    assert [json.loads(line)['game_id'] for line in ''.join(export).splitlines()] == [1000]
+    assert export.cursor == 1001
+    assert ''.join(ExportStream(connection, 'games', 'csv', since=export.cursor)) == 'game_id,timestamp,game_type,winner_id,loser_id,winner_points,loser_points\n'
+
+    # Stats added after deleting the last row reuse its rowid, but are still exported after the cursor
+    stats_cursor = ExportStream(connection, 'user_game_stats').cursor
+    connection.execute('DELETE FROM user_game_stats WHERE rowid=(SELECT MAX(rowid) FROM user_game_stats)')
+    connection.commit()
+    api._api_game_register({'timestamp':1, 'game_type':0, 'winner_id':1, 'loser_id':2, 'winner_points':11, 'loser_points':5})
+    api._api_game_registerStats({'user_id':1, 'game_id':1001, 'swing_count':10, 'swing_hits':5, 'swing_max':20, 'Q1_hits':1, 'Q2_hits':1, 'Q3_hits':1, 'Q4_hits':2})
+    stats = [json.loads(line) for line in ''.join(ExportStream(connection, 'user_game_stats', 'ndjson', since=stats_cursor)).splitlines()]
+    assert [(row['user_id'], row['game_id']) for row in stats] == [(1, 1001)]
+    api.close()
+
+    # Invalid options
+    with pytest.raises(ValueError):
+        ExportStream(connection, 'friends')
+    with pytest.raises(ValueError):
+        ExportStream(connection, 'games', 'xml')
+    with pytest.raises(ValueError):
+        ExportStream(connection, 'users', min_time=0)
+    with pytest.raises(ValueError):
+        ExportStream(connection, 'users', since=0)
+
+
+def test_export_archived(tmp_path):
+    db_path = tmp_path / 'pickle.db'
+    database_setup.generate_db(db_path, 50, 1000, stats_fraction=0.5, seed=0)
+    api = restAPI(db_path, useAuth=False)
+
+    def export(table, **params):
+        return [json.loads(line) for line in ''.join(api._api_admin_export({'table':table, 'format':'ndjson', **params})).splitlines()]
+
+    timestamps = [row[0] for row in api._database.execute('SELECT timestamp FROM games ORDER BY timestamp')]
+    min_time, max_time = timestamps[200], timestamps[799]
+    games, stats = export('games'), export('user_game_stats')
+    games_in_range = export('games', min_time=min_time, max_time=max_time)
+    stats_in_range = export('user_game_stats', min_time=min_time, max_time=max_time)
+
+    # Archived games and their stats are still exported, from each archive in turn and then the current database
+    assert api.archiveGames(timestamps[600])
+    api.MAX_ATTACHED_ARCHIVES = 1
+    key = lambda row: (row['game_id'], row.get('user_id'))
+    assert sorted(export('games'), key=key) == games
+    assert sorted(export('user_game_stats'), key=key) == sorted(stats, key=key)
+    assert export('games', min_time=min_time, max_time=max_time) == games_in_range
+    assert sorted(export('user_game_stats', min_time=min_time, max_time=max_time), key=key) == sorted(stats_in_range, key=key)
+
+    # The cursor includes archived games, even once every game is archived
+    assert api._api_admin_export({'table':'games'}).cursor == 1000
+    api.archiveGames(timestamps[-1] + 1)
+    assert api._api_admin_export({'table':'games'}).cursor == 1000
+    assert export('games', since=990) == games[990:]
+    api.close()
+
+
+def test_export_endpoint(tmp_path):
+    db_path = tmp_path / 'pickle.db'
+    database_setup.setup_db(db_path, {'testUserA':'t3stUserP@ssA'}, gen_games=20, seed=0)
+
+    with database_server.PickleServer(restAPI(db_path), 8080):
+        admin_key = requests.post("http://localhost:8080/pickle/user/auth", json={'username':'admin', 'password':'root'}).json()['apiKey']
+        user_key = requests.post("http://localhost:8080/pickle/user/auth", json={'username':'testUserA', 'password':'t3stUserP@ssA'}).json()['apiKey']
+
+        response = requests.post("http://localhost:8080/pickle/admin/export", json={'table':'games'}, headers={'Authorization':f'Bearer {user_key}'})
+        assert response.status_code == 403
+
+        response = requests.post("http://localhost:8080/pickle/admin/export", json={'table':'games', 'format':'ndjson', 'since':15}, headers={'Authorization':f'Bearer {admin_key}'})
+        assert response.status_code == 200
+        assert response.headers['Content-type'] == 'application/x-ndjson'
+        assert response.headers['X-Export-Cursor'] == '20'
+        assert [json.loads(line)['game_id'] for line in response.text.splitlines()] == [15, 16, 17, 18, 19]
+
+        response = requests.post("http://localhost:8080/pickle/admin/export", json={'table':'passwords'}, headers={'Authorization':f'Bearer {admin_key}'})
+        assert response.status_code == 400
+
+
+def test_export_endpoint_failure(tmp_path, monkeypatch):
+    db_path = tmp_path / 'pickle.db'
+    database_setup.setup_db(db_path, {}, gen_games=20, seed=0)
+
+    # An export failing after its first chunk ends the response, without an error status written into the body
+    def failing_export(self):
+        yield 'game_id\n'
+        raise sqlite3.OperationalError('disk I/O error')
+    monkeypatch.setattr(ExportStream, '__iter__', failing_export)
+
+    with database_server.PickleServer(restAPI(db_path), 8080):
+        admin_key = requests.post("http://localhost:8080/pickle/user/auth", json={'username':'admin', 'password':'root'}).json()['apiKey']
+        response = requests.post("http://localhost:8080/pickle/admin/export", json={'table':'games'}, headers={'Authorization':f'Bearer {admin_key}'})
+        assert response.status_code == 200
+        assert response.text == 'game_id\n'
+
+        # The server keeps working
+        assert requests.post("http://localhost:8080/pickle/user/auth", json={'username':'admin', 'password':'root'}).status_code == 200
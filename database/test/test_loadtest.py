@@ -0,0 +1,35 @@
+from database import database_setup
+from database import database_server
+from database import database_loadtest
+from database.database_api import restAPI
+
+
+def test_run_level(tmp_path):
+    db_path = tmp_path / 'pickle.db'
+    database_setup.generate_db(db_path, 20, 200, seed=0)
+
+    with database_server.PickleServer(restAPI(db_path), 8080):
+        level = database_loadtest.run_level('http://localhost:8080', 2, 1.0, 20, seed=1)
+
+    assert level['concurrency'] == 2
+    assert level['requests'] > 0
+    assert level['throughput'] > 0
+    assert level['error_rate'] == 0
+    assert level['p50_ms'] <= level['p90_ms'] <= level['p99_ms'] <= level['max_ms']
+    assert set(level['actions']) <= set(database_loadtest.DEFAULT_MIX) | {'registerStats'}
+
+
+def test_summarize():
+    results = [('getStats', 0.001 * i, i != 10) for i in range(1, 101)]
+    summary = database_loadtest.summarize(results, 2.0)
+
+    assert summary['requests'] == 100
+    assert summary['throughput'] == 50
+    assert summary['error_rate'] == 0.01
+    assert round(summary['p50_ms']) == 51
+    assert round(summary['max_ms']) == 100
+    assert summary['actions']['getStats']['requests'] == 100
+
+    levels = [{'concurrency':1, 'throughput':100}, {'concurrency':2, 'throughput':180}, {'concurrency':4, 'throughput':185}]
+    assert database_loadtest.find_saturation(levels) == 2
+    assert database_loadtest.find_saturation(levels[:2]) is None
@@ -2,10 +2,13 @@ import time
 import pytest
 import requests
 import json
+import pstats
 
 from database import database_setup
 from database import database_server
 from database.database_api import restAPI
+from database.database_ratelimit import RateLimiter
+from database.database_profiler import RequestProfiler
 
 def setup_server(tmp_path, users=None, auth=True):
     db_path = tmp_path / 'pickle.db'
@@ -171,3 +174,50 @@ def test_auth(tmp_path):
         response = requests.post("http://localhost:8080/pickle/user/getStats", json={'user_id':2}, headers={'Authorization':f'Bearer {new_userB_key}'})
         assert response.status_code == 200
         assert '2' in response.json()
+
+def test_rate_limit(tmp_path):
+    database_setup.setup_db(tmp_path / 'pickle.db')
+    api = restAPI(tmp_path / 'pickle.db', useAuth=True, rateLimiter=RateLimiter({'auth':(0.1, 2)}))
+    with database_server.PickleServer(api, 8080):
+        # Use up the auth bucket for this address
+        for i in range(2):
+            response = requests.post("http://localhost:8080/pickle/user/auth", json={'username':'admin', 'password':'wrongPassword'})
+            assert response.status_code == 401
+
+        # Verify further attempts are rejected with Retry-After
+        response = requests.post("http://localhost:8080/pickle/user/auth", json={'username':'admin', 'password':'root'})
+        assert response.status_code == 429
+        assert 'Too many requests' in response.text
+        assert int(response.headers['Retry-After']) > 0
+
+
+def test_profiler(tmp_path):
+    database_setup.setup_db(tmp_path / 'pickle.db', {'testUserA':'t3stUserP@ssA'})
+    api = restAPI(tmp_path / 'pickle.db', useAuth=True, profiler=RequestProfiler())
+    with database_server.PickleServer(api, 8080):
+        admin_key = requests.post("http://localhost:8080/pickle/user/auth", json={'username':'admin', 'password':'root'}).json()['apiKey']
+        user_key = requests.post("http://localhost:8080/pickle/user/auth", json={'username':'testUserA', 'password':'t3stUserP@ssA'}).json()['apiKey']
+
+        # Only admin can use the profiler
+        response = requests.post("http://localhost:8080/pickle/admin/profile", json={'enabled':True}, headers={'Authorization':f'Bearer {user_key}'})
+        assert response.status_code == 403
+
+        # Profile every request to user/getStats, at runtime
+        response = requests.post("http://localhost:8080/pickle/admin/profile", json={'enabled':True, 'endpoint':'user/getStats'}, headers={'Authorization':f'Bearer {admin_key}'})
+        assert response.status_code == 200
+        assert response.json()['endpoint'] == 'user_getStats'
+
+        for i in range(3):
+            requests.post("http://localhost:8080/pickle/user/getStats", json={'user_id':1}, headers={'Authorization':f'Bearer {user_key}'})
+        requests.post("http://localhost:8080/pickle/user/friends", json={'user_id':1}, headers={'Authorization':f'Bearer {user_key}'})
+
+        # Download the results as a pstats file
+        response = requests.post("http://localhost:8080/pickle/admin/profileResults", json={'reset':True}, headers={'Authorization':f'Bearer {admin_key}'})
+        assert response.status_code == 200
+        assert response.headers['Content-type'] == 'application/octet-stream'
+
+        (tmp_path / 'results.prof').write_bytes(response.content)
+        stats = pstats.Stats(str(tmp_path / 'results.prof'))
+        functions = {func[2]: stat for func, stat in stats.stats.items()}
+        assert functions['_api_user_getStats'][1] == 3
+        assert '_api_user_friends' not in functions
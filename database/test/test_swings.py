@@ -0,0 +1,41 @@
+import pytest
+from database.database_swings import encode_swings, decode_swings, downsample_swings, BYTES_PER_SWING, MAX_SWING_SPEED
+
+
+def test_encode_swings():
+    speeds = [0, 3.5, 12.25, 30.0]
+    times = [0, 1500, 1500, 2**32 - 1]
+
+    blob = encode_swings(speeds, times)
+    assert len(blob) == 4 * BYTES_PER_SWING
+    assert blob[:4] == b'\x00\x00\x00\x00' and blob[4:8] == b'\x00\x00\x60\x40' # little-endian float32 3.5
+    assert decode_swings(blob) == (speeds, times)
+    assert decode_swings(encode_swings([], [])) == ([], [])
+
+    # Speeds are stored as float32
+    assert decode_swings(encode_swings([0.1], [0]))[0] == [pytest.approx(0.1, rel=1e-7)]
+    assert decode_swings(encode_swings([MAX_SWING_SPEED], [0]))[0] == [MAX_SWING_SPEED]
+
+    for speeds, times in (([1.0], []), ([-1.0], [0]), ([float('nan')], [0]), ([float('inf')], [0]), ([1e40], [0]), ([10**400], [0]), (['fast'], [0]), ([True], [0]),
+                          ([1.0], [-1]), ([1.0], [2**32]), ([1.0], [1.5]), ([1.0, 2.0], [10, 5])):
+        with pytest.raises(ValueError):
+            encode_swings(speeds, times)
+
+
+def test_downsample_swings():
+    speeds = [1.0, 9.0, 2.0, 3.0, 8.0, 4.0, 0.5, 5.0]
+    times = list(range(8))
+
+    # Short series are returned as-is
+    assert downsample_swings(speeds, times, 8) == (speeds, times)
+    assert downsample_swings(speeds, times, 0) == (speeds, times)
+
+    # The min and max of each bucket are kept in time order
+    assert downsample_swings(speeds, times, 4) == ([1.0, 9.0, 8.0, 0.5], [0, 1, 4, 6])
+    assert downsample_swings(speeds, times, 3) == ([9.0, 0.5], [1, 6])
+
+    # A single point is the fastest swing
+    assert downsample_swings(speeds, times, 1) == ([9.0], [1])
+
+    # Buckets of constant speed keep a single swing
+    assert downsample_swings([2.0] * 10, list(range(10)), 4) == ([2.0, 2.0], [0, 5])